@@ -2,6 +2,9 @@ import argparse
 import json
 import os
 import pickle
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import List
 
@@ -9,29 +12,198 @@ import numpy as np
 import pandas as pd
 
 from pytz import timezone
-from sqlalchemy import func, or_
+from sqlalchemy import bindparam, func, inspect, or_, union_all
 import shortuuid
 import io
+from airflow.exceptions import AirflowException
 
 from models.session import SessionLocal
 from models.accessioning import Accessioning, Aliquot, QualityControl, StatusUpdates
 
 from scripts.dependencies.table_columns import *
 
-pd.set_option("max_columns", None)  # Showing only two columns
-pd.set_option("max_rows", None)
+from merck_feed_resolver import MappingResolver, ResolverCache
+from merck_feed_mapstore import MappingStore
+from merck_feed_sharding import ShardPool, run_sharded
+from merck_feed_backend import frame_backend
+from merck_feed_checkpoint import Checkpoints, fingerprint
+from merck_feed_outputs import write_study_files
+from merck_feed_keys import KeyEncoder
+from merck_feed_schema import coerce_frame, format_report
+from merck_feed_asof import StatusTimeline, parse_as_of, utc_naive
+from merck_feed_cardinality import estimate_join, format_estimate
+from merck_feed_csv import csv_name, write_csv
+from merck_feed_upload import LocalBackend, SharePointBackend, Uploader, http_session
+from merck_feed_service import FeedService, request, serve
+from merck_feed_cold import COLD_TABLE, ColdTier
+from merck_feed_distributed import read_plan, read_shards, run_local
+from merck_feed_distributed import shard_path, write_plan, write_shard
+from merck_feed_snapshot import write_snapshot
+from merck_feed_planner import Planner, describe
+from merck_feed_layout import BIOTRACS
+from merck_feed_indexes import create_indexes, explain, full_scans, index_ddl
+from merck_feed_indexes import key_fanout, missing_indexes
+from merck_feed_connections import FeedConnections
+from merck_feed_log import DEBUG, WARNING, RowMessages, configure_logging, event
+from merck_feed_log import writer_paused
+from merck_feed_export_table import migrate as migrate_export_table
+from merck_feed_export_table import read_export, read_lineages, read_sources
+from merck_feed_export_table import read_state, replace_rows, stored_lineages
+from merck_feed_summary import DIMENSIONS, YIELD, FeedSummary
+
 pd.set_option("display.max_columns", None)
 pd.set_option("display.max_rows", None)
 
 
-db = SessionLocal()
-
-
 BASESITE = Variable.get("BIOSPHERE_SHAREPOINT_BASESITE")
 USERNAME = Variable.get("BIOSPHERE_SHAREPOINT_USERNAME")
 PASSWORD = Variable.get("BIOSPHERE_SHAREPOINT_PASSWORD")
 SUBMITTER = Variable.get("LIMS_SUBMITTER")
 
+# "object" keeps the historical NaN -> None frames, "arrow" keeps query results in
+# Arrow-backed nullable columns until the CSV boundary
+EXTRACT_BACKEND = Variable.get("MERCK_FEED_EXTRACT_BACKEND", default_var="object")
+ARROW_FETCH_SIZE = 50000
+# Persisted decisions for facility / source / container values missing from the maps
+RESOLVER_CACHE_PATH = Variable.get("MERCK_FEED_RESOLVER_CACHE", default_var=None)
+# "on" substitutes close matches for those values; otherwise they are only
+# reported for review and pass through unchanged
+RESOLVER_SUBSTITUTE = (
+    Variable.get("MERCK_FEED_RESOLVER_SUBSTITUTE", default_var="off") == "on"
+)
+# Versioned mapping store (JSON) and the memory-mapped artifact compiled from
+# it; edits to the store are picked up at the start of the next run. Relative
+# paths are taken from this script's directory, not the working directory
+MAPPINGS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    Variable.get("MERCK_FEED_MAPPINGS", default_var="merck_feed_mappings.json"),
+)
+MAPPINGS_ARTIFACT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    Variable.get("MERCK_FEED_MAPPINGS_ARTIFACT", default_var="merck_feed_mappings.bin"),
+)
+# > 1 shards acc / ali / qc validation by inventory_code across a process pool
+VALIDATION_WORKERS = int(Variable.get("MERCK_FEED_VALIDATION_WORKERS", default_var=1))
+# Stage checkpoints per execution_date; resume "retry" (Airflow try > 1), "always" or "never"
+CHECKPOINT_DIR = Variable.get("MERCK_FEED_CHECKPOINT_DIR", default_var=None)
+RESUME_MODE = Variable.get("MERCK_FEED_RESUME", default_var="retry")
+CHANGE_COLUMNS = ["updated_on", "date_updated", "created_on", "aliquot_created_on"]
+# Sampling for previews: N accessions per (study, status, source) stratum and / or
+# an explicit comma separated list of Specimen IDs, always with their lineage
+SAMPLE_PER_STRATUM = int(Variable.get("MERCK_FEED_SAMPLE_PER_STRATUM", default_var=0))
+SAMPLE_IDS = [
+    code.strip()
+    for code in Variable.get("MERCK_FEED_SAMPLE_IDS", default_var="").split(",")
+    if code.strip()
+]
+# Per-study output files (one per Study Number and INV / NINV) with a manifest
+STUDY_OUTPUT_DIR = Variable.get("MERCK_FEED_STUDY_OUTPUT_DIR", default_var=None)
+OUTPUT_WORKERS = int(Variable.get("MERCK_FEED_OUTPUT_WORKERS", default_var=8))
+# Pre-joined merck_feed_export table: "off", "refresh" (incremental refresh, then
+# read it) or "read" (only scan the table)
+EXPORT_TABLE_MODE = Variable.get("MERCK_FEED_EXPORT_TABLE", default_var="off")
+# Coerce extracted tables to the declared *_SCHEMA types at ingest
+INGEST_SCHEMA = Variable.get("MERCK_FEED_INGEST_SCHEMA", default_var="off") == "on"
+# Engine for the su dedupe and the join chain: "pandas" or "polars" (same
+# output bytes, see merck_feed_backend)
+FRAME_BACKEND = Variable.get("MERCK_FEED_FRAME_BACKEND", default_var="pandas")
+# Lineages that are all "Exhausted" and unchanged for COLD_TIER_DAYS are kept
+# as finished export rows under COLD_TIER_DIR instead of being re-extracted
+COLD_TIER_DIR = Variable.get("MERCK_FEED_COLD_TIER_DIR", default_var=None)
+COLD_TIER_DAYS = int(Variable.get("MERCK_FEED_COLD_TIER_DAYS", default_var=30))
+# Point-in-time exports, e.g. "2023-01-31" or "2023-01-01..2023-01-31" (daily)
+AS_OF = parse_as_of(Variable.get("MERCK_FEED_AS_OF", default_var=""))
+AS_OF_DIR = Variable.get("MERCK_FEED_AS_OF_DIR", default_var="as_of")
+# Merges are expected many-to-one; when duplicated right keys multiply the
+# output above this ratio (to the rows of a join without them) the offending
+# keys are reported ("warn") or the run fails ("block")
+FANOUT_LIMIT = float(Variable.get("MERCK_FEED_FANOUT_LIMIT", default_var=1.0))
+FANOUT_ACTION = Variable.get("MERCK_FEED_FANOUT_ACTION", default_var="warn")
+# Written CSVs: "gzip" / "zstd" compress them (.gz / .zst), otherwise plain
+CSV_COMPRESSION = Variable.get("MERCK_FEED_CSV_COMPRESSION", default_var=None)
+CSV_WORKERS = int(Variable.get("MERCK_FEED_CSV_WORKERS", default_var=4))
+# "sharepoint" uploads to the MERCK_FEED_UPLOAD_TARGET folder of BASESITE,
+# "local" copies into that directory instead
+UPLOAD_BACKEND = Variable.get("MERCK_FEED_UPLOAD_BACKEND", default_var="off")
+UPLOAD_TARGET = Variable.get("MERCK_FEED_UPLOAD_TARGET", default_var=None)
+UPLOAD_STATE = Variable.get("MERCK_FEED_UPLOAD_STATE", default_var=None)
+UPLOAD_WORKERS = int(Variable.get("MERCK_FEED_UPLOAD_WORKERS", default_var=4))
+SERVICE_SOCKET = Variable.get(
+    "MERCK_FEED_SERVICE_SOCKET", default_var="/tmp/merck_feed.sock"
+)
+SERVICE_INTERVAL = int(Variable.get("MERCK_FEED_SERVICE_INTERVAL", default_var=300))
+# Last export kept queryable for merck_feed_snapshot (see its CLI)
+SNAPSHOT_DIR = Variable.get("MERCK_FEED_SNAPSHOT_DIR", default_var=None)
+# Dashboard aggregates kept current with the export (see merck_feed_summary)
+SUMMARY_DIR = Variable.get("MERCK_FEED_SUMMARY_DIR", default_var=None)
+# Fan-out by accession (lineage) hash: SHARDS shard tasks, run in-process
+# by SHARD_WORKERS forked workers unless the DAG maps "shard" tasks itself
+SHARDS = int(Variable.get("MERCK_FEED_SHARDS", default_var=0))
+SHARD_DIR = Variable.get("MERCK_FEED_SHARD_DIR", default_var="shards")
+SHARD_WORKERS = int(Variable.get("MERCK_FEED_SHARD_WORKERS", default_var=SHARDS or 1))
+# "on" lets merck_feed_planner pick the extraction backend, fetch size,
+# validation workers and shards per run, within these budgets
+PLANNER = Variable.get("MERCK_FEED_PLANNER", default_var="off") == "on"
+PLANNER_HISTORY = Variable.get(
+    "MERCK_FEED_PLANNER_HISTORY", default_var="planner_history.json"
+)
+MEMORY_BUDGET_MB = int(Variable.get("MERCK_FEED_MEMORY_BUDGET_MB", default_var=4096))
+CPU_BUDGET = int(Variable.get("MERCK_FEED_CPU_BUDGET", default_var=os.cpu_count()))
+PLANNER_SAMPLE_ROWS = 1000
+# Execution settings of a run: the configured ones above, or what the planner
+# chose for that run (see run_settings); passed down, never rebound
+SETTINGS = {
+    "backend": EXTRACT_BACKEND,
+    "fetch_size": ARROW_FETCH_SIZE,
+    "validation_workers": VALIDATION_WORKERS,
+    "shards": SHARDS,
+    "shard_workers": SHARD_WORKERS,
+    "schema": INGEST_SCHEMA,
+    "frames": FRAME_BACKEND,
+}
+# Feed events below this level are not written (see merck_feed_log)
+LOG_LEVEL = Variable.get("MERCK_FEED_LOG_LEVEL", default_var="INFO")
+configure_logging(LOG_LEVEL)
+# Extraction reads go to the replica when set (primary if it does not
+# answer); each database gets a bounded pool of DB_POOL_SIZE connections,
+# which is also how many tables are extracted at once
+REPLICA_URL = Variable.get("MERCK_FEED_REPLICA_URL", default_var=None)
+DB_POOL_SIZE = int(Variable.get("MERCK_FEED_DB_POOL_SIZE", default_var=4))
+DB_POOL_TIMEOUT = int(Variable.get("MERCK_FEED_DB_POOL_TIMEOUT", default_var=30))
+# Seconds, 0 for none
+DB_STATEMENT_TIMEOUT = int(
+    Variable.get("MERCK_FEED_DB_STATEMENT_TIMEOUT", default_var=0)
+)
+CONNECTIONS = FeedConnections(
+    SessionLocal.kw["bind"].url,
+    REPLICA_URL,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_STATEMENT_TIMEOUT,
+    ARROW_FETCH_SIZE,
+)
+# Session of the current run, see end_run
+db = CONNECTIONS.session()
+# Composite indexes the feed's access paths need (see the "indexes"
+# command): the client filter first, then the join / dedupe keys, and one per
+# change column for the changed-code lookups of export table refreshes
+FEED_INDEXES = [
+    (Accessioning, ["client", "inventory_code"]),
+    (Aliquot, ["client", "inventory_code"]),
+    (Aliquot, ["client", "ultimate_parent"]),
+    (QualityControl, ["client", "inventory_code"]),
+    (StatusUpdates, ["client", "inventory_code", "date_updated"]),
+] + [
+    (model, ["client", column])
+    for model in (Accessioning, Aliquot, QualityControl, StatusUpdates)
+    for column in CHANGE_COLUMNS
+    if hasattr(model, column)
+]
+UPLOAD_FILES = {
+    "main_inv": "BioTRACS_Merck_INV_Sampled",
+    "main_ninv": "BioTRACS_Merck_NINV_Sampled",
+}
+
 MAPPING = {}
 
 ACC_MAPPING = {
@@ -85,6 +257,70 @@ SU_MAPPING = {
     "disposed_date": "Terminal Date",
 }
 
+# Declared ingest types, ORM columns and meta keys alike (see merck_feed_schema)
+ACC_SCHEMA = {
+    "id": "int",
+    "client": "category",
+    "inventory_code": "string",
+    "analysis_type": "string",
+    "assay": "string",
+    "draw_date": "datetime",
+    "draw_time": "string",
+    "created_on": "datetime",
+    "status": "string",
+    "site_name": "string",
+    "origination_facility": "string",
+    "destination_facility": "string",
+    "randomization_id": "string",
+    "screening_number": "string",
+    "date_received": "datetime",
+    "site": "int",
+    "comments": "string",
+    "source": "string",
+    "specimen_type": "string",
+    "study_name": "string",
+    "ruid": "string",
+    "family_id": "string",
+    "container_type": "string",
+}
+
+ALI_SCHEMA = {
+    "id": "int",
+    "client": "category",
+    "inventory_code": "string",
+    "parent_barcode": "string",
+    "ultimate_parent": "string",
+    "status": "string",
+    "ruid": "string",
+    "container_type": "string",
+    "aliquot_created_on": "datetime",
+    "source": "string",
+    "specimen_type": "string",
+}
+
+QC_SCHEMA = {
+    "id": "int",
+    "client": "category",
+    "inventory_code": "string",
+    "concentration": "float",
+    "concentration_unit": "string",
+    "vol_avg": "float",
+    "volume_unit": "string",
+    "260_280": "float",
+}
+
+SU_SCHEMA = {
+    "id": "int",
+    "client": "category",
+    "inventory_code": "string",
+    "status": "string",
+    "site_name": "string",
+    "stored_date": "datetime",
+    "shipped_date": "datetime",
+    "disposed_date": "datetime",
+    "date_updated": "datetime",
+}
+
 STATUS_MAP = {
     "Stored": "In Inventory",
     "Shipped": "In Transit",
@@ -99,192 +335,6 @@ STATUS_MAP = {
     "InProcess": "In Inventory",
 }
 
-FACILITY_MAP = {
-    "MSD-ATC Pharma": "Site",
-    "LabCorp Drug Development-Europe": "Lab Corp",
-    "LabCorp Drug Development-USA": "Lab Corp",
-    "MSD- SGS Belgium": "site",
-    "LabCorp Drug Development - Asia": "Lab Corp",
-    "MSD - UZ Leuven - Campus Gasthuisberg": "Site",
-    "MSD-UZGent-Drug Research Unit Ghent": "Site",
-    "MSD-CCP Leuven": "Site",
-    "MSD - Belgium": "site",
-    "MSD-Collaborative NeuroScience Network": "Site",
-    "MSD-Clinical Pharmacology of Miami": "Site",
-    "MSD- UZ Gent-Drug": "Site",
-    "MSD-MD Clinical": "Site",
-    "MSD-Clinical Research Hospital Tokyo": "Site",
-    "MSD-Medical Corp Heishinkai OPHAC Hos": "Site",
-    "MSD-Yale University": "Site",
-    "MSD-Thomas Jefferson University": "Site",
-    "MSD - Profil Institute for Clinical Research": "Site",
-    "MSD-SGS Clinical Pharmacology Unit": "Site",
-    "MSD-Research Centers of America LLC": "Site",
-    "Celerion-Nebraska": "Celerion",
-    "UZ Leuven - Campus Gasthuisber": "Site",
-    "MSD - Japan": "MSD - Japan",
-    "MSD-Collaborative Neuroscience Research LLC": "Site",
-    "MSD-P-One Clinic": "Site",
-    "MSD- UZ Ghent": "Site",
-    "MSD-UZ GENT": "Site",
-    "MSD-SGS Belgium": "Site",
-    "MSD-Hassman Research Institute Marlton Site": "Site",
-    "MSD-Hassman Research Insitute": "Site",
-    "MSD-Genesis Clinical Research": "Site",
-    "MSD-Jasz Nagykun Szolnok Megyei Hetenyi": "Site",
-    "MSD-BioKinetic Clinical Applications": "Site",
-    "Coriell Institute Med Research": "Site",
-    "MSD-QPS Miami Reaearch Associates": "QPS",
-    "MSD-AMR-NOCCR": "Site",
-    "Celerion-Arizona": "Celerion",
-    "MSD-PRA Health Sciences Research Martini": "ICON",
-    "MSD-Advanced Pharma CR, LLC": "Site",
-    "Drug Research Unit Gent": "Site",
-    "SGS Life Science Services": "Site",
-    "Worldwide Clinical Trials": "Site",
-    "MSD - Hospital Brotonneau": "Site",
-    "Hiroshima Allergy & Respiratory Clinic": "Site",
-    "Takahashi Clinic": "Site",
-    "MSD-hVIVO Queen Mary Centre": "hVIVO Services Limited",
-    "MSD-Republican Clinical Hospital of Moldova": "Site",
-    "MSD-Chaim Sheba Medical Center": "Site",
-    "MSD-Hospital Universitario Central de Asturias": "Site",
-    "MSD- Hospital Universitario de Asturias": "Site",
-    "MSD-H.U Vall de Hebron": "Site",
-    "MSD": "site",
-    "MSD - Spain": "MSD - Spain",
-    "MSD-Hospital Puerta de Hierro": "Site",
-    "MSD-Hospital Universitario Insular DE G": "Site",
-    "Koukokukai Ebisu Medical Clinic": "Site",
-    "Q2 Solutions-Clinica De Neumologia": "Q2",
-    'Alergologiczno-Internis "All-Med"': "Site",
-    "MSD-New Orleans Center for Clinical Research": "Site",
-    "MSD-Vince and Associates Clin Research Associates": "Site",
-    "MSD-Liege- A.T.C. S.a.": "Site",
-    "Brooks Life Sciences": "Azenta",
-    "Koizumi Pulmonology & Internal Medicine Clinic": "Site",
-    "MSD-Houston,TX": "site",
-    "Keikokai Medical": "Site",
-    "MSD Pulmonary Associates": "Site",
-    "Uni. Szpital Kliniczny NR 1": "Site",
-    "Nzoz Centrum Badan Klinicznych": "Site",
-    "Sekino Hospital": "Site",
-    "Q2 Solutions, Karl Bremer Hospital": "Q2",
-    "Centrum Medycyny Oddechowej": "Site",
-    "Q2 Solutions, Synexus Helderberg Clinical Trials": "Q2",
-    "Kanazawa Municipal Hospital": "Site",
-    "Shibasaki Internal Medicine and Pediatrics Clinic": "Site",
-    "Q2 Solutions, Engelbrecht Research": "Q2",
-    "Medical Corporation Ocrom Clinic": "Site",
-    "Lung Clinical Research Unit": "Site",
-    "Kawarada Clinic": "Site",
-    "Doujin Memorial Medical Foundation": "Site",
-    "Tosei General Hospital": "Site",
-    "Idaimae Minamiyojo Int Clinic": "Site",
-    "Profil Institute for Clinical Research, Inc.": "Site",
-    "MSD - London": "site",
-    "Karl Bremer Hospital - Tiervlei Trial Centre": "Site",
-    "University Teknologi Mara": "Site",
-    "Hiramatsu Internal & Respiratory Medicine": "Site",
-    "Q2 Solutions - SHOP 6, Freeway Plaza": "Q2",
-    "Nakatani Hospital": "Site",
-    "Kikuchi Clinic": "Site",
-    "Yamazaki Internal Medicine Clinic": "Site",
-    "Q2 Solutions - Dr. Servet Menendez": "Q2",
-    "Hospital Taiping": "Site",
-    "Osaki Internal and Respiratory Clinic": "Site",
-    "Q2 Solutions - Dr. Gerardo Martinez": "Q2",
-    "Tokyo Center Clinic": "Site",
-    "Medical Corp Tohda Clinic": "Site",
-    "Yokohama City Minato Red Cross Hospital": "Site",
-    "Funaijibiinkoka Clinic": "Site",
-    "Worldwide Clinical Trials Early Phase Ser LLC": "Site",
-    "MSD - OLV Aalst": "Site",
-    "MSD-Prism  Research": "Site",
-    "MSD - Boston": "MRL - Boston",
-    "Otogenetics": "Site",
-    "Northside Hospital": "Site",
-    "BGI CHOP": "BGI",
-    "Showa University Hospital": "Site",
-    "Pharmaron CPC": "Site",
-    "IPS": "Flagship Biosciences",
-    "MSD - Berlin": "Site",
-    "MSD-Gent": "Site",
-    "Universitair Ziekenhuis Gent": "Site",
-    "Novum Pharma Research": "Site",
-    "MSD- Centre Hospitalier Universitaire de Liege": "site",
-    "MERCK-Maccabi Healthcare Services": "Site",
-    "Kouwakai Kouwa Medical Clinic": "Site",
-    "Kono Medical Clinic": "Site",
-    "Kaiseikai Kita Shin Yokohama Internal Medicine Clinic": "Site",
-    "Kinki University Hospital": "Site",
-    "National Mie Hospital": "Site",
-    "Q2 Solutions - Dr. Guerra Mejia": "Q2",
-    "Jalan Taming Sari": "Site",
-    "Inobefunai Clinic": "Site",
-    "MSD - Orlando Clinic Research Center": "Site",
-    "Altasciences": "Site",
-    "Merck Sharp & Dohme, Corp. Oita University Hospital": "Site",
-    "MSD-Oita": "Site",
-    "MSD-QPS": "QPS",
-    "MSD-Clinilabs, INC.": "Site",
-    "MSD - Department of Medica - Calvary Mater Newcastle": "Site",
-    "MSD - Clinilabs Inc.": "Site",
-    "MSD-Charite Research(GmbH)": "Site",
-    "MSD-Hospital General Universitario 12 de Octubre": "Site",
-    "MSD - Altasciences Kansas City": "Site",
-    "MSD - Singapore": "site",
-    "MSD-Univeritair Ziekenhuis Gent": "Site",
-    "MSD-Charite Research Organisation GmbH": "Site",
-    "Q2 Solutions - Inglewood": "Q2",
-    "MSD-Charity-Universitaetsmedizin": "Site",
-    "MSD-ProSciento Inc.": "Site",
-    "MSD-AMR-Lexington": "Site",
-    "MSD-Medstar Good Samaritan Hospital": "Site",
-    "MSD-Massachusetts General Hospital": "Site",
-    "MSD - ProSciento Inc.": "Site",
-    "MSD-PRA Health Sciences": "ICON",
-    "MSD-Beth Israel Deaconess Medical Center": "Site",
-    "MSD - Karolinska University Hospital": "Site",
-    "MSD - Israel": "Site",
-    "MSD- Orszagos Koranyi TBC es Pulmonologiai Intezet": "Site",
-    "MSD- University of Colorado": "Site",
-    "Monogram Biosciences": "Monogram",
-    "MSD-Oncology Institute": "Site",
-    "MSD-Tibor Csoszi": "Site",
-    "MSD-Hospital General Universitario": "Site",
-    "MSD-Petz Aladar Megyei Oktato Korhaz": "Site",
-    "MSD-Weinberg Cancer Institute": "Site",
-    "MSD-CISSSMC-Hospital Charles-LeMoyne": "Site",
-    "MSD-Cancer Centre of Ontario": "Site",
-    "MSD-Global Central Labs": "Site",
-    "MSD-San Antonio": "Site",
-    "Covance CRU": "Lab Corp",
-    "MSD-Woodland Research Northwest LLC": "Site",
-    "MSD-Centre for the Evaluation of Vaccination": "Site",
-    "Quest Clinical Research": "Q2",
-    "MSD-CHRU Lille": "Site",
-    "Celerion-Nebraska 2": "Celerion",
-    "MSD - Beth Israel Deaconess Medical Center": "Site",
-    "MSD-California Clinical Trails Medical Group": "Site",
-    "MSD-Velocity Clinical Research": "Site",
-    "MSD-Arensia Exploratory Medicine-Clinical Nephro": "Site",
-    "MSD-Texas Liver Institute": "Site",
-    "MSD-MD Clinical Miami": "Site",
-    "Merck Sharp & Dohme, CORP.": "Merck",
-    "Shinjo Naika Clinic": "Site",
-    "MSD-Dana Farber Cancer Institute": "Site",
-    "Merck Sharp & Dohme- Hungary": "?",
-    "MSD-AOUS, Immunoterapia Oncologia": "Site",
-    "MSD-Kingston General Hospital": "Site",
-    "MSD-Celerion": "Celerion",
-    "Interpace Pharma Solutions": "Flagship Biosciences?",
-    "Research Centurion": "Site",
-    "MSD-QPS-MRA, LLC-Early Phase": "QPS",
-    "MSD-Maccabi": "Site",
-    "MSD-SCRI": "Site",
-}
-
 REQUIRED = [
     "Analysis Type",
     "Created Date",
@@ -297,55 +347,6 @@ REQUIRED = [
     "Vendor",
 ]
 
-ALL_COLUMNS = [
-    "Analysis Type",
-    "Assay",
-    "Biopsy Accession ID",
-    "Biopsy Anatomic Location",
-    "Biopsy Collection Method",
-    "Collection Date",
-    "Created Date",
-    "Current Status",
-    "Destination Facility",
-    "Fixation Method",
-    "Lesion Type",
-    "Nucleic Acid Concentration",
-    "Nucleic Acid Volume",
-    "Nucleic Acid Yield",
-    "Origination Facility",
-    "Parent Specimen ID",
-    "Pre/Post Treatment",
-    "Randomization ID",
-    "Received Date",
-    "Screening ID",
-    "Shipped Date",
-    "Site ID",
-    "Slide Thickness",
-    "Slides Sectioned Date",
-    "Specimen Comments",
-    "Specimen Fixation Date",
-    "Specimen ID",
-    "Specimen Tissue Category",
-    "Specimen Type",
-    "Study Number",
-    "Terminal Date",
-    "Terminal Date_su",
-    "Vendor",
-    "Vendor Specimen ID",
-    "Visit",
-    "Diagnosis Confirmed",
-    "Biopsy Lesion Injection Status",
-    "Time from Tissue Excision to Immersion in Fixative",
-    "Fixation Time",
-    "Institutional Block or Slide ID",
-    "Time Specimen Placed in Fixative",
-    "Number of Slides Submitted",
-    "Collection Time",
-    "Purity",
-    "Type of Biopsy Sample Taken",
-    "Container Type",
-]
-
 ANALYSIS_MAPPING = {
     "RNA analysis": "RNA Analysis",
     "Genetic Anaylsis": "Genetic Analysis",
@@ -373,603 +374,6 @@ ANALYSIS_MAPPING = {
     "RNA Analysis ": "RNA Analysis",
 }
 
-SOURCE_MAPPING = {
-    "10 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "10 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "10.0 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "10.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "10.0mL Paxgene DNA": "Whole Blood EDTA - DNA",
-    "2mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "BC": "Buffy Coat",
-    "BUC": "Buccal Swab",
-    "d": "Whole Blood PAXgene - DNA",
-    "DNA-BUC": "DNA (Buccal Swab)",
-    "DNA-EP": "DNA",
-    "DNA-Saliva": "DNA (Saliva)",
-    "DNA-WB": "DNA",
-    "EP-DNA	": "DNA",
-    "PL": "Plasma",
-    "RNA-EP": "RNA",
-    "RNA-WB": "RNA",
-    "S": "Saliva",
-    "Whole Blood": "Whole Blood EDTA - DNA",
-    "Whole Blood PAXgene - DNA": "Whole Blood PAXgene - DNA",
-    "TISDGHRT": "Tissue",
-    "EPPL": "Plasma",
-    "DNA-EPCACL": "DNA",
-    "DNA-EPCP": "DNA",
-    "DNA-EPMCACL": "DNA",
-    "DNA-EPPL": "DNA",
-    "DNA-LCL": "DNA",
-    "EPCACL": "DNA",
-    "EPCL": "DNA",
-    "EPMCACL": "DNA",
-    "LCL": "DNA",
-    "TISBST": "Tissue",
-    "TISHMTH": "Tissue",
-    "TISLUNG": "Tissue",
-    "TISOVY": "Tissue",
-    "TISSTM": "Tissue",
-}
-
-SPECIMEN_MAPPING = {
-    "10 mL EDTA": "Whole Blood EDTA - DNA",
-    "10 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "10 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "10 mL PAXgne RNA": "Whole Blood PAXgene - RNA",
-    "10 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "10.0 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "10.0 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "10.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "10.0 mL Streck Tan BCT": "Blood",
-    "10.0 Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "10.0 Purple Top Tube": "Whole Blood EDTA - DNA",
-    "10.0mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "10.0mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "10.0mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "10mL PAXgene DNA tube": "Whole Blood PAXgene - DNA",
-    "10mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "11 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "11 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "11 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "12 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "12 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "12 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "13 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "13 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "13 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "14 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "14 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "14 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "15 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "15 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "15 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "16 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "16 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "16 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "17 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "17 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "17 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "18 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "18 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "18 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "19 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "19 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "19 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "2.0 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "2.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "2.0mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "2.5 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "20 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "20 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "20 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "21 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "21 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "21 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "22 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "22 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "22 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "23 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "23 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "23 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "24 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "24 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "24 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "25 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "25 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "25 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "26 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "26 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "26 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "27 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "27 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "27 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "28 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "28 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "28 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "29 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "29 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "29 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "2mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "3.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "30 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "30 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "30 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "31 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "31 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "32 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "32 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "33 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "33 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "34 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "34 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "35 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "35 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "36 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "36 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "37 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "37 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "38 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "38 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "39 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "39 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "4.0 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "4.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "4.0 mL Purple Top Tubes": "Whole Blood EDTA - DNA",
-    "4.0 mL Purple TopTube": "Whole Blood EDTA - DNA",
-    "40 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "40 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "41 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "41 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "42 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "42 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "43 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "43 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "44 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "44 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "45 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "45 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "46 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "46 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "47 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "47 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "48 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "48 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "49 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "49 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "50 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "50 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "51 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "51 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "52 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "52 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "53 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "53 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "54 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "54 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "55 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "55 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "56 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "56 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "57 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "57 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "58 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "59 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "6.0 mL EDTA DNA": "Whole Blood EDTA - DNA",
-    "6.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "6.0mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "60 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "61 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "62 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "63 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "64 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "65 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "10 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "10 mL PAXgene DNA": "Whole Blood PAXgene - DNA",
-    "10 mL Paxgene RNA": "Whole Blood PAXgene - RNA",
-    "10 mL PAXgene RNA": "Whole Blood PAXgene - RNA",
-    "10 mL Purple Top Tube DNA": "Whole Blood EDTA - DNA",
-    "10.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "10.0 mL Streck Tan BCT": "Whole Blood - Streck Plasma",
-    "2.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "3.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "3.0 mL Purple Top Tube DNA": "Whole Blood EDTA - DNA",
-    "4 mL Paxgene DNA": "Whole Blood PAXgene - DNA",
-    "4.0 mL Purple Top Tube": "Whole Blood EDTA - DNA",
-    "4.0 mL Purple Top Tube DNA": "Whole Blood EDTA - DNA",
-    "6.0 mL Purple Top Tube DNA": "Whole Blood EDTA - DNA",
-    "BloodSpotCard": "Blood Spot Card",
-    "Micronic 1.4": "use Source Matcode mapping",
-    "Sarstedt 2.0": "request Specimen Type from Merck",
-    "Sarstedt 5.0": "request Specimen Type from Merck",
-    "EPPL": "Plasma",
-    "DNA-EPCACL": "DNA",
-    "DNA-EPCP": "DNA",
-    "DNA-EPMCACL": "DNA",
-    "DNA-EPPL": "DNA",
-    "DNA-LCL": "DNA",
-    "EPCACL": "DNA",
-    "EPCL": "DNA",
-    "EPMCACL": "DNA",
-    "LCL": "DNA",
-    "TISBST": "Tissue",
-    "TISHMTH": "Tissue",
-    "TISLUNG": "Tissue",
-    "TISOVY": "Tissue",
-    "TISSTM": "Tissue",
-}
-
-SPECIMEN_MAPPING = {
-    **SPECIMEN_MAPPING,
-    **{key.lower(): value for key, value in SPECIMEN_MAPPING.items()},
-}
-
-ANALYSIS_TYPES = set(
-    [
-        "Virology",
-        "Viremia",
-        "Viral Shedding",
-        "Viral Resistance",
-        "UGT2B17 Genotyping",
-        "TOR-BMx",
-        "T-cell Repertoire (TCR)",
-        "T-cell Evaluation",
-        "Targeted Genotyping",
-        "TARC",
-        "sILT3",
-        "RT-PCR (Zika)",
-        "RT-PCR (Chikungunya)",
-        "RT-PCR",
-        "RSV A and B Ab Titers",
-        "RSV (SNAb)",
-        "RNA Analysis",
-        "Receptor Occupancy",
-        "Pneumococcal Serotype Eval",
-        "Pneumococcal Poly Shed Assess",
-        "Pneumococcal Immunogenicity Assay",
-        "Pneumococcal Colonization Assess",
-        "PK-REL IMI",
-        "PK-REL",
-        "PK-MK8591",
-        "PK-MK8558",
-        "PK-MK3402",
-        "PK-M9",
-        "PK-LNG",
-        "PK-Fluoride",
-        "PK-FEP",
-        "PK-EE",
-        "PK - ISL",
-        "PK - IRL",
-        "PK - DOR",
-        "PK",
-        "PD-L1",
-        "PBMC",
-        "MSI",
-        "mRNA Profiling",
-        "miRNA",
-        "Metagenomics",
-        "Metabolomics",
-        "Metabolome",
-        "MDSC Assay",
-        "Leukapheresis",
-        "Legacy",
-        "Influenza Immunogenicity Assay",
-        "Immunophenotyping",
-        "Immunogenicity Assay (MOPA)",
-        "Immunogenicity Assay (MOPA 2)",
-        "Immunogenicity Assay (MOPA 1)",
-        "Immunogenicity Assay (Hep B)",
-        "Immunogenicity Assay (ECL)",
-        "Immunogenicity Assay",
-        "Immunogenicity (Spike IgG)",
-        "Immunogenicity (Residual)",
-        "Immunogenicity (Nab)",
-        "Immune Profiling (Heparin)",
-        "Immune Profiling",
-        "IL-10",
-        "HPV Type",
-        "HLA",
-        "HIV-1 RNA",
-        "HIV-1 Drug Resistance",
-        "HCV RNA",
-        "HCV Genotyping",
-        "Genetic Analysis (Buccal Swab)",
-        "Genetic Analysis",
-        "Future Biomedical Research (Saliva)",
-        "Future Biomedical Research (Buccal Swab)",
-        "Future Biomedical Research",
-        "Fresh Tumor Tissue Collection",
-        "EBV DNA",
-        "DNA Seq",
-        "Cytokines",
-        "CYP2C9 Genotyping",
-        "ctDNA EGFR/ALK",
-        "ctDNA (specific)",
-        "ctDNA",
-        "CTC - Exploratory",
-        "CTC",
-        "Correlative",
-        "CMV - DNA",
-        "Citrate Coagulation",
-        "C. Difficile",
-        "Bone Marrow (RNA)",
-        "Bone Marrow (DNA)",
-        "Bone Marrow",
-        "Biomarkers",
-        "B-cell Immortalization",
-        "B Cell Isolation",
-        "Avidity",
-        "AT Test",
-        "AR-V7",
-        "Archival or Newly Obtained Collection",
-        "APOE",
-        "Anti-RSV (IgA)",
-        "Anti-HPV Antibody Testing",
-        "Antibodies",
-        "Alzheimer’s Disease Diagnosis",
-        "ADA",
-        "2C19 Genotyping",
-        "ADA",
-        "Antibodies",
-        "Archival or Newly Obtained Collection",
-        "AR-V7",
-        "TBD",
-        "Biomarkers",
-        "Bone Marrow",
-        "Correlative",
-        "ctDNA",
-        "CYP2C9 Genotyping",
-        "Cytokines",
-        "Future Biomedical Research",
-        "Genetic Analysis",
-        "Genetic Analysis (Buccal Swab)",
-        "HCV RNA",
-        "HIV-1 Drug Resistance",
-        "HIV-1 RNA",
-        "Immunogenicity (Nab)",
-        "Immunogenicity (Spike IgG)",
-        "Immunogenicity Assay",
-        "Legacy",
-        "Metabolome",
-        "Metabolomics",
-        "Metagenomics",
-        "mRNA Profiling",
-        "MSI",
-        "PBMC",
-        "PK",
-        "PK - DOR",
-        "PK - ISL",
-        "RNA Analysis",
-        "RSV A and B Ab Titers",
-        "Targeted Genotyping",
-        "T-cell Repertoire (TCR)",
-        "UGT2B17 Genotyping",
-        "Viral Shedding",
-        "Viremia",
-        "NULL",
-    ]
-)
-
-SPECIMEN_TYPES = set(
-    [
-        "Whole Blood PAXgene - RNA",
-        "Whole Blood PAXgene - DNA",
-        "Whole Blood EDTA - DNA",
-        "Whole Blood EDTA - Cell Pellet",
-        "Whole Blood (EDTA)",
-        "Urine",
-        "Tissue",
-        "Stool",
-        "Sputum",
-        "Solution",
-        "Slide Scroll",
-        "Slide Holder",
-        "Slide",
-        "Serum",
-        "Saliva",
-        "RNA",
-        "Plasma Peptide",
-        "Plasma",
-        "PBMC",
-        "Oral Swab",
-        "Nasal Wash",
-        "Nasal Swab",
-        "Middle Ear Fluid",
-        "DNA (Urine)",
-        "DNA (Saliva)",
-        "DNA (EDTA)",
-        "DNA (Buccal Swab)",
-        "DNA",
-        "Cerebrospinal Fluid",
-        "cDNA",
-        "Buffy Coat",
-        "Buccal Swab",
-        "Bone Marrow Biopsy",
-        "Bone Marrow Aspiration (Heparin)",
-        "Bone Marrow Aspiration (EDTA)",
-        "Bone Marrow Aspiration",
-        "Blood",
-        "Block",
-        "Biopsy",
-        "Plasma",
-        "Whole Blood PAXgene - RNA",
-        "Whole Blood PAXgene - DNA",
-        "TBD",
-        "Plasma",
-        "Serum",
-        "Biopsy",
-        "Whole Blood (EDTA)",
-        "Block",
-        "Blood",
-        "Bone Marrow Aspiration",
-        "Buccal Swab",
-        "Cerebrospinal Fluid",
-        "DNA",
-        "RNA",
-        "Whole Blood EDTA - DNA",
-        "DNA (Buccal Swab)",
-        "Slide",
-        "NULL",
-        "Nasal Swab",
-        "PBMC",
-        "Saliva",
-        "Stool",
-        "Tissue",
-        "Urine",
-    ]
-)
-
-# P3_STUDY = [
-#    "MK-0000-386", "MK-0000-387", "MK-0431-838", "MK-0431-845", "MK-0431-848", "MK-0822-018", "MK-1029-001", "MK-1029-003", "MK-1029-004", "MK-1029-005", "MK-1029-006", "MK-1029-008", "MK-1029-011", "MK-1029-012", "MK-1029-015", "MK-1029-017", "MK-1075-001", "MK-1092-001", "MK-1439-007", "MK-1439-018", "MK-1439-042", "MK-1439-044", "MK-1439-045", "MK-1439-046", "MK-1439-048","MK-1439-049", "MK-1439-050", "MK-1439-051", "MK-1439-052", "MK-1439-053", "MK-1439A-054", "MK-1942-001", "MK-1942-003", "MK-1986-004", "MK-2075-001", "MK-2640-001", "MK-2888-001", "MK-3682-014", "MK-3682-023", "MK-3682-026", "MK-3682-029", "MK-3682-035", "MK-3682A-018", "MK-3682A-019", "MK-3682B-025", "MK-3682B-030", "MK-3682B-031", "MK-3682B-032", "MK-3682C-028", "MK-3682C-039", "MK-3682C-044","MK-3682C-045", "MK-3866-001", "MK-3866-002", "MK-3866-005", "MK-3866-006", "MK-3866-008", "MK-4250-001", "MK-4250-005", "MK-4334-001", "MK-4710-001", "MK-4710-002", "MK-4710-003", "MK-5160-001", "MK-5172-052", "MK-5172-058", "MK-5172-062", "MK-5172-068", "MK-5172-074", "MK-5172-078", "MK-5172-080", "MK-5172-081", "MK-5172-082", "MK-5348-015", "MK-5348-046", "MK-5475-001", "MK-5592-097", "MK-6158-001", "MK-6240-001", "MK-6884-001","MK-6884-002", "MK-7264-024", "MK-7264-025", "MK-7264-026", "MK-7264-028", "MK-7264-032", "MK-7625A-013", "MK-7655A-019", "MK-7680-001", "MK-7680-003", "MK-8056-001", "MK-8189-003", "MK-8189-006", "MK-8228-005", "MK-8228-023", "MK-8228-025", "MK-8228-029", "MK-8228-031", "MK-8228-032", "MK-8228-033", "MK-8228-034", "MK-8228-035", "MK-8228-036", "MK-8228-037", "MK-8237-001", "MK-8246-075", "MK-8342B-069", "MK-8408-004", "MK-8408-010", "MK-8504-001","MK-8504-002", "MK-8504-003", "MK-8507-001", "MK-8507-002", "MK-8507-005", "MK-8521-004", "MK-8583-001", "MK-8591-002", "MK-8591-003", "MK-8591-005", "MK-8591-006", "MK-8591-007", "MK-8591-009", "MK-8591-010", "MK-8591-011", "MK-8616-038", "MK-8616-101", "MK-8666-001", "MK-8666-002", "MK-8666-003", "MK-8666-004", "MK-8666-005", "MK-8666-006", "MK-8666-008", "MK-8719-001", "MK-8719-002", "MK-8719-003", "MK-8723-001", "MK-8768-001", "MK-8931-016","MK-8931-030", "MK-8931-032", "P04103", "V501-200"
-# ]
-
-P3_STUDY = [
-    "MK0000386",
-    "MK0000387",
-    "MK0431838",
-    "MK0431845",
-    "MK0431848",
-    "MK0822018",
-    "MK1029001",
-    "MK1029003",
-    "MK1029004",
-    "MK1029005",
-    "MK1029006",
-    "MK1029008",
-    "MK1029011",
-    "MK1029012",
-    "MK1029015",
-    "MK1029017",
-    "MK1075001",
-    "MK1092001",
-    "MK1439007",
-    "MK1439018",
-    "MK1439042",
-    "MK1439044",
-    "MK1439045",
-    "MK1439046",
-    "MK1439048",
-    "MK1439049",
-    "MK1439050",
-    "MK1439051",
-    "MK1439052",
-    "MK1439053",
-    "MK1439A054",
-    "MK1942001",
-    "MK1942003",
-    "MK1986004",
-    "MK2075001",
-    "MK2640001",
-    "MK2888001",
-    "MK3682014",
-    "MK3682023",
-    "MK3682026",
-    "MK3682029",
-    "MK3682035",
-    "MK3682A018",
-    "MK3682A019",
-    "MK3682B025",
-    "MK3682B030",
-    "MK3682B031",
-    "MK3682B032",
-    "MK3682C028",
-    "MK3682C039",
-    "MK3682C044",
-    "MK3682C045",
-    "MK3866001",
-    "MK3866002",
-    "MK3866005",
-    "MK3866006",
-    "MK3866008",
-    "MK4250001",
-    "MK4250005",
-    "MK4334001",
-    "MK4710001",
-    "MK4710002",
-    "MK4710003",
-    "MK5160001",
-    "MK5172052",
-    "MK5172058",
-    "MK5172062",
-    "MK5172068",
-    "MK5172074",
-    "MK5172078",
-    "MK5172080",
-    "MK5172081",
-    "MK5172082",
-    "MK5348015",
-    "MK5348046",
-    "MK5475001",
-    "MK5592097",
-    "MK6158001",
-    "MK6240001",
-    "MK6884001",
-    "MK6884002",
-    "MK7264024",
-    "MK7264025",
-    "MK7264026",
-    "MK7264028",
-    "MK7264032",
-    "MK7625A013",
-    "MK7655A019",
-    "MK7680001",
-    "MK7680003",
-    "MK8056001",
-    "MK8189003",
-    "MK8189006",
-    "MK8228005",
-    "MK8228023",
-    "MK8228025",
-    "MK8228029",
-    "MK8228031",
-    "MK8228032",
-    "MK8228033",
-    "MK8228034",
-    "MK8228035",
-    "MK8228036",
-    "MK8228037",
-    "MK8237001",
-    "MK8246075",
-    "MK8342B069",
-    "MK8408004",
-    "MK8408010",
-    "MK8504001",
-    "MK8504002",
-    "MK8504003",
-    "MK8507001",
-    "MK8507002",
-    "MK8507005",
-    "MK8521004",
-    "MK8583001",
-    "MK8591002",
-    "MK8591003",
-    "MK8591005",
-    "MK8591006",
-    "MK8591007",
-    "MK8591009",
-    "MK8591010",
-    "MK8591011",
-    "MK8616038",
-    "MK8616101",
-    "MK8666001",
-    "MK8666002",
-    "MK8666003",
-    "MK8666004",
-    "MK8666005",
-    "MK8666006",
-    "MK8666008",
-    "MK8719001",
-    "MK8719002",
-    "MK8719003",
-    "MK8723001",
-    "MK8768001",
-    "MK8931016",
-    "MK8931030",
-    "MK8931032",
-    "P04103",
-    "V501200",
-]
-
 # Questions that need to be answered:
 # 1. Analysis Type NEEDS to be derived from another field
 # 2. Specimen Type NEEDS to be derived from another field
@@ -979,131 +383,300 @@ P3_STUDY = [
 # 6. There seem to be null values for volume_unit in LIMS along with vol_avg - How Should this be interpreted?
 
 
-def run_acc_validation(accessioning):
-    accessioning["origination_facility"] = (
+# Facility, source and specimen mappings and the study lists (analysis_types,
+# specimen_types, p3_study) are loaded on first use
+MAPPINGS = MappingStore(MAPPINGS_PATH, MAPPINGS_ARTIFACT)
+RESOLVER_CACHE = ResolverCache(RESOLVER_CACHE_PATH)
+# Validation worker processes (see start_shard_pool)
+SHARD_POOL = ShardPool()
+FACILITY_RESOLVER = MappingResolver(
+    "facility",
+    lambda: MAPPINGS.get("facility"),
+    RESOLVER_CACHE,
+    substitute=RESOLVER_SUBSTITUTE,
+)
+SOURCE_RESOLVER = MappingResolver(
+    "source",
+    lambda: MAPPINGS.get("source"),
+    RESOLVER_CACHE,
+    substitute=RESOLVER_SUBSTITUTE,
+)
+SPECIMEN_RESOLVER = MappingResolver(
+    "specimen",
+    lambda: MAPPINGS.get("specimen"),
+    RESOLVER_CACHE,
+    substitute=RESOLVER_SUBSTITUTE,
+)
+
+
+def has_value(value):
+    # Same truthiness the row lambdas always used, but safe for NaN / pd.NA
+    if pd.isna(value) is True:
+        return False
+    return bool(value)
+
+
+def nulls_to_none(frame, settings=SETTINGS):
+    if settings["backend"] == "arrow":
+        return frame
+    return frame.replace([np.nan], [None])
+
+
+def to_output_frame(frame, settings=SETTINGS):
+    # CSV boundary: the only place None is materialized in arrow mode
+    if settings["backend"] == "arrow":
+        return frame.astype(object).where(frame.notna(), None)
+    return frame.fillna(np.nan).replace([np.nan], [None])
+
+
+def to_datetime(series):
+    if isinstance(series.dtype, pd.ArrowDtype):
+        series = series.astype(object)
+    return pd.to_datetime(series, errors="coerce")
+
+
+def arrow_chunk(values):
+    import pyarrow as pa
+
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+    return None if pa.types.is_nested(array.type) else array
+
+
+def arrow_type(types):
+    # One type for a column whose chunks were typed apart, or None
+    import pyarrow as pa
+
+    if len(types) == 1:
+        return types.pop()
+    if all(pa.types.is_decimal(t) for t in types):
+        scale = max(t.scale for t in types)
+        digits = max(t.precision - t.scale for t in types)
+        return pa.decimal128(min(digits + scale, 38), scale)
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return None
+
+
+def arrow_frame(names, chunks):
+    # chunks: per fetched chunk, the values of each column. Every chunk goes
+    # to Arrow as it arrives, so only one chunk at a time is held as python
+    # objects; JSON blobs (meta), mixed-type and all-null columns stay
+    # python objects
+    import pyarrow as pa
+
+    arrays = {name: [] for name in names}
+    objects = {}
+    for chunk in chunks:
+        for name, values in zip(names, chunk):
+            array = None if name in objects else arrow_chunk(values)
+            if array is not None:
+                arrays[name].append(array)
+                continue
+            if name not in objects:
+                objects[name] = [v for a in arrays.pop(name) for v in a.to_pylist()]
+            objects[name].extend(values)
+    columns = {}
+    for name, chunked in arrays.items():
+        types = {a.type for a in chunked if not pa.types.is_null(a.type)}
+        target = arrow_type(types) if types else None
+        if target is None:
+            objects[name] = [v for a in chunked for v in a.to_pylist()]
+        else:
+            columns[name] = pa.chunked_array([a.cast(target) for a in chunked])
+    frame = pa.table(columns).to_pandas(types_mapper=pd.ArrowDtype)
+    for name, values in objects.items():
+        values = pd.Series(values, dtype=object)
+        frame[name] = values.where(values.notna(), None)
+    return frame[list(names)]
+
+
+def read_query(query, bind=None, settings=SETTINGS):
+    bind = bind or db.bind
+    if settings["backend"] != "arrow":
+        return pd.read_sql(query.statement, bind).replace([np.nan], [None])
+
+    def fetched(result):
+        while True:
+            rows = result.fetchmany(settings["fetch_size"])
+            if not rows:
+                return
+            yield list(zip(*rows))
+
+    with bind.connect() as connection:
+        result = connection.execute(query.statement)
+        return arrow_frame(list(result.keys()), fetched(result))
+
+
+def drop_micronic_wb(frame):
+    return frame[
+        ~(
+            (frame["container_type"].astype(str) == "Micronic 1.4")
+            & (frame["source"] == "WB")
+        )
+    ]
+
+
+def has_missing_status(frame):
+    return bool((~frame["status"].isin(STATUS_MAP.keys())).any())
+
+
+def warm_resolvers(frame, facility_column=None):
+    # Resolve unseen values in the parent too, so the flagged values are
+    # reported and cached when sharded workers do the validation
+    if facility_column:
+        FACILITY_RESOLVER.replace(frame[facility_column])
+    SOURCE_RESOLVER.replace(frame["source"])
+    for container_type in frame.loc[frame["source"] == "WB", "container_type"].unique():
+        if isinstance(container_type, str):
+            SPECIMEN_RESOLVER.get(container_type.lower())
+
+
+def validate(func, frame, settings=SETTINGS, **kwargs):
+    workers = settings["validation_workers"]
+    if workers > 1:
+        return run_sharded(
+            func,
+            frame,
+            SHARD_POOL,
+            workers,
+            prepare=refresh_mappings,
+            settings=settings,
+            **kwargs,
+        )
+    return func(frame, settings=settings, **kwargs)
+
+
+def run_acc_validation(accessioning, missing_status=None, settings=SETTINGS):
+    accessioning["origination_facility"] = FACILITY_RESOLVER.replace(
         accessioning["origination_facility"]
-        .replace(FACILITY_MAP)
-        .replace([np.nan], [None])
-    )
+    ).pipe(nulls_to_none, settings)
     accessioning["analysis_type"] = accessioning["analysis_type"].replace(
         ANALYSIS_MAPPING
     )
-    accessioning["specimen_type"] = accessioning["source"].replace(SOURCE_MAPPING)
-    accessioning = accessioning[
-        ~(
-            (accessioning["container_type"].astype(str) == "Micronic 1.4")
-            & (accessioning["source"] == "WB")
-        )
-    ]
+    accessioning["specimen_type"] = SOURCE_RESOLVER.replace(accessioning["source"])
+    accessioning = drop_micronic_wb(accessioning)
     # accessioning = accessioning[~((accessioning["container_type"] == "Micronic 1.4") & (accessioning["source"] == "WB"))]
     accessioning["specimen_type"] = accessioning.apply(
-        lambda x: SPECIMEN_MAPPING[x["container_type"].lower()]
-        if x["source"] == "WB"
+        lambda x: SPECIMEN_RESOLVER.get(x["container_type"].lower(), x["specimen_type"])
+        if x["source"] == "WB" and isinstance(x["container_type"], str)
         else x["specimen_type"],
         axis=1,
     )
 
-    miss_stat = accessioning[~accessioning["status"].isin(STATUS_MAP.keys())]
-    if miss_stat.shape[0]:
+    if missing_status is None:
+        missing_status = has_missing_status(accessioning)
+    if missing_status:
         accessioning["randomization_id"] = accessioning.apply(
             lambda x: str(x["randomization_id"]).zfill(6)
-            if x["randomization_id"]
+            if has_value(x["randomization_id"])
             else None,
             axis=1,
         )
     accessioning["screening_number"] = accessioning.apply(
         lambda x: str(x["screening_number"]).zfill(9)
-        if x["screening_number"]
+        if has_value(x["screening_number"])
         else None,
         axis=1,
     )
 
+    bad_sites = RowMessages("site_not_converted")
+
     def check_site(inventory_code, site):
         numeric_site = pd.to_numeric(site, errors="coerce")
         try:
-            if not np.isnan(numeric_site):
+            if not pd.isna(numeric_site):
                 return str(int(pd.to_numeric(site))).zfill(4)
         except:
-            print("normal site", site)
-            print("numeric site", numeric_site)
-            print("inventory code", inventory_code)
+            bad_sites.add(
+                inventory_code=inventory_code, site=site, numeric_site=numeric_site
+            )
         return None
 
     accessioning["site"] = accessioning.apply(
         lambda x: check_site(x["inventory_code"], x["site"]), axis=1
     )
+    bad_sites.flush()
     accessioning["comments"] = accessioning.apply(
-        lambda x: str(x["comments"])[:250] if x["comments"] else None, axis=1
+        lambda x: str(x["comments"])[:250] if has_value(x["comments"]) else None,
+        axis=1,
     )
     accessioning["status"] = accessioning["status"].replace(STATUS_MAP)
     return accessioning
 
 
-def run_ali_validation(aliquot):
+def run_ali_validation(aliquot, missing_status=None, settings=SETTINGS):
     aliquot = aliquot[aliquot["container_type"] != "BloodSpotCard"]
-    aliquot = aliquot[
-        ~((aliquot["container_type"] == "Micronic 1.4") & (aliquot["source"] == "WB"))
-    ]
-    aliquot["specimen_type"] = aliquot["source"].replace(SOURCE_MAPPING)
+    aliquot = drop_micronic_wb(aliquot)
+    aliquot["specimen_type"] = SOURCE_RESOLVER.replace(aliquot["source"])
     aliquot["specimen_type"] = aliquot.apply(
-        lambda x: SPECIMEN_MAPPING[x["container_type"].lower()]
-        if x["source"] == "WB"
+        lambda x: SPECIMEN_RESOLVER.get(x["container_type"].lower(), x["specimen_type"])
+        if x["source"] == "WB" and isinstance(x["container_type"], str)
         else x["specimen_type"],
         axis=1,
     )
-    miss_stat = aliquot[~aliquot["status"].isin(STATUS_MAP.keys())]
-    if miss_stat.shape[0]:
+    if missing_status is None:
+        missing_status = has_missing_status(aliquot)
+    if missing_status:
         aliquot["status"] = aliquot["status"].replace(STATUS_MAP)
     return aliquot
 
 
-def run_qc_validation(qc):
+def run_qc_validation(qc, settings=SETTINGS):
     vol_unit_dict = {"ml": 1000, "mL": 1000, "uL": 1, "Unit": 10}
     conc_unit_dict = {"ng/ul": 1}
 
     def add_padding(number):
-        if number:
+        if has_value(number):
             return f"{round(number, 3):.3f}"
         return None
 
     def validate_vol(vol_avg, vol_avg_unit, valid_dict):
-        if vol_avg is not None and vol_avg_unit is not None:
+        if not pd.isna(vol_avg) and not pd.isna(vol_avg_unit):
             return vol_avg * valid_dict[vol_avg_unit]
-        elif vol_avg:
+        elif has_value(vol_avg):
             return vol_avg
         return None
 
     def get_yield(vol, concentration):
-        if vol and concentration:
+        if has_value(vol) and has_value(concentration):
             return vol * concentration / 1000
         return None
 
-    qc = qc.fillna(np.nan).replace([np.nan], [None])
+    if settings["backend"] != "arrow":
+        qc = qc.fillna(np.nan).replace([np.nan], [None])
     qc["vol_avg"] = qc.apply(
         lambda x: validate_vol(x.vol_avg, x.volume_unit, vol_unit_dict), axis=1
     )
     qc["vol_avg"] = qc.apply(
-        lambda x: 0 if x.vol_avg < 0 else x.vol_avg, axis=1
-    ).replace([np.nan], [None])
-    qc.loc[~qc["vol_avg"].isnull(), "volume_unit"] = "uL"
-    qc.loc[~qc["concentration"].isnull(), "concentration_unit"] = "ng/ul"
+        lambda x: 0 if has_value(x.vol_avg) and x.vol_avg < 0 else x.vol_avg, axis=1
+    ).pipe(nulls_to_none, settings)
+    qc["volume_unit"] = qc["volume_unit"].mask(~qc["vol_avg"].isnull(), "uL")
+    qc["concentration_unit"] = qc["concentration_unit"].mask(
+        ~qc["concentration"].isnull(), "ng/ul"
+    )
     qc["yield"] = qc.apply(
         lambda x: get_yield(x.vol_avg, x.concentration), axis=1
-    ).replace([np.nan], [None])
+    ).pipe(nulls_to_none, settings)
     qc["vol_avg"] = qc.apply(
-        lambda x: add_padding(x.vol_avg) if x.vol_avg else None, axis=1
-    ).replace([np.nan], [None])
+        lambda x: add_padding(x.vol_avg) if has_value(x.vol_avg) else None, axis=1
+    ).pipe(nulls_to_none, settings)
     qc["yield"] = qc.apply(
-        lambda x: add_padding(x["yield"]) if x["yield"] else None, axis=1
-    ).replace([np.nan], [None])
+        lambda x: add_padding(x["yield"]) if has_value(x["yield"]) else None, axis=1
+    ).pipe(nulls_to_none, settings)
     qc["concentration"] = qc.apply(
-        lambda x: add_padding(x.concentration) if x.concentration else None, axis=1
-    ).replace([np.nan], [None])
+        lambda x: add_padding(x.concentration) if has_value(x.concentration) else None,
+        axis=1,
+    ).pipe(nulls_to_none, settings)
     return qc
 
 
-def run_su_validation(su):
-    su["site_name"] = su["site_name"].replace(FACILITY_MAP).replace([np.nan], [None])
+def run_su_validation(su, keep_history=False, settings=SETTINGS):
+    su["site_name"] = FACILITY_RESOLVER.replace(su["site_name"]).pipe(
+        nulls_to_none, settings
+    )
     # su = su[(su["site_name"].isnull()) | (su["site_name"].isin(FACILITY_MAP.keys()))] # Temporary Solution
     # su["site_name"] = su.apply(lambda x: "TBD" if x["status"] == "Shipped" and x["site_name"] not in FACILITY_MAP.keys() else x["site_name"], axis = 1)
     # su.loc[(su["status"] == "Shipped") & (su[~su["site_name"].isin(FACILITY_MAP.keys())]), "site_name"] = "TBD"
@@ -1113,127 +686,350 @@ def run_su_validation(su):
     # configure dates depending on what the status is
     # su["Shipped Date"] = su.apply(lambda x: x["date_updated"] if x["status"] == "Shipped" else None, axis = 1)
     # su["Terminal Date"] = su.apply(lambda x: x["date_updated"] if x["status"] == "Disposed" else None, axis = 1)
-    return su.sort_values("date_updated").drop_duplicates(
-        subset=["inventory_code"], keep="last"
-    )
+    if keep_history:
+        return su
+    frames = frame_backend(settings["frames"])
+    return frames.latest(su, "inventory_code", "date_updated")
 
 
-def unpack_meta(data):
-    # print("\n_____________________LIST DATA META___________________\n\n")
-    print(list(data["meta"]))
-    # print("\n_________________________________________\n")
+def unpack_meta(data, settings=SETTINGS):
     meta_data = pd.DataFrame(list(data["meta"]))
+    event("meta_unpacked", DEBUG, rows=len(meta_data), keys=list(meta_data.columns))
+    if settings["backend"] == "arrow":
+        names = list(meta_data.columns)
+        meta_data = arrow_frame(names, [[meta_data[c].tolist() for c in names]])
+        return pd.concat([data.drop(columns=["meta"]), meta_data], axis=1)
     return pd.concat([data.drop(columns=["meta"]), meta_data], axis=1).replace(
         [np.nan], [None]
     )
 
 
-def fetch_data():
-    # Step 1: Get Context for client and project
-    context = get_current_context()
-    tz = timezone("America/New_York")
-    start_time = context["execution_date"]
-    file_time = (
-        start_time.astimezone(tz=tz).replace(tzinfo=None).strftime("%Y%m%d_%H%M%S")
+def is_sampling():
+    return bool(SAMPLE_PER_STRATUM or SAMPLE_IDS)
+
+
+def sampled_accession_codes():
+    selected = []
+    if SAMPLE_PER_STRATUM:
+        ranked = (
+            db.query(
+                Accessioning.inventory_code.label("inventory_code"),
+                func.row_number()
+                .over(
+                    partition_by=(
+                        Accessioning.study_name,
+                        Accessioning.status,
+                        Accessioning.source,
+                    ),
+                    order_by=Accessioning.inventory_code,
+                )
+                .label("stratum_rank"),
+            )
+            .filter(Accessioning.client == "MERCK")
+            .subquery()
+        )
+        selected.append(
+            Accessioning.inventory_code.in_(
+                db.query(ranked.c.inventory_code)
+                .filter(ranked.c.stratum_rank <= SAMPLE_PER_STRATUM)
+                .statement
+            )
+        )
+    if SAMPLE_IDS:
+        # Requested IDs may be aliquots, pull their accession in as well
+        selected.append(Accessioning.inventory_code.in_(SAMPLE_IDS))
+        selected.append(
+            Accessioning.inventory_code.in_(
+                db.query(Aliquot.ultimate_parent)
+                .filter(Aliquot.client == "MERCK")
+                .filter(Aliquot.inventory_code.in_(SAMPLE_IDS))
+                .statement
+            )
+        )
+    return (
+        db.query(Accessioning.inventory_code)
+        .filter(Accessioning.client == "MERCK")
+        .filter(or_(*selected))
     )
-    # If iterative file, need to check edits to fetch INV CODES edited within the last N days
-    print("VALIDATING ACCESSION:\n")
-    acc = run_acc_validation(
-        unpack_meta(
-            pd.read_sql(
-                db.query(Accessioning).filter(Accessioning.client == "MERCK").statement,
-                db.bind,
-            ).replace([np.nan], [None])
+
+
+def extraction_queries(accession_codes=None, exclude=None):
+    # exclude: subquery of accession codes whose whole lineage is left out
+    # Primary key order, so a full run always reads (and writes) rows in the
+    # same order, which export_order reproduces for partial builds
+    queries = {
+        "acc": db.query(Accessioning)
+        .filter(Accessioning.client == "MERCK")
+        .order_by(*Accessioning.__table__.primary_key.columns),
+        "ali": db.query(Aliquot)
+        .filter(Aliquot.client == "MERCK")
+        .order_by(*Aliquot.__table__.primary_key.columns),
+        "qc": db.query(QualityControl)
+        .filter(QualityControl.client == "MERCK")
+        .order_by(*QualityControl.__table__.primary_key.columns),
+        "su": db.query(StatusUpdates)
+        .filter(StatusUpdates.client == "MERCK")
+        .order_by(*StatusUpdates.__table__.primary_key.columns),
+    }
+    if exclude is not None:
+        excluded_ali = (
+            db.query(Aliquot.inventory_code)
+            .filter(Aliquot.client == "MERCK")
+            .filter(Aliquot.ultimate_parent.in_(exclude))
+            .statement
         )
-    ).rename(columns=ACC_MAPPING)
-    print("DONE\n_________________________________________________\n")
-    print("VALIDATING ALIQUOT:\n")
-    ali = run_ali_validation(
-        unpack_meta(
-            pd.read_sql(
-                db.query(Aliquot).filter(Aliquot.client == "MERCK").statement,
-                db.bind,
-            ).replace([np.nan], [None])
+        queries["acc"] = queries["acc"].filter(
+            or_(
+                Accessioning.inventory_code.is_(None),
+                ~Accessioning.inventory_code.in_(exclude),
+            )
         )
-    ).rename(columns=ALI_MAPPING)
-    print("DONE\n_________________________________________________\n")
-    print("VALIDATING QUALITY CONTROL:\n")
-    qc = run_qc_validation(
-        unpack_meta(
-            pd.read_sql(
-                db.query(QualityControl)
-                .filter(QualityControl.client == "MERCK")
-                .statement,
-                db.bind,
-            ).replace([np.nan], [None])
+        queries["ali"] = queries["ali"].filter(
+            or_(
+                Aliquot.ultimate_parent.is_(None), ~Aliquot.ultimate_parent.in_(exclude)
+            )
         )
-    ).rename(columns=QC_MAPPING)
-    print("DONE\n_________________________________________________\n")
-    print("VALIDATING STATUS UPDATE:\n")
-    su = run_su_validation(
-        pd.read_sql(
-            db.query(StatusUpdates).filter(StatusUpdates.client == "MERCK").statement,
-            db.bind,
-        ).replace([np.nan], [None])
-    ).rename(columns=SU_MAPPING)
-    print("DONE SU validation and SU data is", su["Terminal Date"])
-    # send_data(f"su_df_{file_time}.csv", su)
+        queries["qc"] = queries["qc"].filter(
+            or_(
+                QualityControl.inventory_code.is_(None),
+                ~QualityControl.inventory_code.in_(excluded_ali),
+            )
+        )
+        queries["su"] = queries["su"].filter(
+            or_(
+                StatusUpdates.inventory_code.is_(None),
+                ~(
+                    StatusUpdates.inventory_code.in_(exclude)
+                    | StatusUpdates.inventory_code.in_(excluded_ali)
+                ),
+            )
+        )
+    if accession_codes is None and is_sampling():
+        accession_codes = sampled_accession_codes().statement
+    if accession_codes is None:
+        return queries
+    # Keep the subset join-consistent: every aliquot, QC row and status
+    # update that hangs off a selected accession comes along
+    acc_codes = accession_codes
+    ali_codes = (
+        db.query(Aliquot.inventory_code)
+        .filter(Aliquot.client == "MERCK")
+        .filter(Aliquot.ultimate_parent.in_(acc_codes))
+        .statement
+    )
+    queries["acc"] = queries["acc"].filter(Accessioning.inventory_code.in_(acc_codes))
+    queries["ali"] = queries["ali"].filter(Aliquot.ultimate_parent.in_(acc_codes))
+    queries["qc"] = queries["qc"].filter(QualityControl.inventory_code.in_(ali_codes))
+    # One IN over both code sets, which the (client, inventory_code) index
+    # answers; an OR of two INs makes the database read every status update
+    lineage_codes = union_all(
+        db.query(Accessioning.inventory_code)
+        .filter(Accessioning.client == "MERCK")
+        .filter(Accessioning.inventory_code.in_(acc_codes))
+        .statement,
+        ali_codes,
+    )
+    queries["su"] = queries["su"].filter(
+        StatusUpdates.inventory_code.in_(lineage_codes)
+    )
+    return queries
+
+
+def apply_schema(name, frame, schema, settings=SETTINGS):
+    if not settings["schema"]:
+        return frame
+    frame, report = coerce_frame(frame, schema, arrow=settings["backend"] == "arrow")
+    for line in format_report(name, report):
+        event("ingest_schema", table=name, report=line)
+    return frame
+
+
+def extract_tables(accession_codes=None, exclude=None, bind=None, settings=SETTINGS):
+    # bind: engine to read from instead of the session's (the replica)
+    queries = extraction_queries(accession_codes, exclude)
+    schemas = {"acc": ACC_SCHEMA, "ali": ALI_SCHEMA, "qc": QC_SCHEMA, "su": SU_SCHEMA}
+
+    def extract(name):
+        frame = read_query(queries[name], bind, settings)
+        if name != "su":
+            frame = unpack_meta(frame, settings)
+        return apply_schema(name, frame, schemas[name], settings)
+
+    # One pooled connection per table; the session gives back the one it
+    # holds since its last query, or the last table waits for it
+    db.rollback()
+    with ThreadPoolExecutor(max_workers=min(DB_POOL_SIZE, len(queries))) as pool:
+        return dict(zip(queries, pool.map(extract, queries)))
+
+
+def validate_tables(tables, missing_status=None, history=False, settings=SETTINGS):
+    # missing_status overrides the table-wide status checks, for callers that
+    # only validate a subset of the table; history=True also returns every
+    # status update (not just the latest) as "su_history" for as-of exports
+    missing_status = missing_status or {}
+    # Specimen ID / parent keys travel as int64 surrogates until join_tables
+    # has finished merging
+    encoder = KeyEncoder()
+    event("validating", table="acc", rows=len(tables["acc"]))
+    acc = tables["acc"]
+    warm_resolvers(acc, "origination_facility")
+    acc = validate(
+        run_acc_validation,
+        acc,
+        settings,
+        # The padding decision is table-wide, so make it before sharding
+        missing_status=missing_status.get(
+            "acc", has_missing_status(drop_micronic_wb(acc))
+        ),
+    ).rename(columns=ACC_MAPPING)
+    encoder.encode_columns(acc, ["Specimen ID"])
+    event("validated", table="acc", rows=len(acc))
+    event("validating", table="ali", rows=len(tables["ali"]))
+    ali = tables["ali"]
+    warm_resolvers(ali)
+    ali = validate(
+        run_ali_validation,
+        ali,
+        settings,
+        missing_status=missing_status.get(
+            "ali",
+            has_missing_status(
+                drop_micronic_wb(ali[ali["container_type"] != "BloodSpotCard"])
+            ),
+        ),
+    ).rename(columns=ALI_MAPPING)
+    encoder.encode_columns(
+        ali, ["Specimen ID", "Parent Specimen ID", "ultimate_parent"]
+    )
+    event("validated", table="ali", rows=len(ali))
+    event("validating", table="qc", rows=len(tables["qc"]))
+    qc = validate(run_qc_validation, tables["qc"], settings)
+    qc = qc.rename(columns=QC_MAPPING)
+    encoder.encode_columns(qc, ["Specimen ID"])
+    event("validated", table="qc", rows=len(qc))
+    event("validating", table="su", rows=len(tables["su"]))
+    su = encoder.encode_columns(tables["su"], ["inventory_code"])
+    if history:
+        su_history = run_su_validation(su.copy(), True, settings)
+        su_history = su_history.rename(columns=SU_MAPPING)
+    su = run_su_validation(su, settings=settings).rename(columns=SU_MAPPING)
+    event(
+        "validated",
+        table="su",
+        rows=len(su),
+        terminal_dates=int(su["Terminal Date"].notna().sum()),
+    )
+
+    for resolver in (FACILITY_RESOLVER, SOURCE_RESOLVER, SPECIMEN_RESOLVER):
+        for line in resolver.report():
+            event("unmapped_value", WARNING, detail=line)
+    RESOLVER_CACHE.save()
+    validated = {"acc": acc, "ali": ali, "qc": qc, "su": su, "keys": encoder.to_frame()}
+    if history:
+        validated["su_history"] = su_history
+    return validated
+
+
+def check_fanout(name, left, right, left_on, right_on, how, encoder):
+    estimate = estimate_join(left, right, left_on, right_on, how)
+    if not estimate["duplicated_keys"] or estimate["fanout"] <= FANOUT_LIMIT:
+        return
+    encoder.decode_columns(estimate["offenders"], ["Specimen ID", "ultimate_parent"])
+    lines = format_estimate(name, estimate)
+    for line in lines:
+        event("join_fanout", WARNING, join=name, detail=line)
+    if FANOUT_ACTION == "block":
+        raise AirflowException(f"Join fan-out above {FANOUT_LIMIT}: {lines[0]}")
+
+
+def join_tables(tables, as_of=None, settings=SETTINGS):
+    # as_of: tables["su_as_of"] holds each specimen's last status update at
+    # or before that timestamp and tables["updated_after"] the specimens
+    # updated since (see asof_exports); specimens created after it are left out
+    acc, ali, qc, su = tables["acc"], tables["ali"], tables["qc"], tables["su"]
+    encoder = KeyEncoder.from_frame(tables["keys"])
+    frames = frame_backend(settings["frames"])
 
     # Join Tables Together
-    print("Testing Shape: ", acc.shape, ali.shape, qc.shape, su.shape)
+    event("joining", acc=acc.shape, ali=ali.shape, qc=qc.shape, su=su.shape)
+    check_fanout("CONC1", ali, qc, ["Specimen ID"], ["Specimen ID"], "inner", encoder)
+    conc1 = frames.merge(ali, qc, how="inner", on=["Specimen ID"], suffixes=("", "_qc"))
+    event("joined", step="CONC1", shape=conc1.shape)
 
-    print(
-        "\n\n---------------------------------------\nCONC1 = MERGE ALIQUOT AND QC\n\n"
+    check_fanout(
+        "CONC2", conc1, acc, ["ultimate_parent"], ["Specimen ID"], "inner", encoder
     )
-    conc1 = ali.merge(qc, how="inner", on=["Specimen ID"], suffixes=("", "_qc"))
-    print("CONC 1: ", conc1.shape)
-
-    conc2 = conc1.merge(
+    conc2 = frames.merge(
+        conc1,
         acc,
         how="inner",
         left_on=["ultimate_parent"],
         right_on=["Specimen ID"],
         suffixes=("", "_acc"),
     )
-    print("CONC 2: ", conc2.shape)
+    event("joined", step="CONC2", shape=conc2.shape)
 
     conc3 = pd.concat([conc2, acc], ignore_index=True, sort=False)
-    print("CONC 3: ", conc3.shape)
+    event("joined", step="CONC3", shape=conc3.shape)
 
     export = conc3
-    export = export.merge(
-        su, how="left", on=["Specimen ID", "Current Status"], suffixes=("", "_su")
-    )
-    print("*****----ZZ")
-    print(export[export["Specimen ID"] == "8013398046"])
-    print(su[su["Specimen ID"] == "8013398046"])
-    print("*****----ZZ")
+    if as_of is None:
+        su_keys = ["Specimen ID", "Current Status"]
+        check_fanout("SU", export, su, su_keys, su_keys, "left", encoder)
+        export = frames.merge(
+            export,
+            su,
+            how="left",
+            on=["Specimen ID", "Current Status"],
+            suffixes=("", "_su"),
+        )
+    else:
+        created = utc_naive(export["Created Date"])
+        export = export[created.isna() | (created <= utc_naive(as_of))]
+        # Specimens updated after as_of take their status as of then, or keep
+        # their accession / aliquot status when they had no update yet; the
+        # others join today's updates exactly as above
+        su_as_of = tables["su_as_of"]
+        updated = su_as_of["Specimen ID"].isin(tables["updated_after"])
+        statuses = su_as_of[updated].set_index("Specimen ID")["Current Status"]
+        held = export["Specimen ID"].isin(statuses.index)
+        statuses = export["Specimen ID"].map(statuses)
+        export = export.assign(
+            **{"Current Status": statuses.where(held, export["Current Status"])},
+            as_of_status=held,
+        )
+        su = pd.concat(
+            [su[~su["Specimen ID"].isin(tables["updated_after"])], su_as_of[updated]],
+            ignore_index=True,
+        )
+        su_keys = ["Specimen ID", "Current Status"]
+        check_fanout("SU", export, su, su_keys, su_keys, "left", encoder)
+        export = frames.merge(export, su, how="left", on=su_keys, suffixes=("", "_su"))
+        # The statuses taken from the updates, in the export's vocabulary
+        held = export.pop("as_of_status").to_numpy(dtype=bool)
+        status = export["Current Status"]
+        export["Current Status"] = status.where(~held, status.replace(STATUS_MAP))
+    # Per-specimen inspection: python merck_feed_snapshot.py <dir> --specimen ...
 
     # export = export.merge(su, how = "left", on = ["Specimen ID"], suffixes = ('', '_su'))
 
-    print("EXPORT : ", export.columns)
+    event("export_columns", DEBUG, columns=list(export.columns))
 
-    # print("\n\nWriting ACC to CSV\n")
     # send_data(f"Acc_df_{file_time}.csv", acc)
-    print("\n\nWriting ALI to CSV\n")
     # send_data(f"ali_df_{file_time}.csv", ali)
-    print("\n\nWriting QC to CSV\n")
     # send_data(f"qc_df_{file_time}.csv", qc)
-    print("\n\nWriting SU to CSV\n")
     # send_data(f"su_df_{file_time}.csv", su)
-    print("\n\nWriting CONC1 ALI+QC to CSV\n")
     # send_data(f"conc1_df_{file_time}.csv", conc1)
-    print("\n\nWriting CONC2 ALI+QC+ACC to CSV\n")
     # send_data(f"conc2_df_{file_time}.csv", conc2)
-    print("\n\nWriting CONC3 ALI+QC+ACC+ACC to CSV\n")
     # send_data(f"conc3_df_{file_time}.csv", conc3)
     # print("\n\nWriting EXPORT ALI+QC+ACC+ACC+SU to CSV\n")
     # send_data(f"export_df_{file_time}.csv", export)
 
-    print("Testing Shape after joins: ", export.shape)
+    event("joined", step="SU", shape=export.shape)
     export = export.rename(MAPPING)
-    export = export[[col for col in ALL_COLUMNS if col in export.columns]]
-    export = export.replace([np.nan], [None])
+    export = export[[col for col in BIOTRACS.stored if col in export.columns]]
+    encoder.decode_columns(export, ["Specimen ID", "Parent Specimen ID"])
+    export = nulls_to_none(export, settings)
 
     # Here we will format the dates
     date_columns = [
@@ -1244,56 +1040,78 @@ def fetch_data():
         "Received Date",
     ]
     for col in date_columns:
-        export[col] = pd.to_datetime(export[col], errors="coerce").dt.strftime(
-            "%m/%d/%Y"
-        )
-    export["Collection Time"] = pd.to_datetime(
-        export["Collection Time"], errors="coerce"
-    ).dt.strftime("%H:%M")
-    export = export.fillna(np.nan).replace([np.nan], [None])
+        export[col] = to_datetime(export[col]).dt.strftime("%m/%d/%Y")
+    export["Collection Time"] = to_datetime(export["Collection Time"]).dt.strftime(
+        "%H:%M"
+    )
+    export = to_output_frame(export, settings)
 
     # print("\n\nWriting EXPORT AFTER REFORMAT to CSV\n")
     # send_data(f"export2_df_{file_time}.csv", export)
 
-    export["Vendor"] = "IBX"
-    export["Assay"] = ""
-    export["Biopsy Accession ID"] = ""
-    export["Biopsy Anatomic Location"] = ""
-    export["Biopsy Collection Method"] = ""
-    export["Fixation Method"] = ""
-    export["Lesion Type"] = ""
-    export["Pre/Post Treatment"] = ""
-    export["Slide Thickness"] = ""
-    export["Slides Sectioned Date"] = ""
-    export["Specimen Fixation Date"] = ""
-    export["Specimen Tissue Category"] = ""
-    export["Diagnosis Confirmed"] = ""
-    export["Biopsy Lesion Injection Status"] = ""
-    export["Time from Tissue Excision to Immersion in Fixative"] = ""
-    export["Fixation Time"] = ""
-    export["Institutional Block or Slide ID"] = ""
-    export["Time Specimen Placed in Fixative"] = ""
-    export["Number of Slides Submitted"] = ""
-    export["Type of Biopsy Sample Taken"] = ""
-    export["Vendor Specimen ID"] = ""
-    print("===========", export["Vendor Specimen ID"])
+    # Vendor and the empty BioTRACS placeholder columns are added by the
+    # writers (see merck_feed_layout)
     export.fillna("")
+    return export
+
+
+def asof_exports(timestamps):
+    # One extraction and validation for any number of snapshots: each one is
+    # an as-of lookup into the status timeline followed by the usual join
+    validated = validate_tables(extract_tables(), history=True)
+    history = validated.pop("su_history")
+    timeline = StatusTimeline(history)
+    updated = utc_naive(history["date_updated"]).to_numpy()
+    for timestamp, su in timeline.snapshots(timestamps):
+        after = history["Specimen ID"][updated > np.datetime64(utc_naive(timestamp))]
+        tables = {**validated, "su_as_of": su, "updated_after": after.unique()}
+        yield timestamp, join_tables(tables, as_of=timestamp)
+
+
+def write_asof_exports(timestamps, directory):
+    os.makedirs(directory, exist_ok=True)
+    for timestamp, export in asof_exports(timestamps):
+        stamp = timestamp.strftime("%Y%m%d_%H%M%S")
+        for name, frame in partition_export(export).items():
+            file_name = csv_name(
+                f"BioTRACS_Merck_{name}_AsOf_{stamp}.csv", CSV_COMPRESSION
+            )
+            with open(os.path.join(directory, file_name), "wb") as f:
+                write_csv(frame, f, CSV_COMPRESSION, CSV_WORKERS, layout=BIOTRACS)
+        event("asof_export", as_of=stamp, shape=export.shape)
+
+
+def upload_files(files, file_time):
+    if UPLOAD_BACKEND == "sharepoint":
+        session = http_session(USERNAME, PASSWORD, UPLOAD_WORKERS)
+        backend = SharePointBackend(BASESITE, UPLOAD_TARGET, session)
+    else:
+        backend = LocalBackend(UPLOAD_TARGET)
+    uploader = Uploader(backend, UPLOAD_STATE, workers=UPLOAD_WORKERS, layout=BIOTRACS)
+    uploads = [
+        (key, csv_name(f"{prefix}_{file_time}.csv", CSV_COMPRESSION), files[key])
+        for key, prefix in UPLOAD_FILES.items()
+    ]
+    return uploader.upload(uploads, CSV_COMPRESSION, CSV_WORKERS)
 
+
+def partition_export(export):
+    p3_study = MAPPINGS.get("p3_study")
     # File #1: MAIN
-    main_export = export[~export["Study Number"].isin(P3_STUDY)]
+    main_export = export[~export["Study Number"].isin(p3_study)]
     main_inv_export = export[export["Current Status"] == "In Inventory"]
     main_inv_export_nonp3 = main_inv_export[
-        ~main_inv_export["Study Number"].isin(P3_STUDY)
+        ~main_inv_export["Study Number"].isin(p3_study)
     ]
     main_uninvexport = export[export["Current Status"] != "In Inventory"]
     main_uninvexport_nonp3 = main_uninvexport[
-        ~main_uninvexport["Study Number"].isin(P3_STUDY)
+        ~main_uninvexport["Study Number"].isin(p3_study)
     ]
     # send_data(f"BioTRACS_Merck_INV_Sampled_{file_time}.csv", main_inv_export)
 
     # send_data(f"BioTRACS_Merck_NINV_Sampled_{file_time}.csv", main_uninvexport)
 
-    p3_export = export[export["Study Number"].isin(P3_STUDY)]
+    p3_export = export[export["Study Number"].isin(p3_study)]
     p3_inv_export = p3_export[p3_export["Current Status"] == "In Inventory"]
     # p3_inv_export = export[export["Current Status"]=="In Inventory"]
     p3_uninv_export = p3_export[p3_export["Current Status"] != "In Inventory"]
@@ -1303,7 +1121,847 @@ def fetch_data():
     # p3_export = export[export["Study Number"].isin(P3_STUDY)]
     # send_data(f"BioTRACS_Merck_INV_Sampled_{file_time}.csv", main_export)
     # send_data(f"BioTRACS_Merck_INV_Sampled_P3_{file_time}.csv", p3_export)
+    return {
+        "main": main_export,
+        "main_inv": main_inv_export,
+        "main_inv_nonp3": main_inv_export_nonp3,
+        "main_ninv": main_uninvexport,
+        "main_ninv_nonp3": main_uninvexport_nonp3,
+        "p3": p3_export,
+        "p3_inv": p3_inv_export,
+        "p3_ninv": p3_uninv_export,
+    }
+
+
+def source_fingerprint():
+    # Change detection for the extraction inputs: the per-code source digests,
+    # so in-place edits show up too (QC rows have no change timestamps)
+    statements = [str(query.statement) for query in extraction_queries().values()]
+    digests = pd.util.hash_pandas_object(source_digests(), index=False)
+    return fingerprint(statements, digests.tolist())
+
+
+def code_fingerprint(settings=SETTINGS):
+    # This script and every merck_feed_* module it loaded: checkpoints and
+    # the cold tier are only reused by the code that wrote them
+    paths = [__file__] + [
+        module.__file__
+        for name, module in list(sys.modules.items())
+        if name.startswith("merck_feed_") and getattr(module, "__file__", None)
+    ]
+    sources = {}
+    for path in paths:
+        with open(path) as f:
+            sources[os.path.basename(path)] = f.read()
+    return fingerprint(
+        sources,
+        settings["backend"],
+        settings["schema"],
+        EXPORT_TABLE_MODE,
+        SAMPLE_PER_STRATUM,
+        SAMPLE_IDS,
+        COLD_TIER_DIR,
+        COLD_TIER_DAYS,
+        settings["shards"],
+        MAPPINGS.digest,
+    )
+
+
+def should_resume(context):
+    if RESUME_MODE == "always":
+        return True
+    task_instance = context.get("ti")
+    return RESUME_MODE == "retry" and bool(
+        task_instance and task_instance.try_number > 1
+    )
+
+
+def export_table_watermarks():
+    watermarks = {}
+    for model in (Accessioning, Aliquot, QualityControl, StatusUpdates):
+        for column in CHANGE_COLUMNS:
+            if hasattr(model, column):
+                latest = (
+                    db.query(func.max(getattr(model, column)))
+                    .filter(model.client == "MERCK")
+                    .scalar()
+                )
+                watermarks[f"{model.__tablename__}.{column}"] = latest
+    return watermarks
+
+
+def changed_code_queries(watermarks):
+    queries = {}
+    for model in (Accessioning, Aliquot, QualityControl, StatusUpdates):
+        changed = [
+            getattr(model, column) > pd.Timestamp(watermarks[key]).to_pydatetime()
+            for column in CHANGE_COLUMNS
+            for key in [f"{model.__tablename__}.{column}"]
+            if hasattr(model, column) and watermarks.get(key) is not None
+        ]
+        if changed:
+            queries[model.__tablename__] = (
+                db.query(model.inventory_code)
+                .filter(model.client == "MERCK")
+                .filter(or_(*changed))
+            )
+    return queries
+
+
+def changed_inventory_codes(watermarks):
+    codes = set()
+    for query in changed_code_queries(watermarks).values():
+        codes.update(code for (code,) in query)
+    return codes
+
+
+def lineage_queries(batch):
+    return {
+        "acc": db.query(Accessioning.inventory_code)
+        .filter(Accessioning.client == "MERCK")
+        .filter(Accessioning.inventory_code.in_(batch)),
+        "ali": db.query(Aliquot.ultimate_parent)
+        .filter(Aliquot.client == "MERCK")
+        .filter(Aliquot.inventory_code.in_(batch)),
+    }
+
+
+def lineage_codes(codes):
+    # Accession inventory_codes owning the given accession / aliquot codes
+    codes, roots = sorted(codes), set()
+    for start in range(0, len(codes), 500):
+        batch = codes[start : start + 500]
+        for query in lineage_queries(batch).values():
+            roots.update(code for (code,) in query)
+    roots.discard(None)
+    return roots
+
+
+def table_missing_status():
+    # SQL form of the table-wide has_missing_status checks in validate_tables,
+    # so a partial refresh pads / maps exactly like a full run
+    def missing(model, *filters):
+        return (
+            db.query(model.inventory_code)
+            .filter(model.client == "MERCK")
+            .filter(or_(model.status.is_(None), ~model.status.in_(list(STATUS_MAP))))
+            .filter(
+                or_(
+                    model.container_type.is_(None),
+                    model.source.is_(None),
+                    model.container_type != "Micronic 1.4",
+                    model.source != "WB",
+                )
+            )
+            .filter(*filters)
+            .first()
+            is not None
+        )
+
+    return {
+        "acc": missing(Accessioning),
+        "ali": missing(
+            Aliquot,
+            or_(
+                Aliquot.container_type.is_(None),
+                Aliquot.container_type != "BloodSpotCard",
+            ),
+        ),
+    }
+
+
+def source_digests():
+    # Digest of the source rows behind every (table, inventory_code): their
+    # count and newest change timestamps, or for a table without change
+    # columns (QC) a hash of their contents, so edits, inserts and deletes
+    # all show up as a changed digest
+    frames = []
+    for source, model in (
+        ("acc", Accessioning),
+        ("ali", Aliquot),
+        ("qc", QualityControl),
+        ("su", StatusUpdates),
+    ):
+        changes = [
+            func.max(getattr(model, column))
+            for column in CHANGE_COLUMNS
+            if hasattr(model, column)
+        ]
+        if changes:
+            query = (
+                db.query(model.inventory_code, func.count(), *changes)
+                .filter(model.client == "MERCK")
+                .group_by(model.inventory_code)
+            )
+            parts = pd.read_sql(query.statement, db.bind)
+            codes = parts.iloc[:, 0]
+            parts = parts.iloc[:, 1:]
+        else:
+            query = db.query(model).filter(model.client == "MERCK")
+            rows = pd.read_sql(query.statement, db.bind)
+            hashes = pd.util.hash_pandas_object(rows.astype(str), index=False)
+            hashes = hashes.to_numpy()
+            parts = pd.DataFrame(
+                {
+                    "rows": np.ones(len(hashes), dtype=np.int64),
+                    "low": (hashes & 0xFFFFFFFF).astype(np.int64),
+                    "high": (hashes >> 32).astype(np.int64),
+                }
+            )
+            parts = parts.groupby(rows["inventory_code"].to_numpy()).sum()
+            codes = parts.index.to_series()
+        parts = parts.astype(str)
+        digest = parts.iloc[:, 0].str.cat(
+            [parts.iloc[:, i] for i in range(1, parts.shape[1])], sep="|"
+        )
+        frames.append(
+            pd.DataFrame({"source": source, "code": codes.to_numpy(), "digest": digest})
+        )
+    digests = pd.concat(frames, ignore_index=True)
+    return digests[digests["code"].notna()].reset_index(drop=True)
+
+
+def changed_sources(stored, digests):
+    # (source, code) pairs whose digest changed, or that appeared or were
+    # deleted since the stored digests
+    both = stored.merge(
+        digests, on=["source", "code"], how="outer", suffixes=("_stored", "")
+    )
+    changed = both[both["digest_stored"].ne(both["digest"])]
+    return changed[["source", "code"]].reset_index(drop=True)
+
+
+def row_ids(frame, model):
+    # Primary key of the first row of every inventory_code
+    key = model.__table__.primary_key.columns.keys()[0]
+    frame = frame.drop_duplicates("inventory_code")
+    return pd.Series(frame[key].to_numpy(), index=frame["inventory_code"].to_numpy())
+
+
+def export_order(acc_ids, ali_ids, export, lineage):
+    # Sort keys putting export rows in the order join_tables gives them on a
+    # full extraction: aliquot rows by lineage (in order of its first
+    # aliquot), then by aliquot; then accession rows; each by primary key
+    codes = export["Specimen ID"].reset_index(drop=True)
+    aliquot = codes.isin(ali_ids.index).to_numpy()
+    item = pd.Series(np.where(aliquot, codes.map(ali_ids), codes.map(acc_ids)))
+    item = item.astype(float).fillna(0).astype(np.int64)
+    lineages = pd.Series(lineage, dtype=object).fillna("")
+    first = item.where(aliquot).groupby(lineages).transform("min")
+    group = item.where(~aliquot, first).astype(np.int64)
+    copy = codes.groupby(codes.fillna("")).cumcount()
+    return [
+        f"{int(not ali)}{first:020d}{row:020d}{dup:06d}"
+        for ali, first, row, dup in zip(aliquot, group, item, copy)
+    ]
+
+
+def build_export_rows(accession_codes=None, missing_status=None, settings=SETTINGS):
+    tables = extract_tables(accession_codes, settings=settings)
+    parents = dict(
+        zip(tables["ali"]["inventory_code"], tables["ali"]["ultimate_parent"])
+    )
+    acc_ids = row_ids(tables["acc"], Accessioning)
+    ali_ids = row_ids(tables["ali"], Aliquot)
+    export = join_tables(validate_tables(tables, missing_status, settings=settings))
+    lineage = [parents.get(code, code) for code in export["Specimen ID"]]
+    return export, lineage, export_order(acc_ids, ali_ids, export, lineage)
+
+
+def refresh_export_table(full=False):
+    primary = CONNECTIONS.primary
+    tables = migrate_export_table(primary, BIOTRACS.stored)
+    export_table, state, sources = tables
+    watermarks = read_state(primary, state, "watermarks")
+    flags = table_missing_status()
+    current = export_table_watermarks()
+    digests = source_digests()
+    stored = read_sources(primary, sources)
+    # A flipped table-wide flag, new mappings or another ingest schema setting
+    # change every row, so they force a rebuild; so does a table without
+    # source digests yet
+    rebuild = (
+        full
+        or watermarks is None
+        or stored.empty
+        or read_state(primary, state, "flags") != flags
+        or read_state(primary, state, "mappings") != MAPPINGS.digest
+        or read_state(primary, state, "schema") != SETTINGS["schema"]
+    )
+    if not rebuild:
+        changed = changed_sources(stored, digests)
+        if changed.empty:
+            event("export_table_up_to_date")
+            return
+        # Without the ingest schema a subset of a table infers other dtypes
+        # than the whole table, so only a full build gives the feed's rows
+        rebuild = not SETTINGS["schema"]
+    if rebuild:
+        export, lineage, order = build_export_rows(missing_status=flags)
+        replace_rows(
+            primary,
+            tables,
+            export,
+            lineage,
+            order,
+            digests=digests,
+            watermarks=current,
+            flags=flags,
+            mappings=MAPPINGS.digest,
+            schema=SETTINGS["schema"],
+            columns=list(export.columns),
+        )
+        event("export_table_rebuilt", shape=export.shape)
+        update_summary(None, current, lambda: export)
+        return
+    # The lineages the changed codes belong to now, and those their stored
+    # rows belong to (all a deleted code still has)
+    codes = set(changed["code"])
+    roots = lineage_codes(codes) | stored_lineages(
+        primary, export_table, "Specimen ID", codes
+    )
+    export, lineage, order = build_export_rows(sorted(roots), flags)
+    removed = None
+    if SUMMARY_DIR:
+        summary_columns = DIMENSIONS + [YIELD]
+        removed = read_lineages(primary, export_table, summary_columns, roots)
+    replace_rows(
+        primary,
+        tables,
+        export,
+        lineage,
+        order,
+        roots,
+        digests=digests.merge(changed, on=["source", "code"]),
+        changed=changed,
+        watermarks=current,
+    )
+    update_summary(watermarks, current, read_export_table, removed, export)
+    event("export_table_refreshed", lineages=len(roots), shape=export.shape)
+
+
+def lineage_last_change(tables):
+    # Newest change timestamp of every lineage across the extracted tables
+    parents = dict(
+        zip(tables["ali"]["inventory_code"], tables["ali"]["ultimate_parent"])
+    )
+    latest = []
+    for name, frame in tables.items():
+        columns = [column for column in CHANGE_COLUMNS if column in frame.columns]
+        if not columns or frame.empty:
+            continue
+        codes = frame["ultimate_parent" if name == "ali" else "inventory_code"]
+        if name in ("qc", "su"):
+            codes = codes.map(lambda code: parents.get(code, code))
+        # Naive UTC, so aware and naive columns compare with each other and
+        # with the cutoff
+        stamps = pd.concat([utc_naive(frame[c]) for c in columns], axis=1)
+        latest.append(pd.Series(stamps.max(axis=1).to_numpy(), index=codes.to_numpy()))
+    if not latest:
+        return pd.Series([], dtype="datetime64[ns]")
+    return pd.concat(latest).groupby(level=0).max()
+
+
+def cold_tier_export():
+    cold = ColdTier(COLD_TIER_DIR, CONNECTIONS.primary)
+    flags = table_missing_status()
+    key = code_fingerprint()
+    # Frozen rows were built by this code under these table-wide flags
+    if cold.state.get("flags") != flags or cold.state.get("key") != key:
+        cold.thaw()
+    elif cold.state.get("watermarks"):
+        changed = lineage_codes(changed_inventory_codes(cold.state["watermarks"]))
+        promoted = cold.thaw(changed)
+        event("cold_tier_promoted", lineages=len(promoted))
+    cold.sync()
+    current = export_table_watermarks()
+
+    # The exclusion subquery reads merck_feed_cold, just written on the
+    # primary; a lagging replica would still exclude promoted lineages
+    tables = extract_tables(exclude=cold.codes(), bind=CONNECTIONS.primary)
+    last_change = lineage_last_change(tables)
+    parents = dict(
+        zip(tables["ali"]["inventory_code"], tables["ali"]["ultimate_parent"])
+    )
+    export = join_tables(validate_tables(tables, flags))
+    lineage = [parents.get(code, code) for code in export["Specimen ID"]]
+
+    terminal = (
+        export["Current Status"].map(lambda status: STATUS_MAP.get(status, status))
+        == "Exhausted"
+    )
+    terminal = terminal.groupby(lineage).all()
+    now = utc_naive(pd.Timestamp.now(tz="UTC"))
+    cutoff = now - pd.Timedelta(days=COLD_TIER_DAYS)
+    stable = last_change.reindex(terminal.index) <= cutoff
+    frozen = set(terminal.index[terminal.to_numpy() & stable.to_numpy()])
+    export = cold.freeze(export, lineage, frozen)
+    cold.save(flags=flags, key=key, watermarks=current)
+    event("cold_tier_frozen", lineages=len(frozen), total=len(cold.lineages()))
+    return pd.concat(
+        [export, cold.export(export.columns)], ignore_index=True, sort=False
+    )
+
+
+def shard_run_dir(file_time):
+    return os.path.join(SHARD_DIR, file_time)
+
+
+def shard_codes(start, end):
+    # Accessions of one shard as a code range, selected by the database over
+    # the (client, inventory_code) index
+    query = db.query(Accessioning.inventory_code).filter(Accessioning.client == "MERCK")
+    if start is not None:
+        query = query.filter(Accessioning.inventory_code >= start)
+    if end is not None:
+        query = query.filter(Accessioning.inventory_code < end)
+    return query.statement
+
+
+def plan_shards(run_dir, settings=SETTINGS):
+    # Boundaries are every n-th accession code in the database's own order,
+    # so the ranges partition the codes under its collation
+    codes = (
+        db.query(Accessioning.inventory_code)
+        .filter(Accessioning.client == "MERCK")
+        .filter(Accessioning.inventory_code.isnot(None))
+        .order_by(Accessioning.inventory_code)
+    )
+    total = codes.count()
+    shards = min(settings["shards"], total)
+    bounds = [
+        codes.offset(shard * total // shards).limit(1).scalar()
+        for shard in range(1, shards)
+    ]
+    # Repeated codes would leave a shard empty
+    starts = [None] + list(dict.fromkeys(bounds))
+    # The status flags are table-wide, so every shard validates with the
+    # values of the whole table; shard tasks also run with the plan's settings
+    write_plan(run_dir, starts, flags=table_missing_status(), settings=settings)
+
+
+def run_shard(run_dir, shard):
+    bounds, state = read_plan(run_dir, shard)
+    if bounds is None:
+        return 0
+    selected, settings = shard_codes(*bounds), state["settings"]
+    tables = extract_tables(selected, settings=settings)
+    export = join_tables(
+        validate_tables(tables, state["flags"], settings=settings), settings=settings
+    )
+    write_shard(run_dir, shard, export)
+    event("shard_done", shard=shard, rows=len(export))
+    return len(export)
+
+
+def reset_connection():
+    # Forked shard workers must not share the parent's database connections
+    global db
+    CONNECTIONS.after_fork()
+    db = CONNECTIONS.session()
+
+
+def start_shard_pool(workers):
+    # Called before anything starts a thread; the log writer is paused so
+    # the validation workers fork from a single-threaded process
+    with writer_paused():
+        started = SHARD_POOL.start(workers)
+    if workers > 1 and not started:
+        event("validation_serial", WARNING, reason="other threads are running")
+
+
+def end_run():
+    # Closes the run's session and connections; the next run starts a fresh
+    # session
+    global db
+    SHARD_POOL.stop()
+    db.close()
+    CONNECTIONS.close()
+    db = CONNECTIONS.session()
+
+
+def distributed_export(run_dir, resume=False, settings=SETTINGS):
+    # Local stand-in for plan -> mapped shard tasks -> reduce; a resumed run
+    # keeps the plan and only runs the shards that have no output yet
+    if not resume:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    if not os.path.exists(os.path.join(run_dir, "plan.json")):
+        plan_shards(run_dir, settings)
+    pending = [
+        shard
+        for shard in range(len(read_plan(run_dir)["starts"]))
+        if not os.path.exists(shard_path(run_dir, shard))
+    ]
+    db.close()
+    # The shard workers fork; the log writer thread must not be running
+    with writer_paused():
+        run_local(
+            lambda shard: run_shard(run_dir, shard),
+            pending,
+            settings["shard_workers"],
+            reset_connection,
+        )
+    return read_shards(run_dir)
+
+
+def source_estimates():
+    # Row counts plus the in-memory width of a small sample of each table
+    estimates = {}
+    for name, query in extraction_queries().items():
+        rows = query.order_by(None).count()
+        sample = pd.read_sql(query.limit(PLANNER_SAMPLE_ROWS).statement, db.bind)
+        if "meta" in sample.columns:
+            meta = pd.DataFrame(list(sample["meta"]), index=sample.index)
+            sample = pd.concat([sample.drop(columns=["meta"]), meta], axis=1)
+        width = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+        estimates[name] = {"rows": rows, "bytes": int(rows * width)}
+    return estimates
+
+
+def run_settings(decision):
+    # The execution settings of a planned run; what the planner does not
+    # choose stays as configured
+    return {
+        **SETTINGS,
+        "backend": "arrow" if decision["mode"] == "streaming" else "object",
+        "fetch_size": decision["chunk_size"],
+        "validation_workers": 1 if decision["shards"] else decision["workers"],
+        "shards": decision["shards"],
+        "shard_workers": decision["workers"],
+    }
+
+
+def feed_queries():
+    # The statements a run generates, by name, for the index advisor; code
+    # lists and watermarks are stand-ins. The full (and hot tier) extraction
+    # reads every row of the client by design, so a scan is its right plan and
+    # it is listed separately
+    queries, full_reads = {}, {}
+    codes = bindparam("shard_codes", ["A0"], expanding=True, literal_execute=True)
+    subsets = {
+        "extract": None,
+        "extract lineages": codes,
+        "extract shard": shard_codes("A0", "A1"),
+    }
+    for label, selected in subsets.items():
+        for name, query in extraction_queries(selected).items():
+            target = full_reads if selected is None else queries
+            target[f"{label} {name}"] = query.statement
+    # The advisor only reads: no cold table yet means no hot tier queries
+    if COLD_TIER_DIR and inspect(CONNECTIONS.primary).has_table(COLD_TABLE):
+        cold = ColdTier(COLD_TIER_DIR, CONNECTIONS.primary)
+        hot = extraction_queries(exclude=cold.codes())
+        for name, query in hot.items():
+            full_reads[f"extract hot {name}"] = query.statement
+    for name, query in lineage_queries(["A0", "A1"]).items():
+        queries[f"lineage {name}"] = query.statement
+    watermarks = {
+        f"{model.__tablename__}.{column}": datetime(2000, 1, 1)
+        for model in (Accessioning, Aliquot, QualityControl, StatusUpdates)
+        for column in CHANGE_COLUMNS
+    }
+    for name, query in changed_code_queries(watermarks).items():
+        queries[f"changed {name}"] = query.statement
+    return queries, full_reads
+
+
+def index_report(apply=False):
+    # Prints the plan of every feed query and the missing index migrations;
+    # returns {query: [tables read without an index]} for the queries that
+    # should not read a whole table
+    wanted = [(model.__table__, columns) for model, columns in FEED_INDEXES]
+    # Migrations run on the primary, the plans are the reads' own
+    missing = missing_indexes(CONNECTIONS.primary, wanted)
+    if missing:
+        print("MISSING INDEXES:\n" + index_ddl(CONNECTIONS.primary, missing))
+        if apply:
+            create_indexes(CONNECTIONS.primary, missing)
+            print("INDEXES CREATED: ", len(missing))
+    tables = {table.name for table, _ in wanted}
+    findings = {}
+    queries, full_reads = feed_queries()
+    with db.bind.connect() as connection:
+        for name, statement in {**full_reads, **queries}.items():
+            # A lookup on the client alone still reads every feed row
+            steps = explain(connection, statement, broad=["client"])
+            for step in steps:
+                print(f"PLAN {name}: {step['access']} {step['detail']}")
+            if name in queries and full_scans(steps, tables):
+                findings[name] = full_scans(steps, tables)
+        # Rows per join key, client plus the first key column
+        for table, columns in wanted:
+            fanout = key_fanout(
+                connection, table, columns[:2], table.c.client == "MERCK"
+            )
+            print(
+                f"FAN-OUT {table.name}({', '.join(columns[:2])}): "
+                f"{fanout['rows']} rows over {fanout['keys']} keys, "
+                f"up to {fanout['max']} per key"
+            )
+    return findings
+
+
+def read_export_table():
+    primary = CONNECTIONS.primary
+    export_table, state, _ = migrate_export_table(primary, BIOTRACS.stored)
+    columns = read_state(primary, state, "columns") or BIOTRACS.stored
+    return read_export(primary, export_table, columns)
+
+
+def resident_refresh(state):
+    # In-memory counterpart of refresh_export_table for the feed service
+    db.rollback()  # new transaction, so the refresh sees what was committed
+    flags = table_missing_status()
+    current = export_table_watermarks()
+    digests = source_digests()
+    rebuild = refresh_mappings() or state.get("flags") != flags
+    if not rebuild:
+        codes = set(changed_sources(state["digests"], digests)["code"])
+        held = pd.Series(state["lineage"], dtype=object)
+        roots = lineage_codes(codes) | set(
+            held[state["export"]["Specimen ID"].isin(codes).to_numpy()]
+        )
+        # As in refresh_export_table: partial builds need the ingest schema
+        rebuild = bool(roots) and not SETTINGS["schema"]
+    if rebuild:
+        rows = build_export_rows(missing_status=flags)
+        state["export"], state["lineage"], state["order"] = rows
+        event("resident_export_rebuilt", shape=state["export"].shape)
+        update_summary(None, current, lambda: state["export"])
+    elif roots:
+        export, lineage, order = build_export_rows(sorted(roots), flags)
+        keep = ~held.isin(roots).to_numpy()
+        update_summary(
+            state["watermarks"],
+            current,
+            lambda: pd.concat([state["export"][keep], export]),
+            state["export"][~keep],
+            export,
+        )
+        # Back in full run order
+        order = [key for key, kept in zip(state["order"], keep) if kept] + order
+        rows = np.argsort(np.array(order, dtype=object), kind="stable")
+        state["export"] = pd.concat(
+            [state["export"][keep], export], ignore_index=True
+        ).iloc[rows]
+        state["export"] = state["export"].reset_index(drop=True)
+        lineage = held[keep].tolist() + lineage
+        state["lineage"] = [lineage[row] for row in rows]
+        state["order"] = [order[row] for row in rows]
+        event("resident_export_refreshed", lineages=len(roots))
+    state.update(flags=flags, watermarks=current, digests=digests)
+
+
+def resident_export(state, file_time=None, directory=None):
+    if file_time is None:
+        now = datetime.now(timezone("America/New_York"))
+        file_time = now.strftime("%Y%m%d_%H%M%S")
+    files = partition_export(state["export"])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name, frame in files.items():
+            file_name = csv_name(
+                f"BioTRACS_Merck_{name}_{file_time}.csv", CSV_COMPRESSION
+            )
+            with open(os.path.join(directory, file_name), "wb") as f:
+                write_csv(frame, f, CSV_COMPRESSION, CSV_WORKERS, layout=BIOTRACS)
+    # The refreshes keep the summary current
+    publish(files, file_time, state["export"], summary=False)
+    return {name: len(frame) for name, frame in files.items()}
+
+
+def update_summary(watermarks, current, full, removed=None, added=None):
+    # removed / added: old and new rows of the refreshed lineages. Deltas only
+    # apply to a summary of the rows as of these watermarks; otherwise it is
+    # recomputed from full(), the whole export
+    if not SUMMARY_DIR or is_sampling():
+        return
+    summary = FeedSummary(SUMMARY_DIR)
+    watermarks = json.loads(json.dumps(watermarks, default=str))
+    if added is not None and watermarks and summary.state.get("as_of") == watermarks:
+        summary.update(removed, added)
+        how = "delta"
+    else:
+        summary.replace(full())
+        how = "full"
+    summary.save(as_of=current, updated=datetime.now().isoformat(timespec="seconds"))
+    event("summary_updated", how=how, groups=len(summary.groups))
+
+
+def publish(files, file_time, export, summary=True):
+    if SNAPSHOT_DIR and not is_sampling():
+        event("snapshot", path=write_snapshot(SNAPSHOT_DIR, export, file_time))
+    if summary:
+        update_summary(None, None, lambda: export)
+    if STUDY_OUTPUT_DIR and not is_sampling():
+        changed = write_study_files(
+            export,
+            STUDY_OUTPUT_DIR,
+            file_time,
+            MAPPINGS.get("p3_study"),
+            OUTPUT_WORKERS,
+            CSV_COMPRESSION,
+            BIOTRACS,
+        )
+        event("study_files_rewritten", count=len(changed), files=changed)
+    if UPLOAD_BACKEND != "off" and not is_sampling():
+        event("uploaded", files=upload_files(files, file_time))
+
+
+def refresh_mappings():
+    # A new mapping store version applies from the next run, never mid-run
+    changed = MAPPINGS.refresh()
+    if changed:
+        event("mappings_loaded", version=MAPPINGS.version, digest=MAPPINGS.digest)
+    return changed
+
+
+def fetch_data():
+    try:
+        return run_feed()
+    finally:
+        end_run()
+
+
+def run_feed():
+    # Step 1: Get Context for client and project
+    context = get_current_context()
+    tz = timezone("America/New_York")
+    start_time = context["execution_date"]
+    file_time = (
+        start_time.astimezone(tz=tz).replace(tzinfo=None).strftime("%Y%m%d_%H%M%S")
+    )
+    refresh_mappings()
+    if AS_OF:
+        write_asof_exports(AS_OF, AS_OF_DIR)
+        return True
+    # If iterative file, need to check edits to fetch INV CODES edited within the last N days
+    run_key = f"{file_time}_sample" if is_sampling() else file_time
+    resume = should_resume(context)
+    planner = decision = None
+    settings = SETTINGS
+    if PLANNER and not is_sampling():
+        planner = Planner(PLANNER_HISTORY, MEMORY_BUDGET_MB << 20, CPU_BUDGET)
+        decision = resume and planner.decision(run_key)
+        decision = decision or planner.plan(run_key, source_estimates())
+        settings = run_settings(decision)
+        event("execution_plan", plan=describe(decision))
+    # Sharded runs validate in their shard processes
+    if not settings["shards"]:
+        start_shard_pool(settings["validation_workers"])
+    checkpoints = Checkpoints(CHECKPOINT_DIR, run_key, resume)
+    keys = {}
+    if CHECKPOINT_DIR:
+        source_key, code_key = source_fingerprint(), code_fingerprint(settings)
+        for stage in ("extracted", "validated", "export", "files"):
+            keys[stage] = fingerprint(stage, source_key, code_key)
+
+    # Each stage only pulls its input (from checkpoint or by rebuilding) when
+    # its own checkpoint cannot be reused
+    def extracted():
+        return checkpoints.stage(
+            "extracted",
+            keys.get("extracted"),
+            lambda: extract_tables(settings=settings),
+        )
+
+    def validated():
+        return checkpoints.stage(
+            "validated",
+            keys.get("validated"),
+            lambda: validate_tables(extracted(), settings=settings),
+        )
+
+    def exported():
+        if EXPORT_TABLE_MODE != "off" and not is_sampling():
+            if EXPORT_TABLE_MODE == "refresh":
+                refresh_export_table()
+            return read_export_table()
+        if COLD_TIER_DIR and not is_sampling():
+            return checkpoints.stage("export", keys.get("export"), cold_tier_export)
+        if settings["shards"] and not is_sampling():
+            return checkpoints.stage(
+                "export",
+                keys.get("export"),
+                lambda: distributed_export(shard_run_dir(file_time), resume, settings),
+            )
+        return checkpoints.stage(
+            "export",
+            keys.get("export"),
+            lambda: join_tables(validated(), settings=settings),
+        )
+
+    # Built (or loaded) once per run; the files and every publish step use it
+    export = exported()
+    files = checkpoints.stage(
+        "files", keys.get("files"), lambda: partition_export(export)
+    )
+    # Export table refreshes keep the summary current themselves
+    publish(files, file_time, export, summary=EXPORT_TABLE_MODE == "off")
+    if decision:
+        event("execution_measured", plan=describe(planner.finish(decision, resume)))
+    # send_data(f"BioTRACS_Merck_INV_Sampled_{file_time}.csv", files["main_inv"])
+    # send_data(f"BioTRACS_Merck_NINV_Sampled_{file_time}.csv", files["main_ninv"])
     return True
 
 
-fetch_data()
+def main(argv=None):
+    # "run" is the scheduled job; "serve" keeps the feed resident and the
+    # other commands are sent to a running service
+    parser = argparse.ArgumentParser(description="Merck BioTRACS data feed")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=["run", "serve", "export", "refresh", "status"]
+        + ["plan", "shard", "reduce", "indexes"],
+    )
+    parser.add_argument("--socket", default=SERVICE_SOCKET)
+    parser.add_argument("--directory", help="also write the export files here")
+    parser.add_argument("--file-time", help="file name timestamp, default now")
+    parser.add_argument("--shard", type=int, help="shard number for 'shard'")
+    parser.add_argument(
+        "--apply", action="store_true", help="create missing indexes for 'indexes'"
+    )
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return fetch_data()
+    if args.command in ("plan", "shard", "reduce"):
+        # Task bodies for a DAG that maps the shards over its workers:
+        # plan, then "shard --shard n" for n < MERCK_FEED_SHARDS, then reduce
+        if not args.file_time:
+            parser.error(f"{args.command} needs --file-time")
+        run_dir = shard_run_dir(args.file_time)
+        if args.command == "plan":
+            shutil.rmtree(run_dir, ignore_errors=True)
+            return plan_shards(run_dir)
+        if args.command == "shard":
+            return run_shard(run_dir, args.shard)
+        export = read_shards(run_dir)
+        publish(partition_export(export), args.file_time, export)
+        return
+    if args.command == "indexes":
+        # Query plan regression check: fails while a feed query still reads
+        # a whole feed table
+        findings = index_report(args.apply)
+        for name, tables in findings.items():
+            print(f"FULL SCAN {name}: {', '.join(tables)}")
+        if findings:
+            parser.exit(1, f"{len(findings)} feed queries read a whole table\n")
+        return
+    if args.command == "serve":
+        start_shard_pool(SETTINGS["validation_workers"])
+        service = FeedService(
+            resident_refresh, {"export": resident_export}, SERVICE_INTERVAL
+        )
+        return serve(service, args.socket)
+    arguments = {}
+    if args.command == "export":
+        arguments = {"directory": args.directory, "file_time": args.file_time}
+    print(json.dumps(request(args.socket, args.command, **arguments), indent=1))
+
+
+if __name__ == "__main__":
+    main()
+else:
+    fetch_data()
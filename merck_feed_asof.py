@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+
+def utc_naive(values):
+    # Timestamps (a Series or one value) as naive UTC so they compare: aware
+    # ones are converted, naive ones are taken to be UTC already
+    if isinstance(values, pd.Series):
+        if isinstance(values.dtype, pd.ArrowDtype):
+            values = values.astype(object)
+        values = pd.to_datetime(values, errors="coerce", utc=True)
+        return values.dt.tz_localize(None)
+    value = pd.Timestamp(values)
+    return value.tz_convert("UTC").tz_localize(None) if value.tzinfo else value
+
+
+class StatusTimeline:
+    # Per-specimen index over the full StatusUpdates history. The rows are
+    # sorted once by (specimen, date_updated); as_of(T) then finds each
+    # specimen's last update at or before T with one vectorized searchsorted,
+    # so any number of snapshots cost a single extraction and sort.
+    def __init__(self, history, key="Specimen ID", on="date_updated"):
+        history = history[history[on].notna()]
+        times = utc_naive(history[on]).to_numpy("datetime64[ns]")
+        order = np.lexsort((times, history[key].to_numpy()))
+        self.history = history.iloc[order]
+        self.times = np.unique(times)
+        codes = self.history[key].to_numpy()
+        # Dense time ranks let (specimen, time) pack into one sortable int64
+        ranks = np.searchsorted(self.times, times[order])
+        _, self.starts, groups = np.unique(
+            codes, return_index=True, return_inverse=True
+        )
+        self.width = len(self.times) + 1
+        self.packed = groups.astype(np.int64) * self.width + ranks
+
+    def as_of(self, timestamp):
+        if not len(self.history):
+            return self.history
+        rank = (
+            np.searchsorted(self.times, np.datetime64(utc_naive(timestamp)), "right")
+            - 1
+        )
+        groups = np.arange(len(self.starts), dtype=np.int64)
+        positions = (
+            np.searchsorted(self.packed, groups * self.width + rank, "right") - 1
+        )
+        # A specimen with no update yet at T has its match in the previous group
+        positions = positions[(rank >= 0) & (positions >= self.starts)]
+        return self.history.iloc[positions]
+
+    def snapshots(self, timestamps):
+        for timestamp in timestamps:
+            yield timestamp, self.as_of(timestamp)
+
+
+def parse_as_of(value):
+    # "2023-01-31" | "2023-01-01,2023-02-01" | "2023-01-01..2023-01-31" (daily)
+    timestamps = []
+    for part in value.split(","):
+        part = part.strip()
+        if ".." in part:
+            start, end = part.split("..")
+            timestamps.extend(pd.date_range(start, end, freq="D"))
+        elif part:
+            timestamps.append(pd.Timestamp(part))
+    # A bare date means "as of the end of that day"
+    return [
+        ts + pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+        if ts == ts.normalize()
+        else ts
+        for ts in sorted(set(timestamps))
+    ]
@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+# Dataframe backends for the su dedupe in run_su_validation and the merge
+# chain in join_tables. Both backends order their results with the same
+# explicit sort, so the export files are byte-identical whichever one runs:
+# - latest: the last row of every key after a stable sort on `by`, rows in
+#   that sorted order
+# - merge: matched row pairs by (first left row of the key, left row, right
+#   row) for inner joins, which is the order pandas 1.5 gives, and by (left
+#   row, right row) for left joins
+# "polars" computes the row positions on Polars' multithreaded lazy engine
+# and assembles the result with pandas takes, so columns, dtypes and NaN
+# filling stay those of pandas. Keys Polars cannot hold unchanged (mixed
+# object columns, differing key dtypes) fall back to the pandas path.
+
+FIRST_ROW = "__first_row__"
+LEFT_ROW = "__left_row__"
+RIGHT_ROW = "__right_row__"
+
+
+class PandasBackend:
+    name = "pandas"
+
+    def latest(self, frame, key, by):
+        return frame.sort_values(by, kind="stable").drop_duplicates(
+            subset=[key], keep="last"
+        )
+
+    def merge(
+        self,
+        left,
+        right,
+        how="inner",
+        on=None,
+        left_on=None,
+        right_on=None,
+        suffixes=("_x", "_y"),
+    ):
+        if how not in ("inner", "left"):
+            return left.merge(
+                right,
+                how=how,
+                on=on,
+                left_on=left_on,
+                right_on=right_on,
+                suffixes=suffixes,
+            )
+        rows = pd.Series(np.arange(len(left)))
+        order = {LEFT_ROW: rows.to_numpy()}
+        if how == "inner":
+            keys = [left[column].to_numpy() for column in left_on or on]
+            first = rows.groupby(keys, dropna=False).transform("min")
+            order = {FIRST_ROW: first.to_numpy(), **order}
+        merged = left.assign(**order).merge(
+            right.assign(**{RIGHT_ROW: np.arange(len(right))}),
+            how=how,
+            on=on,
+            left_on=left_on,
+            right_on=right_on,
+            suffixes=suffixes,
+        )
+        order = list(order) + [RIGHT_ROW]
+        merged = merged.sort_values(order, kind="stable", na_position="last")
+        return merged.drop(columns=order).reset_index(drop=True)
+
+
+class PolarsBackend(PandasBackend):
+    name = "polars"
+
+    @staticmethod
+    def _frame(columns):
+        # Positional names: keys may share names across the two sides
+        import polars as pl
+
+        try:
+            return pl.from_pandas(
+                pd.DataFrame(
+                    {f"k{i}": values.to_numpy() for i, values in enumerate(columns)}
+                )
+            )
+        except (TypeError, ValueError, pl.exceptions.PolarsError):
+            return None
+
+    def latest(self, frame, key, by):
+        import polars as pl
+
+        keys = self._frame([frame[key], frame[by]])
+        if keys is None:
+            return super().latest(frame, key, by)
+        rows = (
+            keys.lazy()
+            .with_columns(pl.int_range(pl.len()).alias("row"))
+            .sort(["k1", "row"], nulls_last=True)
+            .filter(pl.col("row") == pl.col("row").last().over("k0"))
+            .select("row")
+            .collect()
+        )
+        return frame.take(rows["row"].to_numpy())
+
+    def join_rows(self, left, right, how, left_on, right_on):
+        import polars as pl
+
+        left_keys = self._frame([left[column] for column in left_on])
+        right_keys = self._frame([right[column] for column in right_on])
+        if left_keys is None or right_keys is None:
+            return None
+        if left_keys.schema != right_keys.schema:
+            return None
+        keys = list(left_keys.columns)
+        pairs = (
+            left_keys.lazy()
+            .with_columns(pl.int_range(pl.len()).alias("i"))
+            .join(
+                right_keys.lazy().with_columns(pl.int_range(pl.len()).alias("j")),
+                on=keys,
+                how=how,
+                nulls_equal=True,
+            )
+        )
+        if how == "inner":
+            pairs = pairs.with_columns(pl.col("i").min().over(keys).alias("first"))
+            pairs = pairs.sort(["first", "i", "j"])
+        else:
+            pairs = pairs.sort(["i", "j"], nulls_last=True)
+        pairs = pairs.select("i", pl.col("j").fill_null(-1)).collect()
+        return pairs["i"].to_numpy(), pairs["j"].to_numpy()
+
+    def merge(
+        self,
+        left,
+        right,
+        how="inner",
+        on=None,
+        left_on=None,
+        right_on=None,
+        suffixes=("_x", "_y"),
+    ):
+        plain = lambda: super(PolarsBackend, self).merge(
+            left, right, how, on, left_on, right_on, suffixes
+        )
+        left_on, right_on = left_on or on, right_on or on
+        if how not in ("inner", "left") or any(
+            left[a].dtype != right[b].dtype for a, b in zip(left_on, right_on)
+        ):
+            return plain()
+        # pandas keeps one copy of keys named the same on both sides and
+        # suffixes the other columns present on both sides
+        shared = [a for a, b in zip(left_on, right_on) if a == b]
+        kept = [column for column in right.columns if column not in shared]
+        overlap = set(left.columns) & set(kept)
+        left_suffix, right_suffix = (suffix or "" for suffix in suffixes)
+        if overlap and left_suffix == right_suffix:
+            return plain()
+        rows = self.join_rows(left, right, how, left_on, right_on)
+        # Empty results have their own column layout in pandas
+        if rows is None or not len(rows[0]):
+            return plain()
+        left_rows, right_rows = rows
+        columns = [
+            f"{column}{left_suffix}" if column in overlap else column
+            for column in left.columns
+        ] + [
+            f"{column}{right_suffix}" if column in overlap else column
+            for column in kept
+        ]
+        result_left = left.take(left_rows).reset_index(drop=True)
+        result_right = right[kept].reset_index(drop=True)
+        if (right_rows >= 0).all():
+            result_right = result_right.take(right_rows).reset_index(drop=True)
+        else:
+            result_right = result_right.reindex(right_rows).reset_index(drop=True)
+        result = pd.concat([result_left, result_right], axis=1)
+        result.columns = columns
+        return result
+
+
+BACKENDS = {"pandas": PandasBackend, "polars": PolarsBackend}
+
+
+def frame_backend(name):
+    return BACKENDS[name]()
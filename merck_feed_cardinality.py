@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+# Pre-join cardinality check. Join keys are hashed per row (NaN hashes equal
+# to NaN, like pandas merge matches missing keys), the multiplicities of both
+# sides come from one value_counts each, and the output size of the merge is
+# their dot product over the shared keys, all before the merge runs. The
+# fan-out compares it with the same join over unique right keys, so left rows
+# an inner join drops cannot hide the rows duplicated keys add.
+
+TOP_KEYS = 10
+
+
+def key_counts(frame, columns):
+    hashes = pd.util.hash_pandas_object(frame[columns], index=False)
+    return hashes, hashes.value_counts(sort=False)
+
+
+def estimate_join(left, right, left_on, right_on, how="inner", top=TOP_KEYS):
+    left_hashes, left_counts = key_counts(left, left_on)
+    right_hashes, right_counts = key_counts(right, right_on)
+    left_counts, right_counts = left_counts.align(right_counts, join="outer")
+    left_counts = left_counts.fillna(0).astype(np.int64)
+    right_counts = right_counts.fillna(0).astype(np.int64)
+
+    matched = left_counts * right_counts
+    rows = int(matched.sum())
+    if how in ("left", "outer"):
+        rows += int(left_counts[right_counts == 0].sum())
+    if how in ("right", "outer"):
+        rows += int(right_counts[left_counts == 0].sum())
+
+    # Offenders are matched keys repeated on the right, which multiply the
+    # left rows; ranked by the rows they add over a many-to-one match
+    added = left_counts * (right_counts - 1).clip(lower=0)
+    added = added[added > 0].sort_values(ascending=False, kind="stable")
+    first = pd.Series(np.arange(len(right_hashes)), index=right_hashes.to_numpy())
+    first = first[~first.index.duplicated()]
+    offenders = right.iloc[first[added.index[:top]].to_numpy()][right_on]
+    offenders = offenders.reset_index(drop=True).assign(
+        left_rows=left_counts[added.index[:top]].to_numpy(),
+        right_rows=right_counts[added.index[:top]].to_numpy(),
+        added_rows=added[:top].to_numpy(),
+    )
+    added_rows = int(added.sum())
+    return {
+        "left_rows": len(left),
+        "right_rows": len(right),
+        "rows": rows,
+        "fanout": rows / max(rows - added_rows, 1),
+        "duplicated_keys": len(added),
+        "added_rows": added_rows,
+        "offenders": offenders,
+    }
+
+
+def format_estimate(name, estimate):
+    lines = [
+        f"FANOUT {name}: {estimate['left_rows']} x {estimate['right_rows']} rows -> "
+        f"{estimate['rows']} (x{estimate['fanout']:.2f}), "
+        f"{estimate['duplicated_keys']} duplicated key(s) adding "
+        f"{estimate['added_rows']} rows"
+    ]
+    for row in estimate["offenders"].itertuples(index=False):
+        *key, left_rows, right_rows, added_rows = row
+        lines.append(
+            f"FANOUT {name}: key {tuple(key)} {left_rows} x {right_rows} "
+            f"(+{added_rows} rows)"
+        )
+    return lines
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from merck_feed_frames import frame_to_table, table_to_frame
+from merck_feed_log import event
+
+MANIFEST = "manifest.json"
+
+
+def fingerprint(*parts):
+    payload = json.dumps(parts, default=str, sort_keys=True).encode()
+    return hashlib.sha1(payload).hexdigest()
+
+
+class Checkpoints:
+    # Stage outputs for one execution_date, stored as zstd parquet under
+    # <root>/<run_key>/<stage>/<name>.parquet. A stage is reused only when
+    # resuming and its recorded fingerprint matches the current inputs.
+    def __init__(self, root, run_key, resume=False):
+        self.directory = os.path.join(root, run_key) if root else None
+        self.resume = resume
+        self.manifest = {}
+        if self.directory and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def load(self, stage, key):
+        entry = self.manifest.get(stage)
+        if not (self.directory and self.resume and entry and entry["key"] == key):
+            return None
+        stage_dir = os.path.join(self.directory, stage)
+        frames = {
+            name: table_to_frame(
+                pq.read_table(os.path.join(stage_dir, f"{name}.parquet"))
+            )
+            for name in entry["frames"]
+        }
+        return frames["data"] if entry["single"] else frames
+
+    def save(self, stage, key, result):
+        if not self.directory:
+            return
+        single = isinstance(result, pd.DataFrame)
+        frames = {"data": result} if single else result
+        stage_dir = os.path.join(self.directory, stage)
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        os.makedirs(stage_dir)
+        for name, frame in frames.items():
+            pq.write_table(
+                frame_to_table(frame),
+                os.path.join(stage_dir, f"{name}.parquet"),
+                compression="zstd",
+            )
+        self.manifest[stage] = {"key": key, "frames": list(frames), "single": single}
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def stage(self, stage, key, build):
+        result = self.load(stage, key)
+        if result is not None:
+            event("resumed_from_checkpoint", stage=stage)
+            return result
+        result = build()
+        self.save(stage, key, result)
+        return result
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+from sqlalchemy import Column, MetaData, String, Table, delete, insert, select
+
+from merck_feed_frames import frame_to_table, table_to_frame
+
+# Cold tier for lineages (an accession and everything descending from it)
+# whose specimens are all terminal and have not changed for a while. Their
+# final export rows live in <directory>/cold.parquet; the lineage codes are
+# mirrored into the merck_feed_cold table so the extraction queries can
+# exclude them with a NOT IN subquery.
+
+COLD_TABLE = "merck_feed_cold"
+ROWS = "cold.parquet"
+MANIFEST = "manifest.json"
+BATCH = 500
+
+
+def cold_table():
+    metadata = MetaData()
+    table = Table(
+        COLD_TABLE, metadata, Column("lineage_code", String(64), primary_key=True)
+    )
+    return metadata, table
+
+
+class ColdTier:
+    def __init__(self, directory, engine):
+        self.directory = directory
+        self.engine = engine
+        self.metadata, self.table = cold_table()
+        self.state = {}
+        self.rows = pd.DataFrame({"lineage_code": pd.Series([], dtype=object)})
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.state = json.load(f)
+            self.rows = table_to_frame(pq.read_table(self.rows_path))
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    @property
+    def rows_path(self):
+        return os.path.join(self.directory, ROWS)
+
+    def lineages(self):
+        return set(self.rows["lineage_code"])
+
+    def codes(self):
+        # Subquery of the cold lineage codes for the extraction filters
+        return select(self.table.c.lineage_code)
+
+    def thaw(self, codes=None):
+        # codes=None empties the tier; returns the lineages moved back to hot
+        thawed = self.lineages() if codes is None else self.lineages() & set(codes)
+        self.rows = self.rows[~self.rows["lineage_code"].isin(thawed)]
+        return thawed
+
+    def freeze(self, export, lineage, codes):
+        frozen = pd.Series(lineage, dtype=object).isin(codes).to_numpy()
+        rows = export[frozen].assign(lineage_code=pd.Series(lineage)[frozen].to_numpy())
+        self.rows = pd.concat([self.rows, rows], ignore_index=True)
+        return export[~frozen]
+
+    def export(self, columns):
+        return self.rows.reindex(columns=columns).reset_index(drop=True)
+
+    def sync(self):
+        # Brings merck_feed_cold in line with the stored rows; the cold export
+        # is the only writer, so it creates the table on its first sync
+        self.metadata.create_all(self.engine)
+        wanted = self.lineages()
+        with self.engine.begin() as connection:
+            present = set(connection.execute(self.codes()).scalars())
+            removed, added = sorted(present - wanted), sorted(wanted - present)
+            for start in range(0, len(removed), BATCH):
+                batch = removed[start : start + BATCH]
+                connection.execute(
+                    delete(self.table).where(self.table.c.lineage_code.in_(batch))
+                )
+            if added:
+                connection.execute(
+                    insert(self.table), [{"lineage_code": code} for code in added]
+                )
+
+    def save(self, **state):
+        # Rows first, then the manifest; the table is synced from the rows
+        os.makedirs(self.directory, exist_ok=True)
+        pq.write_table(
+            frame_to_table(self.rows.reset_index(drop=True)),
+            f"{self.rows_path}.tmp",
+            compression="zstd",
+        )
+        os.replace(f"{self.rows_path}.tmp", self.rows_path)
+        self.state = state
+        with open(f"{self.manifest_path}.tmp", "w") as f:
+            json.dump(state, f, indent=1, default=str)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+        self.sync()
@@ -0,0 +1,93 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+from merck_feed_log import WARNING, event
+
+# Database connections of a feed run. Writes (export table, cold tier, index
+# migrations) go to the LIMS primary; the extraction reads go to the read
+# replica when one is configured and answers, otherwise to the primary as
+# well. Each engine has its own bounded pool (no overflow, so the feed never
+# holds more than pool_size connections per database), a statement timeout,
+# and reads stream from server-side cursors where the driver has them.
+
+
+class FeedConnections:
+    def __init__(
+        self,
+        primary_url,
+        replica_url=None,
+        pool_size=4,
+        pool_timeout=30,
+        statement_timeout=0,
+        fetch_size=50000,
+    ):
+        self.replica_url = replica_url
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.statement_timeout = statement_timeout
+        self.fetch_size = fetch_size
+        self.primary = self._engine(primary_url)
+        self._reader = None
+
+    def _engine(self, url):
+        url = make_url(url)
+        connect_args = {}
+        if url.get_backend_name() == "sqlite":
+            # SQLite has no statement timeout; bound the wait on locks instead
+            connect_args = {
+                "check_same_thread": False,
+                "timeout": self.statement_timeout or 5,
+            }
+        elif url.get_backend_name() == "postgresql" and self.statement_timeout:
+            timeout = int(self.statement_timeout * 1000)
+            connect_args = {"options": f"-c statement_timeout={timeout}"}
+        return create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=self.pool_size,
+            max_overflow=0,
+            pool_timeout=self.pool_timeout,
+            pool_pre_ping=True,
+            connect_args=connect_args,
+        )
+
+    def reader(self):
+        # Chosen on first use: the replica if it answers, else the primary
+        if self._reader is None:
+            engine = self.primary
+            if self.replica_url:
+                replica = None
+                try:
+                    replica = self._engine(self.replica_url)
+                    with replica.connect() as connection:
+                        connection.execute(text("SELECT 1"))
+                    engine = replica
+                except (SQLAlchemyError, ImportError) as error:
+                    # ImportError: the replica's driver is not installed
+                    event("replica_unavailable", WARNING, error=error)
+                    if replica is not None:
+                        replica.dispose()
+            self._reader = engine.execution_options(
+                stream_results=True, max_row_buffer=self.fetch_size
+            )
+        return self._reader
+
+    def session(self):
+        # Sessions connect lazily, on their first query
+        return Session(bind=self.reader())
+
+    def close(self):
+        # End of run: close every pooled connection; the engines reconnect if
+        # the process runs again (e.g. the feed service)
+        if self._reader is not None and self._reader.engine is not self.primary:
+            self._reader.engine.dispose()
+        self.primary.dispose()
+
+    def after_fork(self):
+        # Forked workers must not use the parent's pooled connections
+        if self._reader is not None and self._reader.engine is not self.primary:
+            self._reader.engine.dispose(close=False)
+        self.primary.dispose(close=False)
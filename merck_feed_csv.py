@@ -0,0 +1,148 @@
+import csv
+import gzip
+import hashlib
+import io
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# CSV writer producing the same bytes as DataFrame.to_csv(index=False) for the
+# export frames (object / numeric / bool columns). Rows are encoded in chunks
+# with Arrow compute kernels, which release the GIL, so chunks encode and
+# compress on a thread pool while earlier ones are already being written.
+# Compressed output is one gzip member / zstd frame per chunk, which standard
+# decompressors read as a single stream.
+
+CHUNK_ROWS = 50000
+
+
+def _special_characters():
+    # The characters that make the running csv module quote a field (pandas
+    # writes through it with lineterminator="\n"); "\r" differs by version
+    special = []
+    for character in [",", '"', "\r", "\n"]:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(["a", character])
+        if buffer.getvalue().startswith('a,"'):
+            special.append(character)
+    return "[" + "".join(re.escape(c) for c in special) + "]"
+
+
+NEEDS_QUOTES = _special_characters()
+SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def csv_name(name, compression=None):
+    return name + SUFFIXES[compression]
+
+
+def supported(frame):
+    return all(
+        isinstance(dtype, np.dtype) and dtype.kind in "Oiufb" for dtype in frame.dtypes
+    )
+
+
+def _text(values):
+    import pyarrow as pa
+
+    if values.dtype.kind != "O":
+        missing = values.isna().to_numpy()
+        text = values.to_numpy().astype(str)
+        return pa.array(text, type=pa.string(), mask=missing)
+    try:
+        return pa.array(values.to_numpy(), type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Numbers, dates etc. in an object column are written with str(),
+        # as the csv module does
+        text = [
+            None if missing else value if isinstance(value, str) else str(value)
+            for value, missing in zip(values.to_numpy(), values.isna().to_numpy())
+        ]
+        return pa.array(text, type=pa.string())
+
+
+def _quote(text, single):
+    import pyarrow.compute as pc
+
+    if single:
+        # The csv module quotes a row made of one empty field
+        text = pc.fill_null(text, "")
+    quoted = pc.binary_join_element_wise(
+        '"', pc.replace_substring(text, '"', '""'), '"', ""
+    )
+    needs = pc.match_substring_regex(text, NEEDS_QUOTES)
+    if single:
+        needs = pc.or_(needs, pc.equal(text, ""))
+    return pc.if_else(needs, quoted, text)
+
+
+def _encode(frame, single):
+    import pyarrow.compute as pc
+
+    columns = [_quote(_text(frame[column]), single) for column in frame.columns]
+    rows = pc.binary_join_element_wise(
+        *columns, ",", null_handling="replace", null_replacement=""
+    )
+    rows = pc.binary_join_element_wise(rows, "", "\n")
+    _, offsets, data = rows.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int32)
+    return data.to_pybytes()[offsets[rows.offset] : offsets[rows.offset + len(rows)]]
+
+
+def _compress(payload, compression):
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=6, mtime=0)
+    if compression == "zstd":
+        import pyarrow as pa
+
+        return pa.Codec("zstd").compress(payload, asbytes=True)
+    return payload
+
+
+def _chunk(frame, start, chunk_rows, single, compression, layout=None):
+    rows = frame.iloc[start : start + chunk_rows]
+    if layout is not None:
+        rows = layout.materialize(rows)
+    return _compress(_encode(rows, single), compression)
+
+
+def csv_chunks(frame, compression=None, workers=4, chunk_rows=CHUNK_ROWS, layout=None):
+    # Yields the file in order; at most 2 * workers chunks are held at once.
+    # layout (merck_feed_layout) adds its constant columns to each chunk.
+    if not supported(frame):
+        if layout is not None:
+            frame = layout.materialize(frame)
+        yield _compress(frame.to_csv(index=False).encode(), compression)
+        return
+    columns = list(frame.columns)
+    if layout is not None:
+        columns = layout.output_columns(frame)
+    single = len(columns) == 1
+    header = pd.DataFrame([list(map(str, columns))], dtype=object)
+    yield _compress(_encode(header, single), compression)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start in range(0, len(frame), chunk_rows):
+            pending.append(
+                pool.submit(
+                    _chunk, frame, start, chunk_rows, single, compression, layout
+                )
+            )
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_csv(
+    frame, stream, compression=None, workers=4, chunk_rows=CHUNK_ROWS, layout=None
+):
+    # Returns the sha256 of the bytes written
+    digest = hashlib.sha256()
+    for payload in csv_chunks(frame, compression, workers, chunk_rows, layout):
+        digest.update(payload)
+        stream.write(payload)
+    return digest.hexdigest()
@@ -0,0 +1,84 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from merck_feed_frames import frame_to_table, table_to_frame
+
+# Fan-out / fan-in layout in a run directory shared by the workers:
+#   plan.json            shard boundaries and run-wide state (status flags)
+#   shard_<n>.parquet    export rows of shard n, written by that shard's task
+# Shard n is the accessions from starts[n] (None: no lower bound) up to, not
+# including, starts[n + 1]. The plan is written once per run, so a retried
+# shard task rebuilds the same code range even if the source changed in
+# between.
+
+PLAN = "plan.json"
+
+# Set right before the local pool forks (see merck_feed_sharding)
+_TASK = {}
+
+
+def write_plan(run_dir, starts, **state):
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, PLAN)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(dict(state, starts=starts), f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_plan(run_dir, shard=None):
+    # shard=None: the plan state; otherwise that shard's (start, end) codes,
+    # None for a shard the plan does not have
+    with open(os.path.join(run_dir, PLAN)) as f:
+        state = json.load(f)
+    if shard is None:
+        return state
+    starts = state["starts"]
+    if shard >= len(starts):
+        return None, state
+    end = starts[shard + 1] if shard + 1 < len(starts) else None
+    return (starts[shard], end), state
+
+
+def shard_path(run_dir, shard):
+    return os.path.join(run_dir, f"shard_{shard}.parquet")
+
+
+def write_shard(run_dir, shard, frame):
+    path = shard_path(run_dir, shard)
+    pq.write_table(frame_to_table(frame), f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+def read_shards(run_dir):
+    # Shard outputs in shard order
+    planned = range(len(read_plan(run_dir)["starts"]))
+    missing = [s for s in planned if not os.path.exists(shard_path(run_dir, s))]
+    if missing:
+        raise RuntimeError(f"Shards not finished: {missing}")
+    frames = [table_to_frame(pq.read_table(shard_path(run_dir, s))) for s in planned]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _run_task(shard):
+    return _TASK["func"](shard)
+
+
+def run_local(func, shards, workers, initializer=None):
+    # Local stand-in for the mapped shard tasks, on forked processes
+    if not shards:
+        return []
+    _TASK.update(func=func)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=initializer,
+        ) as pool:
+            return list(pool.map(_run_task, shards))
+    finally:
+        _TASK.clear()
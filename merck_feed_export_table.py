@@ -0,0 +1,211 @@
+import json
+
+import pandas as pd
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    delete,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+# Denormalized copy of the feed export (accession + aliquot + QC + latest
+# status) kept in the LIMS database. Rows are grouped by lineage_code, the
+# accession inventory_code every export row descends from, which is the unit
+# an incremental refresh deletes and re-inserts; sort_key puts them back in
+# the order a full run writes them. The sources table keeps a digest of the
+# source rows behind each (table, inventory_code) as of the last refresh, so
+# the next one can tell which codes changed, appeared or were deleted.
+
+EXPORT_TABLE = "merck_feed_export"
+STATE_TABLE = "merck_feed_export_state"
+SOURCES_TABLE = "merck_feed_export_sources"
+DELETE_BATCH = 500
+
+
+def export_tables(columns):
+    metadata = MetaData()
+    export = Table(
+        EXPORT_TABLE,
+        metadata,
+        Column("row_id", Integer, primary_key=True, autoincrement=True),
+        Column("lineage_code", String(64), nullable=False, index=True),
+        Column("sort_key", String(64)),
+        *[Column(name, Text) for name in columns],
+    )
+    state = Table(
+        STATE_TABLE,
+        metadata,
+        Column("key", String(64), primary_key=True),
+        Column("value", Text),
+    )
+    sources = Table(
+        SOURCES_TABLE,
+        metadata,
+        Column("source", String(16), primary_key=True),
+        Column("code", String(64), primary_key=True),
+        Column("digest", String(128), nullable=False),
+    )
+    return metadata, export, state, sources
+
+
+def export_table_ddl(engine, columns):
+    _, export, state, sources = export_tables(columns)
+    statements = [CreateTable(export), CreateTable(state), CreateTable(sources)]
+    statements += [CreateIndex(index) for index in export.indexes]
+    return ";\n".join(str(ddl.compile(engine)).strip() for ddl in statements) + ";"
+
+
+def migrate(engine, columns):
+    # Creates the tables on first use and adds any export column that was
+    # added to the layout's stored columns since the table was created
+    metadata, export, state, sources = export_tables(columns)
+    metadata.create_all(engine)
+    existing = {column["name"] for column in inspect(engine).get_columns(EXPORT_TABLE)}
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as connection:
+        for column in export.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {quote(EXPORT_TABLE)} "
+                        f"ADD COLUMN {quote(column.name)} {column_type}"
+                    )
+                )
+    return export, state, sources
+
+
+def read_state(engine, state, key):
+    with engine.connect() as connection:
+        value = connection.execute(
+            select(state.c.value).where(state.c.key == key)
+        ).scalar()
+    return json.loads(value) if value is not None else None
+
+
+def write_state(connection, state, key, value):
+    connection.execute(delete(state).where(state.c.key == key))
+    connection.execute(
+        insert(state).values(key=key, value=json.dumps(value, default=str))
+    )
+
+
+def _records(export, frame, lineage, order):
+    names = [name for name in frame.columns if name in export.c]
+    values = frame[names].astype(object).where(frame[names].notna(), None)
+    records = []
+    rows = values.itertuples(index=False, name=None)
+    for code, key, row in zip(lineage, order, rows):
+        record = {
+            name: None if value is None else str(value)
+            for name, value in zip(names, row)
+        }
+        record["lineage_code"] = code
+        record["sort_key"] = key
+        records.append(record)
+    return records
+
+
+def _delete_in(connection, table, column, values, *filters):
+    values = list(values)
+    for start in range(0, len(values), DELETE_BATCH):
+        batch = values[start : start + DELETE_BATCH]
+        connection.execute(delete(table).where(column.in_(batch), *filters))
+
+
+def replace_rows(
+    engine,
+    tables,
+    frame,
+    lineage,
+    order,
+    lineage_codes=None,
+    digests=None,
+    changed=None,
+    **states,
+):
+    # tables: what migrate returns. lineage_codes=None replaces the whole
+    # table, otherwise only the rows of those lineages. digests: the source
+    # digests to store, after deleting those of the changed (source, code)
+    # pairs (changed=None: all of them). State keys are written in the same
+    # transaction
+    export, state, sources = tables
+    with engine.begin() as connection:
+        if lineage_codes is None:
+            connection.execute(delete(export))
+        else:
+            _delete_in(connection, export, export.c.lineage_code, lineage_codes)
+        records = _records(export, frame, lineage, order)
+        if records:
+            connection.execute(insert(export), records)
+        if digests is not None:
+            if changed is None:
+                connection.execute(delete(sources))
+            else:
+                for source, codes in changed.groupby("source")["code"]:
+                    _delete_in(
+                        connection,
+                        sources,
+                        sources.c.code,
+                        codes,
+                        sources.c.source == source,
+                    )
+            if not digests.empty:
+                connection.execute(insert(sources), digests.to_dict(orient="records"))
+        for key, value in states.items():
+            write_state(connection, state, key, value)
+
+
+def read_export(engine, export, columns):
+    # In the order of a full run; rows of one refresh keep their own order
+    query = select(*[export.c[name] for name in columns]).order_by(
+        export.c.sort_key, export.c.row_id
+    )
+    with engine.connect() as connection:
+        return pd.read_sql(query, connection)
+
+
+def read_sources(engine, sources):
+    query = select(sources.c.source, sources.c.code, sources.c.digest)
+    with engine.connect() as connection:
+        return pd.read_sql(query, connection)
+
+
+def stored_lineages(engine, export, column, codes):
+    # Lineages whose stored rows have these codes in column (e.g. Specimen
+    # ID), for codes the source no longer has or that moved lineage
+    codes, found = list(codes), set()
+    with engine.connect() as connection:
+        for start in range(0, len(codes), DELETE_BATCH):
+            batch = codes[start : start + DELETE_BATCH]
+            query = (
+                select(export.c.lineage_code)
+                .where(export.c[column].in_(batch))
+                .distinct()
+            )
+            found.update(code for (code,) in connection.execute(query))
+    return found
+
+
+def read_lineages(engine, export, columns, lineage_codes):
+    # The stored rows of these lineages, e.g. before a refresh replaces them
+    codes = list(lineage_codes)
+    frames = []
+    with engine.connect() as connection:
+        for start in range(0, len(codes), DELETE_BATCH):
+            batch = codes[start : start + DELETE_BATCH]
+            query = select(*[export.c[name] for name in columns]).where(
+                export.c.lineage_code.in_(batch)
+            )
+            frames.append(pd.read_sql(query, connection))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,71 @@
+import json
+import pickle
+
+import pandas as pd
+import pyarrow as pa
+
+# Lossless DataFrame <-> Arrow table conversion shared by the sharded
+# validation, the stage checkpoints and anything else that persists frames.
+# Column names may repeat (ACC_MAPPING maps two columns onto "Destination
+# Facility"), so columns are stored positionally and the names, dtypes and
+# index travel in the schema metadata.
+
+METADATA_KEY = b"merck_feed"
+INDEX_COLUMN = "__index__"
+
+
+def _to_array(values):
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+    if pa.types.is_nested(array.type):
+        return None
+    return array
+
+
+def frame_to_table(frame):
+    arrays, names, kinds = [], [], []
+    for position, dtype in enumerate(frame.dtypes):
+        values = frame.iloc[:, position]
+        array = _to_array(values)
+        if array is None:
+            # Mixed-type / JSON columns have no Arrow type, keep them exact
+            array = pa.array([pickle.dumps(value) for value in values], pa.binary())
+            kinds.append("pickle")
+        elif isinstance(dtype, pd.ArrowDtype):
+            kinds.append("arrow")
+        else:
+            kinds.append(str(dtype))
+        arrays.append(array)
+        names.append(f"c{position}")
+    arrays.append(pa.array(frame.index.to_numpy(), from_pandas=True))
+    names.append(INDEX_COLUMN)
+    metadata = {"columns": [str(name) for name in frame.columns], "kinds": kinds}
+    return pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(
+        {METADATA_KEY: json.dumps(metadata)}
+    )
+
+
+def _restore(column, kind):
+    if kind == "pickle":
+        return pd.Series([pickle.loads(value) for value in column.to_pylist()])
+    if kind == "arrow":
+        return pd.Series(pd.arrays.ArrowExtensionArray(column))
+    values = column.to_pandas(integer_object_nulls=True)
+    if kind == "object":
+        values = values.astype(object)
+        return values.where(values.notna(), None)
+    return values.astype(kind)
+
+
+def table_to_frame(table):
+    metadata = json.loads(table.schema.metadata[METADATA_KEY])
+    data = {
+        position: _restore(table.column(f"c{position}"), kind)
+        for position, kind in enumerate(metadata["kinds"])
+    }
+    frame = pd.DataFrame(data, index=pd.RangeIndex(table.num_rows))
+    frame.columns = metadata["columns"]
+    frame.index = pd.Index(table.column(INDEX_COLUMN).to_pandas())
+    return frame
@@ -0,0 +1,169 @@
+import json
+import re
+
+from sqlalchemy import Column, Index, MetaData, Table, func, inspect, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+# Index advisor for the feed's access paths. explain() runs the database's
+# own planner over a generated statement (EXPLAIN QUERY PLAN on SQLite,
+# EXPLAIN (FORMAT JSON) on PostgreSQL) and reduces the plan to how each table
+# is read:
+#   scan     every row of the table, no index
+#   index    every entry of an index (full index scan)
+#   search   an index lookup on a key prefix
+# Composite indexes are declared as (table, columns) with the filter column
+# first, so the same index serves the client filter and the key lookups. A
+# lookup on nothing but "broad" columns (the client filter, which nearly every
+# row matches) still reads the whole table and counts as a scan.
+
+SQLITE_STEP = re.compile(r"^(SCAN|SEARCH)(?: TABLE)? (\S+)(?: AS (\S+))?(.*)$")
+SQLITE_CONDITION = re.compile(r"\((.*)\)$")
+CONDITION_COLUMN = re.compile(r"[(\s]*(?:\w+\.)?(\w+)")
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    if compiler.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    elif compiler.dialect.name == "postgresql":
+        prefix = "EXPLAIN (FORMAT JSON) "
+    else:
+        raise NotImplementedError(f"EXPLAIN on {compiler.dialect.name}")
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def _narrows(conditions, broad):
+    # True when every index condition constrains a column other than the
+    # broad ones
+    def columns(condition):
+        parts = re.split(r"\s+AND\s+", condition)
+        matches = [CONDITION_COLUMN.match(part) for part in parts]
+        return {match.group(1) for match in matches if match}
+
+    return bool(conditions) and all(
+        columns(condition) - set(broad) for condition in conditions
+    )
+
+
+def _sqlite_steps(rows, broad):
+    steps = []
+    for row in rows:
+        detail = row[-1]
+        match = SQLITE_STEP.match(detail)
+        if match:
+            kind, table, _, rest = match.groups()
+            if kind == "SEARCH":
+                condition = SQLITE_CONDITION.search(rest)
+                conditions = [condition.group(1)] if condition else []
+                access = "search" if _narrows(conditions, broad) else "scan"
+            else:
+                access = "index" if "INDEX" in rest else "scan"
+            steps.append({"table": table, "access": access, "detail": detail})
+        elif detail.startswith("USE TEMP B-TREE"):
+            steps.append({"table": None, "access": "sort", "detail": detail})
+    return steps
+
+
+def _index_conditions(node):
+    # Index conditions of a node and of the bitmap index scans under it
+    conditions = [node["Index Cond"]] if "Index Cond" in node else []
+    for child in node.get("Plans", []):
+        if child["Node Type"].startswith("Bitmap"):
+            conditions += _index_conditions(child)
+    return conditions
+
+
+def _postgres_steps(node, steps, broad):
+    kind = node["Node Type"]
+    if "Relation Name" in node:
+        conditions = _index_conditions(node)
+        if kind == "Seq Scan":
+            access = "scan"
+        elif conditions or kind == "Bitmap Heap Scan":
+            access = "search" if _narrows(conditions, broad) else "scan"
+        else:
+            access = "index"
+        steps.append({"table": node["Relation Name"], "access": access, "detail": kind})
+    elif kind == "Sort":
+        steps.append({"table": None, "access": "sort", "detail": kind})
+    for child in node.get("Plans", []):
+        _postgres_steps(child, steps, broad)
+    return steps
+
+
+def explain(connection, statement, broad=()):
+    rows = connection.execute(Explain(statement)).fetchall()
+    if connection.dialect.name == "sqlite":
+        return _sqlite_steps(rows, broad)
+    plan = rows[0][0]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return _postgres_steps(plan[0]["Plan"], [], broad)
+
+
+def full_scans(steps, tables):
+    return sorted(
+        {step["table"] for step in steps if step["access"] == "scan"} & tables
+    )
+
+
+def index_name(table, columns):
+    return "ix_" + "_".join([table.name] + list(columns))
+
+
+def _index(table, columns):
+    # Built on a detached copy so the models' metadata is left untouched
+    copy = Table(
+        table.name,
+        MetaData(),
+        *[Column(name, table.c[name].type) for name in columns],
+        schema=table.schema,
+    )
+    return Index(index_name(table, columns), *[copy.c[name] for name in columns])
+
+
+def missing_indexes(engine, wanted):
+    # wanted: [(table, columns)]; an index whose leading columns match counts
+    inspector = inspect(engine)
+    missing = []
+    for table, columns in wanted:
+        present = [
+            index["column_names"]
+            for index in inspector.get_indexes(table.name, schema=table.schema)
+        ]
+        if not any(index[: len(columns)] == list(columns) for index in present):
+            missing.append((table, columns))
+    return missing
+
+
+def index_ddl(engine, wanted):
+    statements = [CreateIndex(_index(table, columns)) for table, columns in wanted]
+    return "".join(f"{str(ddl.compile(engine)).strip()};\n" for ddl in statements)
+
+
+def create_indexes(engine, wanted):
+    for table, columns in wanted:
+        _index(table, columns).create(engine)
+
+
+def key_fanout(connection, table, columns, *filters):
+    # Rows per key value: how far a join or lookup on these columns fans out
+    per_key = (
+        select(func.count().label("rows"))
+        .select_from(table)
+        .where(*filters)
+        .group_by(*[table.c[name] for name in columns])
+        .subquery()
+    )
+    keys, rows, widest = connection.execute(
+        select(func.count(), func.sum(per_key.c.rows), func.max(per_key.c.rows))
+    ).one()
+    return {"keys": keys, "rows": rows or 0, "max": widest or 0}
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# int64 surrogate keys for inventory codes. Purely numeric barcodes (no
+# leading zero, at most 15 digits so they stay exact even if pandas upcasts
+# the column to float) encode as their own value; every other code gets a
+# dictionary id stored as a negative number, so the two ranges never collide.
+# Missing codes share NULL_KEY, which keeps pandas' None-matches-None merge
+# behaviour of the object columns.
+
+NUMERIC_CODE = r"[1-9][0-9]{0,14}"
+NULL_KEY = -1
+DICTIONARY_BASE = -2
+
+
+class KeyEncoder:
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.ids = {name: position for position, name in enumerate(self.names)}
+
+    def _id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def encode(self, values):
+        values = pd.Series(np.asarray(values, dtype=object), dtype=object)
+        missing = values.isna().to_numpy()
+        text = values.where(~missing, "").astype(str)
+        numeric = text.str.fullmatch(NUMERIC_CODE).to_numpy(dtype=bool)
+        keys = np.full(len(values), NULL_KEY, dtype=np.int64)
+        keys[numeric] = text[numeric].astype(np.int64).to_numpy()
+        other = ~numeric & ~missing
+        if other.any():
+            uniques, inverse = np.unique(
+                text[other].to_numpy(dtype=object), return_inverse=True
+            )
+            ids = np.array([self._id(name) for name in uniques], dtype=np.int64)
+            keys[other] = DICTIONARY_BASE - ids[inverse]
+        return keys
+
+    def decode(self, keys):
+        keys = pd.Series(keys)
+        missing = (keys.isna() | (keys == NULL_KEY)).to_numpy()
+        ints = keys.where(~missing, NULL_KEY).astype(np.int64).to_numpy()
+        decoded = np.full(len(ints), None, dtype=object)
+        numeric = ints >= 0
+        decoded[numeric] = ints[numeric].astype(str).tolist()
+        dictionary = ints <= DICTIONARY_BASE
+        names = np.array(self.names, dtype=object)
+        decoded[dictionary] = names[DICTIONARY_BASE - ints[dictionary]]
+        return decoded
+
+    def encode_columns(self, frame, columns):
+        for column in columns:
+            if column in frame.columns:
+                frame[column] = self.encode(frame[column])
+        return frame
+
+    def decode_columns(self, frame, columns):
+        for column in columns:
+            if column in frame.columns:
+                frame[column] = self.decode(frame[column])
+        return frame
+
+    def to_frame(self):
+        return pd.DataFrame({"code": pd.Series(self.names, dtype=object)})
+
+    @classmethod
+    def from_frame(cls, frame):
+        return cls(frame["code"].tolist())
@@ -0,0 +1,115 @@
+import pandas as pd
+
+# BioTRACS output layout: the order columns are written in, and the columns
+# that hold the same value on every row. Constant columns are not stored in
+# the export frames (or checkpoints, snapshots, shards, the export table);
+# the writers add them chunk by chunk with OutputLayout.materialize.
+
+
+class OutputLayout:
+    def __init__(self, columns, constants, mapped=()):
+        self.columns = list(columns)
+        self.constants = dict(constants)
+        # Constant columns the extraction maps, which keep their place in
+        # columns; the other constants follow, in the order they are listed
+        self.mapped = set(mapped)
+        # Columns the export frames actually carry
+        self.stored = [name for name in self.columns if name not in self.constants]
+
+    def output_columns(self, frame):
+        # Stored columns the frame lacks are left out, as the join does
+        placed = [
+            name
+            for name in self.columns
+            if name in self.mapped
+            or (name not in self.constants and name in frame.columns)
+        ]
+        return placed + [name for name in self.constants if name not in placed]
+
+    def materialize(self, frame):
+        constants = pd.DataFrame(
+            {
+                name: pd.Series(value, index=frame.index, dtype=object)
+                for name, value in self.constants.items()
+            },
+            index=frame.index,
+        )
+        stored = frame.drop(columns=list(self.constants), errors="ignore")
+        return pd.concat([stored, constants], axis=1)[self.output_columns(frame)]
+
+
+BIOTRACS = OutputLayout(
+    columns=[
+        "Analysis Type",
+        "Assay",
+        "Biopsy Accession ID",
+        "Biopsy Anatomic Location",
+        "Biopsy Collection Method",
+        "Collection Date",
+        "Created Date",
+        "Current Status",
+        "Destination Facility",
+        "Fixation Method",
+        "Lesion Type",
+        "Nucleic Acid Concentration",
+        "Nucleic Acid Volume",
+        "Nucleic Acid Yield",
+        "Origination Facility",
+        "Parent Specimen ID",
+        "Pre/Post Treatment",
+        "Randomization ID",
+        "Received Date",
+        "Screening ID",
+        "Shipped Date",
+        "Site ID",
+        "Slide Thickness",
+        "Slides Sectioned Date",
+        "Specimen Comments",
+        "Specimen Fixation Date",
+        "Specimen ID",
+        "Specimen Tissue Category",
+        "Specimen Type",
+        "Study Number",
+        "Terminal Date",
+        "Terminal Date_su",
+        "Vendor",
+        "Vendor Specimen ID",
+        "Visit",
+        "Diagnosis Confirmed",
+        "Biopsy Lesion Injection Status",
+        "Time from Tissue Excision to Immersion in Fixative",
+        "Fixation Time",
+        "Institutional Block or Slide ID",
+        "Time Specimen Placed in Fixative",
+        "Number of Slides Submitted",
+        "Collection Time",
+        "Purity",
+        "Type of Biopsy Sample Taken",
+        "Container Type",
+    ],
+    constants={
+        "Vendor": "IBX",
+        "Assay": "",
+        "Biopsy Accession ID": "",
+        "Biopsy Anatomic Location": "",
+        "Biopsy Collection Method": "",
+        "Fixation Method": "",
+        "Lesion Type": "",
+        "Pre/Post Treatment": "",
+        "Slide Thickness": "",
+        "Slides Sectioned Date": "",
+        "Specimen Fixation Date": "",
+        "Specimen Tissue Category": "",
+        "Diagnosis Confirmed": "",
+        "Biopsy Lesion Injection Status": "",
+        "Time from Tissue Excision to Immersion in Fixative": "",
+        "Fixation Time": "",
+        "Institutional Block or Slide ID": "",
+        "Time Specimen Placed in Fixative": "",
+        "Number of Slides Submitted": "",
+        "Type of Biopsy Sample Taken": "",
+        # Mapped from ruid on extraction, but BioTRACS gets it empty
+        "Vendor Specimen ID": "",
+    },
+    mapped=["Assay", "Vendor Specimen ID"],
+)
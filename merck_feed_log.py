@@ -0,0 +1,146 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+from logging import DEBUG, INFO, WARNING
+from logging.handlers import QueueHandler, QueueListener
+
+# Feed logging. event() writes one leveled line "name key=value ..." where
+# every value is rendered in bounded size (frames and long sequences are
+# summarized), and RowMessages folds row-level messages into one event with
+# a count and a few examples. Records go through a bounded queue to a
+# background writer thread; when the queue is full they are dropped and
+# counted instead of blocking the feed.
+
+LOGGER = "merck_feed"
+QUEUE_SIZE = 10000
+VALUE_CHARS = 200
+ITEMS = 20
+SAMPLES = 5
+FORMAT = "%(asctime)s %(levelname)s %(message)s"
+
+_state = {}
+_hooks = []
+
+
+class _BoundedQueueHandler(QueueHandler):
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        # Called under the handler's lock
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _value(value):
+    shape = getattr(value, "shape", None)
+    if shape is not None and len(shape) == 1 and shape[0] <= ITEMS:
+        value = list(value)
+    elif shape is not None and shape != ():
+        return f"<{type(value).__name__} shape={tuple(shape)}>"
+    if isinstance(value, (list, tuple, set)) and len(value) > ITEMS:
+        head = list(value)[:ITEMS]
+        return f"{str(head)[:-1]}, ... {len(value)} items]"[: VALUE_CHARS + 20]
+    text = str(value)
+    if len(text) > VALUE_CHARS:
+        text = f"{text[:VALUE_CHARS]}...({len(text)} chars)"
+    return text.replace("\n", "\\n")
+
+
+def _stream_handler(stream):
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    return handler
+
+
+def _after_fork():
+    # Worker processes have no writer thread; they write directly
+    logger = logging.getLogger(LOGGER)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(_stream_handler(_state["stream"]))
+    _state.clear()
+
+
+def configure_logging(level="INFO", stream=None):
+    if _state:
+        return
+    stream = stream or sys.stdout
+    records = queue.Queue(QUEUE_SIZE)
+    handler = _BoundedQueueHandler(records)
+    listener = QueueListener(records, _stream_handler(stream))
+    logger = logging.getLogger(LOGGER)
+    logger.setLevel(level)
+    logger.propagate = False
+    logger.addHandler(handler)
+    listener.start()
+    _state.update(handler=handler, listener=listener, stream=stream)
+    if not _hooks:
+        os.register_at_fork(after_in_child=lambda: _state and _after_fork())
+        atexit.register(shutdown)
+        _hooks.append(True)
+
+
+def shutdown():
+    # Drains the queue; reports what a full queue dropped
+    if "listener" not in _state:
+        return
+    _state["listener"].stop()
+    if _state["handler"].dropped:
+        stream = _state["stream"]
+        stream.write(f"LOG RECORDS DROPPED: {_state['handler'].dropped}\n")
+    logging.getLogger(LOGGER).removeHandler(_state["handler"])
+    _state.clear()
+
+
+@contextmanager
+def writer_paused():
+    # Stops the writer thread (it drains the queue first) for the block, e.g.
+    # to fork worker processes from a single-threaded process
+    listener = _state.get("listener")
+    if listener is None:
+        yield
+        return
+    listener.stop()
+    try:
+        yield
+    finally:
+        listener.start()
+
+
+def event(name, level=logging.INFO, **fields):
+    logger = logging.getLogger(LOGGER)
+    if not logger.isEnabledFor(level):
+        return
+    parts = [name] + [f"{key}={_value(value)}" for key, value in fields.items()]
+    logger.log(level, " ".join(parts))
+
+
+class RowMessages:
+    def __init__(self, name, level=logging.WARNING, samples=SAMPLES):
+        self.name = name
+        self.level = level
+        self.samples = samples
+        self.count = 0
+        self.examples = []
+        self.lock = threading.Lock()
+
+    def add(self, **fields):
+        with self.lock:
+            self.count += 1
+            if len(self.examples) < self.samples:
+                self.examples.append({k: _value(v) for k, v in fields.items()})
+
+    def flush(self, **fields):
+        with self.lock:
+            count, examples = self.count, self.examples
+            self.count, self.examples = 0, []
+        if count:
+            event(self.name, self.level, count=count, examples=examples, **fields)
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+# Versioned store for the feed's lookup tables (facility, source and specimen
+# mappings, study lists). The source of record is a JSON file:
+#   {"version": 2,
+#    "sections": {"facility": {"kind": "map", "entries": {...}},
+#                 "p3_study": {"kind": "list", "entries": [...]}}}
+# ("lower_keys": true also maps the lower-cased keys of a map). It is compiled
+# into a flat binary artifact that is memory-mapped read-only, so every
+# process using it (forked workers included) shares the same pages instead of
+# building its own dicts. Entries keep their source order; lookups binary
+# search a key-sorted index over the mapped string table.
+#
+# Artifact: MAGIC, header length, JSON header, then per section
+#   offsets  uint32[strings + 1]  string boundaries in the blob
+#   order    uint32[entries]      entry numbers sorted by key
+#   blob     UTF-8 strings        key, value, key, value, ... (or items)
+
+MAGIC = b"MFMAP001"
+PREFIX = struct.Struct("<8sI")
+
+
+def _align(position, size=8):
+    return -(-position // size) * size
+
+
+def _section(spec):
+    entries = spec["entries"]
+    if spec["kind"] == "map":
+        if spec.get("lower_keys"):
+            entries = {**entries, **{k.lower(): v for k, v in entries.items()}}
+        keys = list(entries)
+        strings = [text for key in keys for text in (key, entries[key])]
+    elif spec["kind"] == "list":
+        keys = list(dict.fromkeys(entries))
+        strings = keys
+    else:
+        raise ValueError(f"unknown mapping kind {spec['kind']!r}")
+    encoded = [text.encode() for text in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(text) for text in encoded])
+    sort_keys = [key.encode() for key in keys]
+    order = np.array(sorted(range(len(keys)), key=sort_keys.__getitem__), dtype="<u4")
+    return len(keys), offsets, order, b"".join(encoded)
+
+
+def compile_store(store, path, digest=""):
+    sections = {name: _section(spec) for name, spec in store["sections"].items()}
+    header = {"version": store["version"], "source": digest, "sections": {}}
+    # Positions depend on the header length, so lay out until it is stable
+    length = 0
+    while True:
+        position = _align(PREFIX.size + length)
+        for name, (count, offsets, order, blob) in sections.items():
+            kind = store["sections"][name]["kind"]
+            entry = {"kind": kind, "count": count, "offsets": position}
+            position = entry["order"] = _align(position + offsets.nbytes)
+            position = entry["blob"] = _align(position + order.nbytes)
+            position = _align(position + len(blob))
+            header["sections"][name] = entry
+        encoded = json.dumps(header, sort_keys=True).encode()
+        if len(encoded) == length:
+            break
+        length = len(encoded)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, length) + encoded)
+        for name, (count, offsets, order, blob) in sections.items():
+            entry = header["sections"][name]
+            for start, data in (
+                (entry["offsets"], offsets.tobytes()),
+                (entry["order"], order.tobytes()),
+                (entry["blob"], blob),
+            ):
+                f.write(b"\0" * (start - f.tell()))
+                f.write(data)
+    # Readers keep the file they mapped; new readers get the new one
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    try:
+        with open(path, "rb") as f:
+            magic, length = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                return None
+            return json.loads(f.read(length))
+    except (OSError, struct.error, ValueError):
+        return None
+
+
+class _Table:
+    def __init__(self, buffer, entry, width):
+        self._count = entry["count"]
+        self._width = width
+        self._offsets = np.frombuffer(
+            buffer, "<u4", self._count * width + 1, entry["offsets"]
+        )
+        self._order = np.frombuffer(buffer, "<u4", self._count, entry["order"])
+        self._blob = memoryview(buffer)[entry["blob"] :]
+        # Keys looked up so far: the feed asks for the same few values on
+        # every row
+        self._found = {}
+
+    def _bytes(self, string):
+        return bytes(self._blob[self._offsets[string] : self._offsets[string + 1]])
+
+    def _text(self, string):
+        return self._bytes(string).decode()
+
+    def _find(self, key):
+        # Entry number of key, or -1
+        if not isinstance(key, str):
+            return -1
+        entry = self._found.get(key)
+        if entry is None:
+            entry = self._found[key] = self._search(key)
+        return entry
+
+    def _search(self, key):
+        try:
+            target = key.encode()
+        except UnicodeEncodeError:
+            return -1
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._bytes(self._order[middle] * self._width) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count:
+            entry = int(self._order[low])
+            if self._bytes(entry * self._width) == target:
+                return entry
+        return -1
+
+    def __len__(self):
+        return self._count
+
+
+class CompiledMap(_Table, Mapping):
+    def __init__(self, buffer, entry):
+        super().__init__(buffer, entry, 2)
+
+    def __getitem__(self, key):
+        entry = self._find(key)
+        if entry < 0:
+            raise KeyError(key)
+        return self._text(entry * 2 + 1)
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        return (self._text(entry * 2) for entry in range(self._count))
+
+    def items(self):
+        return [
+            (self._text(entry * 2), self._text(entry * 2 + 1))
+            for entry in range(self._count)
+        ]
+
+
+class CompiledList(_Table, Sequence):
+    def __init__(self, buffer, entry):
+        super().__init__(buffer, entry, 1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._text(index)
+
+    def __contains__(self, value):
+        return self._find(value) >= 0
+
+
+class MappingStore:
+    def __init__(self, source, artifact):
+        self.source = source
+        self.artifact = artifact
+        self.version = None
+        self.digest = None
+        self._sections = None
+        self._stamp = None
+
+    def refresh(self):
+        # Maps the artifact of the source's current contents, compiling it
+        # first if needed; True when that replaced what was loaded
+        stat = os.stat(self.source)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if self._sections is not None and stamp == self._stamp:
+            return False
+        with open(self.source, "rb") as f:
+            raw = f.read()
+        self._stamp = stamp
+        digest = hashlib.sha1(raw).hexdigest()
+        if digest == self.digest:
+            return False
+        header = read_header(self.artifact)
+        if header is None or header["source"] != digest:
+            compile_store(json.loads(raw), self.artifact, digest)
+        with open(self.artifact, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, length = PREFIX.unpack_from(buffer)
+        header = json.loads(buffer[PREFIX.size : PREFIX.size + length])
+        kinds = {"map": CompiledMap, "list": CompiledList}
+        # The old tables (and their mapping) stay valid for whoever holds them
+        self._sections = {
+            name: kinds[entry["kind"]](buffer, entry)
+            for name, entry in header["sections"].items()
+        }
+        self.version, self.digest = header["version"], header["source"]
+        return True
+
+    def get(self, name):
+        # Loaded on first use
+        if self._sections is None:
+            self.refresh()
+        return self._sections[name]
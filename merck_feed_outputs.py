@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from merck_feed_csv import csv_name, write_csv
+
+MANIFEST = "manifest.json"
+
+
+def status_class(status):
+    return np.where(status == "In Inventory", "INV", "NINV")
+
+
+def safe_study_name(study):
+    return re.sub(r"[^A-Za-z0-9-]+", "_", str(study)) if study else "NO_STUDY"
+
+
+def safe_study_names(studies):
+    # Studies that come out the same once made safe ("MK-1/A", "MK-1 A")
+    # get a short hash of their raw name appended, so each keeps its own file
+    safe = {study: safe_study_name(study) for study in studies}
+    counts = Counter(safe.values())
+    return {
+        study: name
+        if counts[name] == 1
+        else f"{name}_{hashlib.sha1(str(study).encode()).hexdigest()[:8]}"
+        for study, name in safe.items()
+    }
+
+
+def study_file_name(study, status, compression=None, safe_study=None):
+    # safe_study: the name safe_study_names gave the study
+    safe_study = safe_study or safe_study_name(study)
+    return csv_name(f"BioTRACS_Merck_{safe_study}_{status}.csv", compression)
+
+
+def content_hash(frame):
+    # Order-sensitive hash of the rows, far cheaper than encoding the CSV
+    digest = hashlib.sha256("\x1f".join(frame.columns).encode())
+    rows = pd.util.hash_pandas_object(frame.astype(object), index=False)
+    digest.update(rows.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def _write(path, frame, compression=None, layout=None):
+    with open(f"{path}.tmp", "wb") as f:
+        checksum = write_csv(frame, f, compression, layout=layout)
+    os.replace(f"{path}.tmp", path)
+    return checksum
+
+
+def write_study_files(
+    export,
+    directory,
+    file_time,
+    p3_studies=(),
+    workers=8,
+    compression=None,
+    layout=None,
+):
+    # One CSV per Study Number and INV / NINV class. Files whose rows did not
+    # change since the last run are left alone; returns the rewritten names.
+    os.makedirs(directory, exist_ok=True)
+    previous = load_manifest(directory)
+    p3_studies = set(p3_studies)
+
+    groups = export.groupby(
+        [export["Study Number"].fillna(""), status_class(export["Current Status"])],
+        sort=True,
+    )
+    safe_studies = safe_study_names(export["Study Number"].fillna("").unique())
+    manifest, pending = {}, {}
+    for (study, status), frame in groups:
+        name = study_file_name(study, status, compression, safe_studies[study])
+        entry = {
+            "study": study or None,
+            "status": status,
+            "p3": study in p3_studies,
+            "rows": int(frame.shape[0]),
+            "content_hash": content_hash(frame),
+        }
+        old = previous.get(name)
+        path = os.path.join(directory, name)
+        if (
+            old
+            and old["content_hash"] == entry["content_hash"]
+            and os.path.exists(path)
+        ):
+            entry.update(sha256=old["sha256"], updated=old["updated"])
+        else:
+            entry["updated"] = file_time
+            pending[name] = frame
+        manifest[name] = entry
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        checksums = pool.map(
+            lambda name: _write(
+                os.path.join(directory, name), pending[name], compression, layout
+            ),
+            list(pending),
+        )
+        for name, checksum in zip(list(pending), checksums):
+            manifest[name]["sha256"] = checksum
+
+    # Studies that disappeared from the feed are dropped with their file
+    for name in set(previous) - set(manifest):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    save_manifest(directory, manifest)
+    return sorted(pending)
@@ -0,0 +1,194 @@
+import json
+import math
+import os
+import resource
+import statistics
+import time
+
+# Per-run choice of execution mode from estimated source sizes (row counts
+# from COUNT queries, bytes from the in-memory width of a small sample):
+#   memory       object frames, the whole run in one process
+#   streaming    Arrow-backed extraction fetched chunk_size rows at a time
+#   out_of_core  lineage shards run by worker processes (merck_feed_distributed)
+# Each mode predicts its peak memory as factor * the bytes one process holds,
+# and the first mode that fits the memory budget wins. Decisions are kept in a
+# JSON history together with the measured peak of the run; a mode's factor is
+# the median measured / estimated ratio of its recent runs, so the planner
+# corrects itself as the data grows.
+#
+# The measured peak is what the process holding the work added: the feed
+# process for memory / streaming, the largest shard worker (less the pages it
+# shares with the feed process it was forked from) for out_of_core.
+# The feed's own high-water mark is restarted when a run starts, so runs of a
+# resident service are measured separately; workers are only seen through
+# RUSAGE_CHILDREN, which keeps the largest child of the process's lifetime.
+
+MODES = ["memory", "streaming", "out_of_core"]
+# Peak memory per estimated source byte, until a mode has measured runs.
+# Measured on an extract estimated at 94 MB: memory 3.8, streaming 2.3 and
+# out_of_core 2.1-2.4 per worker (25 shards)
+DEFAULT_FACTORS = {"memory": 3.8, "streaming": 2.3, "out_of_core": 2.3}
+HISTORY_RUNS = 50
+CALIBRATION_RUNS = 10
+ROWS_PER_WORKER = 50000
+MIN_CHUNK, MAX_CHUNK = 5000, 200000
+
+
+def _status(field):
+    # kB field of /proc/self/status, None where there is none
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak():
+    # Restarts this process's high-water mark from its current resident set
+    # (Linux >= 4.0); False where it cannot
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def process_peak():
+    peak = _status("VmHWM")
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return peak
+
+
+def children_peak():
+    # Largest resident set of any child waited for so far
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+class Planner:
+    def __init__(self, history_path, memory_budget, cpus):
+        self.history_path = history_path
+        self.memory_budget = memory_budget
+        self.cpus = max(1, cpus)
+        self.history = []
+        if os.path.exists(history_path):
+            with open(history_path) as f:
+                self.history = json.load(f)
+
+    def factor(self, mode):
+        ratios = [
+            run["actual"]["peak_bytes"] / run["work_bytes"]
+            for run in self.history
+            if run["mode"] == mode
+            and run.get("actual")
+            and not run["actual"]["resumed"]
+            and run["actual"]["peak_bytes"] is not None
+            and run["work_bytes"]
+        ][-CALIBRATION_RUNS:]
+        return statistics.median(ratios) if ratios else DEFAULT_FACTORS[mode]
+
+    def candidates(self, estimates):
+        rows = sum(table["rows"] for table in estimates.values())
+        total = sum(table["bytes"] for table in estimates.values())
+        row_bytes = total / rows if rows else 1
+        workers = max(1, min(self.cpus, math.ceil(rows / ROWS_PER_WORKER)))
+        # A fetched chunk is kept to ~1/50 of the budget
+        chunk = int(self.memory_budget / 50 / max(row_bytes, 1))
+        chunk = min(max(chunk, MIN_CHUNK), MAX_CHUNK)
+        plain = {"workers": workers, "chunk_size": chunk, "shards": 0}
+        yield dict(plain, mode="memory", work_bytes=total)
+        yield dict(plain, mode="streaming", work_bytes=total)
+        # Enough shards that `workers` of them in flight fit the budget
+        workers = self.cpus
+        need = workers * total * self.factor("out_of_core") / self.memory_budget
+        shards = max(2, workers, math.ceil(need))
+        yield {
+            "mode": "out_of_core",
+            "workers": workers,
+            "chunk_size": chunk,
+            "shards": shards,
+            "work_bytes": total / shards,
+        }
+
+    def plan(self, run, estimates):
+        for decision in self.candidates(estimates):
+            factor = self.factor(decision["mode"])
+            concurrent = decision["workers"] if decision["shards"] else 1
+            predicted = factor * decision["work_bytes"] * concurrent
+            if predicted <= self.memory_budget:
+                break
+        decision.update(
+            run=run,
+            planned=time.time(),
+            estimates=estimates,
+            factor=factor,
+            predicted_peak=int(predicted),
+            memory_budget=self.memory_budget,
+            actual=None,
+        )
+        self.start(decision)
+        self.history = [r for r in self.history if r["run"] != run] + [decision]
+        self.save()
+        return decision
+
+    def decision(self, run):
+        # A retried run keeps its decision, e.g. so resumed shards line up
+        for decision in self.history:
+            if decision["run"] == run:
+                self.start(decision)
+                return decision
+        return None
+
+    def start(self, decision):
+        # Where this process's measurement of the run starts from
+        if reset_peak():
+            process = _status("VmRSS")
+        else:
+            process = process_peak()
+        decision["baseline"] = {"process": process, "children": children_peak()}
+
+    def finish(self, decision, resumed=False):
+        baseline = decision["baseline"]
+        process = max(process_peak() - baseline["process"], 0)
+        # Forked workers start out sharing the feed process's pages, which
+        # count in their resident set; no child above the baseline: unknown
+        children = children_peak()
+        if children > baseline["children"]:
+            children = max(children - baseline["process"], 0)
+        else:
+            children = None
+        peak = children if decision["mode"] == "out_of_core" else process
+        decision["actual"] = {
+            "peak_bytes": peak,
+            "process_bytes": process,
+            "worker_bytes": children,
+            "seconds": round(time.time() - decision["planned"], 1),
+            "resumed": resumed,
+        }
+        self.save()
+        return decision
+
+    def save(self):
+        self.history = self.history[-HISTORY_RUNS:]
+        with open(f"{self.history_path}.tmp", "w") as f:
+            json.dump(self.history, f, indent=1)
+        os.replace(f"{self.history_path}.tmp", self.history_path)
+
+
+def describe(decision):
+    line = (
+        f"{decision['mode']}: {decision['workers']} worker(s), "
+        f"chunk {decision['chunk_size']} rows, {decision['shards']} shard(s), "
+        f"predicted peak {decision['predicted_peak'] >> 20} MB "
+        f"of {decision['memory_budget'] >> 20} MB"
+    )
+    actual = decision["actual"]
+    if actual:
+        peak = actual["peak_bytes"]
+        peak = "?" if peak is None else peak >> 20
+        line += f", measured {peak} MB in {actual['seconds']} s"
+    return line
@@ -0,0 +1,165 @@
+import fcntl
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+# Bump when the matching logic changes so old decisions are not reused
+RESOLVER_VERSION = 1
+
+
+def normalize(value):
+    return " ".join(str(value).lower().split())
+
+
+def ngrams(value, n=3):
+    padded = f"  {normalize(value)} "
+    return {padded[i : i + n] for i in range(len(padded) - n + 1)}
+
+
+def fingerprint(mapping):
+    payload = json.dumps(sorted(mapping.items()), default=str).encode()
+    return hashlib.sha1(payload).hexdigest()
+
+
+class ResolverCache:
+    def __init__(self, path):
+        self.path = path
+        self.sections = {}
+        self.dirty = False
+        if path:
+            self.sections = self._read()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except ValueError:
+            # A corrupt cache is rebuilt like a missing one
+            return {}
+        if not isinstance(data, dict) or data.get("version") != RESOLVER_VERSION:
+            return {}
+        maps = data.get("maps", {})
+        return maps if isinstance(maps, dict) else {}
+
+    def section(self, name, mapping_fingerprint):
+        section = self.sections.get(name)
+        # A changed mapping invalidates every decision made against the old one
+        if not section or section["fingerprint"] != mapping_fingerprint:
+            section = {"fingerprint": mapping_fingerprint, "decisions": {}}
+            self.sections[name] = section
+            self.dirty = True
+        return section["decisions"]
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        # Shard workers save concurrently: each one merges its decisions into
+        # what is on disk under a lock, and writes through its own tmp file
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            sections = self._read()
+            for name, section in self.sections.items():
+                stored = sections.get(name)
+                if stored and stored["fingerprint"] == section["fingerprint"]:
+                    for value, decision in stored["decisions"].items():
+                        section["decisions"].setdefault(value, decision)
+            sections.update(self.sections)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": RESOLVER_VERSION, "maps": sections}, f, indent=1)
+            os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class MappingResolver:
+    def __init__(self, name, mapping, cache=None, threshold=0.6, substitute=False):
+        # mapping: a mapping, or a function returning the current one; the
+        # index is built on first use and rebuilt when that mapping changes.
+        # substitute: use a close match for a value missing from the mapping;
+        # otherwise the match is only reported for review
+        self.name = name
+        self.source = mapping if callable(mapping) else lambda: mapping
+        self.mapping = None
+        self.threshold = threshold
+        self.substitute = substitute
+        self.cache = cache if cache is not None else ResolverCache(None)
+        self.flagged = {}
+
+    def current(self):
+        mapping = self.source()
+        if mapping is not self.mapping:
+            self.mapping = mapping
+            self.decisions = self.cache.section(self.name, fingerprint(mapping))
+            self.keys = list(mapping)
+            self.key_grams = [ngrams(key) for key in self.keys]
+            self.index = defaultdict(list)
+            for key_id, grams in enumerate(self.key_grams):
+                for gram in grams:
+                    self.index[gram].append(key_id)
+        return mapping
+
+    def match(self, value):
+        self.current()
+        grams = ngrams(value)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for key_id in self.index.get(gram, ()):
+                overlap[key_id] += 1
+        best, best_score = None, 0.0
+        for key_id, shared in overlap.items():
+            # Dice coefficient over character trigrams
+            score = 2 * shared / (len(grams) + len(self.key_grams[key_id]))
+            if score > best_score:
+                best, best_score = self.keys[key_id], score
+        if best_score < self.threshold:
+            best = None
+        return {"match": best, "score": round(best_score, 3)}
+
+    def decide(self, value):
+        key = str(value)
+        self.current()
+        decision = self.decisions.get(key)
+        if decision is None:
+            decision = self.match(value)
+            self.decisions[key] = decision
+            self.cache.dirty = True
+        self.flagged[key] = decision
+        return decision
+
+    def get(self, value, default=None):
+        mapping = self.current()
+        if value in mapping:
+            return mapping[value]
+        if not isinstance(value, str):
+            return default
+        decision = self.decide(value)
+        if decision["match"] is None or not self.substitute:
+            return default
+        return mapping[decision["match"]]
+
+    def replace(self, series):
+        # Same pass-through behaviour as Series.replace(mapping) for values
+        # that have no close match. Only the series' distinct values are
+        # looked up, so a compiled mapping is never decoded as a whole
+        lookup = {}
+        for value in series.dropna().unique():
+            resolved = self.get(value, value)
+            if resolved != value:
+                lookup[value] = resolved
+        return series.replace(lookup)
+
+    def report(self):
+        lines = []
+        for value, decision in sorted(self.flagged.items()):
+            if decision["match"] is None:
+                action = "unmapped"
+            else:
+                action = "substituted" if self.substitute else "review"
+            lines.append(
+                f"{self.name}: {value!r} -> {decision['match']!r} "
+                f"({decision['score']}, {action})"
+            )
+        return lines
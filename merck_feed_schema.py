@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+# Declared column types for the extracted tables. coerce_frame applies a
+# table's schema in one pass right after extraction / unpack_meta, so the
+# validation and join stages see one type per column instead of whatever
+# read_sql and the meta DataFrame happened to infer.
+#
+#   "string"   identifiers and free text; integral numbers lose the ".0" that
+#              float inference adds (randomization_id 123.0 -> "123")
+#   "int"      nullable integer
+#   "float"    nullable float
+#   "datetime" timestamp, unparseable values become missing
+#   "category" low-cardinality values that are never rewritten downstream
+
+EXAMPLES = 3
+
+
+def _as_text(value):
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float):
+        if np.isnan(value):
+            return None
+        if value.is_integer():
+            return str(int(value))
+    if isinstance(value, (np.integer, np.floating)):
+        return _as_text(value.item())
+    return str(value)
+
+
+def _plain(values):
+    if isinstance(values.dtype, pd.ArrowDtype):
+        return values.astype(object)
+    return values
+
+
+def _to_string(values):
+    values = _plain(values)
+    uniques = pd.unique(values.dropna())
+    lookup = {value: _as_text(value) for value in uniques}
+    return values.map(lookup).astype(object).where(values.notna(), None)
+
+
+def _to_numeric(values, kind):
+    values = _plain(values)
+    if values.dtype == object:
+        values = values.where(values.notna(), np.nan)
+    numbers = pd.to_numeric(values, errors="coerce")
+    if kind == "int":
+        # Non-integral values count as invalid rather than being truncated
+        numbers = numbers.where(numbers.isna() | (numbers % 1 == 0))
+        return numbers.astype("Int64")
+    return numbers.astype("float64")
+
+
+def _to_datetime(values):
+    values = _plain(values)
+    if values.dtype == object:
+        values = values.where(values.notna(), None)
+    return pd.to_datetime(values, errors="coerce")
+
+
+COERCIONS = {
+    "string": _to_string,
+    "int": lambda values: _to_numeric(values, "int"),
+    "float": lambda values: _to_numeric(values, "float"),
+    "datetime": _to_datetime,
+    "category": lambda values: _plain(values).astype("category"),
+}
+
+ARROW_TYPES = {
+    "string": "string",
+    "int": "int64",
+    "float": "double",
+    "datetime": "timestamp[ns]",
+}
+
+
+def _to_arrow(values, kind):
+    import pyarrow as pa
+
+    if kind not in ARROW_TYPES:
+        return values
+    array = pa.array(
+        values, type=pa.type_for_alias(ARROW_TYPES[kind]), from_pandas=True
+    )
+    return pd.Series(pd.arrays.ArrowExtensionArray(array), index=values.index)
+
+
+def coerce_frame(frame, schema, arrow=False):
+    # Returns the coerced frame and a report of {column: (invalid, examples)}
+    # plus the undeclared columns, which are passed through untouched
+    report = {"invalid": {}, "undeclared": []}
+    columns = {}
+    for column in frame.columns:
+        values = frame[column]
+        kind = schema.get(column)
+        if kind is None:
+            report["undeclared"].append(column)
+            columns[column] = values
+            continue
+        coerced = COERCIONS[kind](values)
+        lost = values.notna().to_numpy() & coerced.isna().to_numpy()
+        if lost.any():
+            examples = pd.unique(_plain(values)[lost])[:EXAMPLES]
+            report["invalid"][column] = (int(lost.sum()), [str(e) for e in examples])
+        columns[column] = _to_arrow(coerced, kind) if arrow else coerced
+    return pd.DataFrame(columns, index=frame.index), report
+
+
+def format_report(table, report):
+    lines = [
+        f"SCHEMA {table}.{column}: {count} invalid value(s), e.g. {', '.join(examples)}"
+        for column, (count, examples) in sorted(report["invalid"].items())
+    ]
+    if report["undeclared"]:
+        lines.append(f"SCHEMA {table}: undeclared {', '.join(report['undeclared'])}")
+    return lines
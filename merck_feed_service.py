@@ -0,0 +1,90 @@
+import json
+import os
+import socketserver
+import threading
+import time
+import traceback
+
+from merck_feed_log import event
+
+# Resident feed process. The feed state stays in memory between requests; a
+# background thread refreshes it every `interval` seconds and clients ask for
+# exports over a Unix socket, one JSON request / response line each.
+
+
+class FeedService:
+    def __init__(self, refresh, commands, interval=300):
+        # refresh(state) updates the state in place; commands map a request
+        # name to handler(state, **arguments) returning a JSON-able result
+        self.refresh = refresh
+        self.commands = dict(commands, refresh=lambda state: self.refresh(state))
+        self.interval = interval
+        self.state = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self, command, **arguments):
+        if command == "status":
+            return {"refreshed": self.state.get("refreshed")}
+        if command not in self.commands:
+            raise ValueError(f"unknown command {command}")
+        with self.lock:
+            return self.commands[command](self.state, **arguments)
+
+    def _refresh(self):
+        with self.lock:
+            started = time.time()
+            self.refresh(self.state)
+            self.state["refreshed"] = started
+
+    def _refresh_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self._refresh()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        self._refresh()
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            result = self.server.service.run(
+                request["command"], **request.get("arguments", {})
+            )
+            response = {"ok": True, "result": result}
+        except Exception as error:
+            traceback.print_exc()
+            response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+        self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+
+def serve(service, address):
+    if os.path.exists(address):
+        os.remove(address)
+    service.start()
+    with socketserver.ThreadingUnixStreamServer(address, _Handler) as server:
+        server.service = service
+        event("service_listening", address=address)
+        try:
+            server.serve_forever()
+        finally:
+            service.stopped.set()
+            os.remove(address)
+
+
+def request(address, command, **arguments):
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(address)
+        payload = {"command": command, "arguments": arguments}
+        connection.sendall(json.dumps(payload).encode() + b"\n")
+        response = json.loads(connection.makefile().readline())
+    if not response["ok"]:
+        raise RuntimeError(response["error"])
+    return response["result"]
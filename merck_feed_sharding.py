@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from merck_feed_frames import frame_to_table, table_to_frame
+
+
+def shard_ids(codes, shards):
+    hashes = pd.util.hash_pandas_object(codes.astype(object), index=False)
+    return hashes.to_numpy() % np.uint64(shards)
+
+
+def _stream_size(table):
+    size = pa.MockOutputStream()
+    with pa.ipc.new_stream(size, table.schema) as writer:
+        writer.write_table(table)
+    return size.size()
+
+
+def _write_stream(view, table):
+    sink = pa.FixedSizeBufferWriter(pa.py_buffer(view))
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    sink.close()
+
+
+def write_shared(frame):
+    table = frame_to_table(frame)
+    # Size the segment first, then serialize straight into it
+    shm = SharedMemory(create=True, size=max(_stream_size(table), 1))
+    _write_stream(shm.buf, table)
+    shm.close()
+    return shm.name
+
+
+def write_shared_shards(frames):
+    # All the input shards in one segment, one IPC stream (schema included)
+    # after the other; returns the segment name and each stream's span
+    tables = [frame_to_table(frame) for frame in frames]
+    sizes = [_stream_size(table) for table in tables]
+    shm = SharedMemory(create=True, size=max(sum(sizes), 1))
+    spans, offset = [], 0
+    for table, size in zip(tables, sizes):
+        with shm.buf[offset : offset + size] as view:
+            _write_stream(view, table)
+        spans.append((offset, size))
+        offset += size
+    shm.close()
+    return shm.name, spans
+
+
+def read_shared(name):
+    shm = SharedMemory(name=name)
+    try:
+        # One memcpy out of the segment so the frame owns its buffers once the
+        # segment is unlinked
+        table = pa.ipc.open_stream(pa.py_buffer(bytes(shm.buf))).read_all()
+        return table_to_frame(table)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def read_shared_shard(name, offset, size):
+    # Copies only this shard's stream out; the segment stays for the others
+    # and the parent unlinks it
+    shm = SharedMemory(name=name)
+    try:
+        data = bytes(shm.buf[offset : offset + size])
+    finally:
+        shm.close()
+    return table_to_frame(pa.ipc.open_stream(pa.py_buffer(data)).read_all())
+
+
+def discard_shared(name):
+    try:
+        shm = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+class ShardPool:
+    # Worker processes for run_sharded, forked up front while the process
+    # runs no other thread: a fork copies every lock, including those another
+    # thread holds at that moment, and the child can never release them
+    def __init__(self):
+        self.executor = None
+        self.workers = 0
+        self.pid = None
+
+    def start(self, workers):
+        # False when workers <= 1 or other threads already run; run_sharded
+        # then validates in this process
+        if self.running() and self.workers >= workers:
+            return True
+        self.stop()
+        if workers <= 1 or threading.active_count() > 1:
+            return False
+        # Workers must register their segments with the parent's tracker,
+        # otherwise a worker exiting would unlink results not yet read
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        )
+        # A fork context launches every worker on the first task
+        self.executor.submit(int).result()
+        self.workers, self.pid = workers, os.getpid()
+        return True
+
+    def running(self):
+        # A forked child holds a copy of its parent's pool it cannot use
+        return self.executor is not None and self.pid == os.getpid()
+
+    def stop(self):
+        if self.running():
+            self.executor.shutdown()
+        self.executor, self.workers, self.pid = None, 0, None
+
+
+def _run_shard(func, shard, prepare, kwargs):
+    if prepare is not None:
+        prepare()
+    return write_shared(func(read_shared_shard(*shard), **kwargs))
+
+
+def run_sharded(
+    func,
+    frame,
+    pool,
+    workers,
+    key="inventory_code",
+    min_rows=20000,
+    prepare=None,
+    **kwargs,
+):
+    # prepare: called in the worker before func, e.g. to pick up state that
+    # changed since the pool forked. Small tables are not worth the shipping,
+    # and a tiny shard can end up empty after the validation filters, which
+    # the row-wise applies do not handle
+    shards = min(workers, pool.workers, len(frame) // min_rows)
+    if not pool.running() or shards <= 1 or not frame.index.is_unique:
+        return func(frame, **kwargs)
+
+    ids = shard_ids(frame[key], shards)
+    # The workers get the segment name and their shard's span, not the rows
+    block, spans = write_shared_shards(
+        [frame.iloc[ids == shard] for shard in range(shards)]
+    )
+    names, parts = [], []
+    try:
+        futures = [
+            pool.executor.submit(_run_shard, func, (block, *span), prepare, kwargs)
+            for span in spans
+        ]
+        wait(futures)
+        names = [future.result() for future in futures if future.exception() is None]
+        for future in futures:
+            future.result()  # the first worker error, if any
+        while names:
+            parts.append(read_shared(names.pop(0)))
+    finally:
+        # The input shards, and the results of the shards that finished when
+        # another one failed
+        discard_shared(block)
+        for name in names:
+            discard_shared(name)
+
+    validated = pd.concat(parts)
+    # Reassemble in the serial path's row order
+    order = frame.index[frame.index.isin(validated.index)]
+    return validated.loc[order]
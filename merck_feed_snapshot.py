@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from merck_feed_frames import frame_to_table, table_to_frame
+from merck_feed_layout import BIOTRACS
+
+# Queryable copy of the latest export. <directory>/LATEST names the current
+# snapshot directory, which holds:
+#   export.parquet   rows sorted by Study Number, Current Status, in small
+#                    row groups
+#   specimens.npz    sorted 64-bit hashes of Specimen ID -> row position
+#   index.json       per row group min / max of the study, status and date
+#                    columns (zone maps), so filters only read matching groups
+
+ROW_GROUP = 4096
+LATEST = "LATEST"
+# Snapshot directories are named by file_time; a replaced one is kept this
+# long for readers that opened it just before the switch
+SNAPSHOT_NAME = re.compile(r"\d{8}_\d{6}")
+GRACE_SECONDS = 3600
+SORTED_COLUMNS = ["Study Number", "Current Status"]
+DATE_COLUMNS = [
+    "Collection Date",
+    "Terminal Date",
+    "Shipped Date",
+    "Created Date",
+    "Received Date",
+]
+DATE_FORMAT = "%m/%d/%Y"
+
+
+def _hashes(values):
+    return pd.util.hash_pandas_object(
+        pd.Series(values, dtype=object).astype(str), index=False
+    ).to_numpy()
+
+
+def _zone(values):
+    values = values.dropna().astype(str)
+    values = values[values != ""]
+    if values.empty:
+        return None
+    return [str(values.min()), str(values.max())]
+
+
+def _dates(values):
+    return pd.to_datetime(values, format=DATE_FORMAT, errors="coerce")
+
+
+def read_latest(directory):
+    try:
+        with open(os.path.join(directory, LATEST)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(
+    directory, export, file_time, row_group=ROW_GROUP, grace=GRACE_SECONDS
+):
+    keys = [export[column].fillna("").astype(str) for column in SORTED_COLUMNS]
+    export = export.iloc[np.lexsort(keys[::-1])].reset_index(drop=True)
+
+    snapshot = os.path.join(directory, file_time)
+    shutil.rmtree(snapshot, ignore_errors=True)
+    os.makedirs(snapshot)
+    pq.write_table(
+        frame_to_table(export),
+        os.path.join(snapshot, "export.parquet"),
+        row_group_size=row_group,
+        compression="zstd",
+    )
+    hashes = _hashes(export["Specimen ID"])
+    order = np.argsort(hashes, kind="stable")
+    np.savez(os.path.join(snapshot, "specimens.npz"), hashes=hashes[order], rows=order)
+    zones = []
+    for start in range(0, len(export), row_group):
+        rows = export.iloc[start : start + row_group]
+        zone = {column: _zone(rows[column]) for column in SORTED_COLUMNS}
+        for column in DATE_COLUMNS:
+            dates = _dates(rows[column])
+            zone[column] = _zone(dates.dt.strftime("%Y-%m-%d"))
+        zones.append(zone)
+    with open(os.path.join(snapshot, "index.json"), "w") as f:
+        json.dump(
+            {
+                "file_time": file_time,
+                "rows": len(export),
+                "row_group": row_group,
+                "zones": zones,
+            },
+            f,
+        )
+
+    # Switch LATEST last. The snapshot it replaced is stamped with the switch
+    # time; snapshots replaced more than grace seconds ago are dropped
+    previous = read_latest(directory)
+    with open(os.path.join(directory, f"{LATEST}.tmp"), "w") as f:
+        f.write(file_time)
+    os.replace(
+        os.path.join(directory, f"{LATEST}.tmp"), os.path.join(directory, LATEST)
+    )
+    if previous and previous != file_time:
+        try:
+            os.utime(os.path.join(directory, previous))
+        except FileNotFoundError:
+            pass
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if (
+            name != file_time
+            and SNAPSHOT_NAME.fullmatch(name)
+            and os.path.isdir(path)
+            and now - os.path.getmtime(path) > grace
+        ):
+            shutil.rmtree(path, ignore_errors=True)
+    return snapshot
+
+
+class Snapshot:
+    def __init__(self, directory):
+        with open(os.path.join(directory, LATEST)) as f:
+            self.path = os.path.join(directory, f.read().strip())
+        with open(os.path.join(self.path, "index.json")) as f:
+            self.index = json.load(f)
+        self.file = pq.ParquetFile(os.path.join(self.path, "export.parquet"))
+        self.groups_read = 0
+
+    def _read(self, groups):
+        groups = sorted(set(groups))
+        self.groups_read = len(groups)
+        if not groups:
+            table = self.file.schema_arrow.empty_table()
+        else:
+            table = self.file.read_row_groups(groups)
+        return BIOTRACS.materialize(table_to_frame(table))
+
+    def lookup(self, specimen_ids):
+        specimens = np.load(os.path.join(self.path, "specimens.npz"))
+        wanted = _hashes(specimen_ids)
+        starts = np.searchsorted(specimens["hashes"], wanted, "left")
+        ends = np.searchsorted(specimens["hashes"], wanted, "right")
+        rows = np.concatenate(
+            [specimens["rows"][a:b] for a, b in zip(starts, ends)] + [[]]
+        ).astype(np.int64)
+        found = self._read(rows // self.index["row_group"])
+        found = found[found["Specimen ID"].astype(str).isin(map(str, specimen_ids))]
+        return found.reset_index(drop=True)
+
+    def query(self, study=None, status=None, date_column=None, since=None, until=None):
+        # Equality on study / status and an inclusive date range; a row group
+        # is read only when its zone map can contain a match
+        since = pd.Timestamp(since).strftime("%Y-%m-%d") if since else None
+        until = pd.Timestamp(until).strftime("%Y-%m-%d") if until else None
+
+        def may_match(zone):
+            for column, value in (("Study Number", study), ("Current Status", status)):
+                if value is not None and (
+                    zone[column] is None
+                    or not zone[column][0] <= value <= zone[column][1]
+                ):
+                    return False
+            if date_column and (since or until):
+                dates = zone[date_column]
+                if dates is None:
+                    return False
+                if (since and dates[1] < since) or (until and dates[0] > until):
+                    return False
+            return True
+
+        zones = self.index["zones"]
+        found = self._read(i for i, zone in enumerate(zones) if may_match(zone))
+        mask = pd.Series(True, index=found.index)
+        if study is not None:
+            mask &= found["Study Number"] == study
+        if status is not None:
+            mask &= found["Current Status"] == status
+        if date_column and (since or until):
+            dates = _dates(found[date_column])
+            if since:
+                mask &= dates >= pd.Timestamp(since)
+            if until:
+                mask &= dates <= pd.Timestamp(until)
+        return found[mask.to_numpy()].reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the latest feed export")
+    parser.add_argument("directory", help="MERCK_FEED_SNAPSHOT_DIR")
+    parser.add_argument("--specimen", action="append", help="Specimen ID, repeatable")
+    parser.add_argument("--study")
+    parser.add_argument("--status")
+    parser.add_argument("--date-column", choices=DATE_COLUMNS)
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    parser.add_argument("--columns", help="comma-separated output columns")
+    args = parser.parse_args(argv)
+
+    snapshot = Snapshot(args.directory)
+    if args.specimen:
+        found = snapshot.lookup(args.specimen)
+    else:
+        found = snapshot.query(
+            args.study, args.status, args.date_column, args.since, args.until
+        )
+    if args.columns:
+        found = found[args.columns.split(",")]
+    print(found.to_csv(index=False), end="")
+    print(
+        f"# {len(found)} row(s), {snapshot.groups_read} of "
+        f"{len(snapshot.index['zones'])} row group(s) read "
+        f"from snapshot {snapshot.index['file_time']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
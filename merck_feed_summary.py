@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Feed summary for dashboards: export row counts per (Study Number, Current
+# Status, Specimen Type, Destination Facility) group with the Nucleic Acid
+# Yield total of each group, in one small parquet file. Any rollup (per study,
+# per status, yield per study, ...) is a groupby over it. Yields are summed in
+# integer thousandths (the export writes them with 3 decimals), so adding and
+# subtracting delta rows run after run stays exact.
+
+SUMMARY = "summary.parquet"
+DIMENSIONS = [
+    "Study Number",
+    "Current Status",
+    "Specimen Type",
+    "Destination Facility",
+]
+YIELD = "Nucleic Acid Yield"
+MEASURES = ["rows", "yield_rows", "yield_milli"]
+
+
+def _empty():
+    frame = pd.DataFrame({name: pd.Series([], dtype=object) for name in DIMENSIONS})
+    for name in MEASURES:
+        frame[name] = pd.Series([], dtype=np.int64)
+    return frame
+
+
+def summarize(frame):
+    # Missing dimension values are grouped under ""
+    groups = pd.DataFrame(
+        {name: frame[name].fillna("").astype(str) for name in DIMENSIONS}
+    )
+    milli = (pd.to_numeric(frame[YIELD], errors="coerce") * 1000).round()
+    groups["rows"] = np.int64(1)
+    groups["yield_rows"] = milli.notna().astype(np.int64).to_numpy()
+    groups["yield_milli"] = milli.fillna(0).astype(np.int64).to_numpy()
+    if groups.empty:
+        return _empty()
+    return groups.groupby(DIMENSIONS, as_index=False, sort=True)[MEASURES].sum()
+
+
+def _combine(parts, signs):
+    frames = [
+        part.assign(**{name: part[name] * sign for name in MEASURES})
+        for part, sign in zip(parts, signs)
+    ]
+    total = pd.concat(frames, ignore_index=True)
+    if total.empty:
+        return _empty()
+    total = total.groupby(DIMENSIONS, as_index=False, sort=True)[MEASURES].sum()
+    return total[total["rows"] != 0].reset_index(drop=True)
+
+
+def rollup(groups, by):
+    by = [by] if isinstance(by, str) else list(by)
+    total = groups.groupby(by, as_index=False, sort=True)[MEASURES].sum()
+    total["yield"] = total["yield_milli"] / 1000
+    return total.drop(columns=["yield_milli"])
+
+
+class FeedSummary:
+    def __init__(self, directory):
+        self.path = os.path.join(directory, SUMMARY)
+        self.exists = os.path.exists(self.path)
+        self.state = {}
+        self.groups = _empty()
+        if self.exists:
+            table = pq.read_table(self.path)
+            self.groups = table.to_pandas()
+            metadata = table.schema.metadata or {}
+            self.state = json.loads(metadata.get(b"merck_feed", b"{}"))
+
+    def replace(self, export):
+        self.groups = summarize(export)
+
+    def update(self, removed, added):
+        # removed / added: the old and new export rows of what changed
+        self.groups = _combine(
+            [self.groups, summarize(removed), summarize(added)], [1, -1, 1]
+        )
+
+    def save(self, **state):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        table = pa.Table.from_pandas(self.groups, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {"merck_feed": json.dumps(state, default=str)}
+        )
+        pq.write_table(table, f"{self.path}.tmp", compression="zstd")
+        os.replace(f"{self.path}.tmp", self.path)
+        self.state, self.exists = state, True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Feed summary rollups")
+    parser.add_argument("directory", help="MERCK_FEED_SUMMARY_DIR")
+    parser.add_argument(
+        "--by",
+        action="append",
+        choices=DIMENSIONS,
+        help="group by these dimensions, repeatable (default: Study Number)",
+    )
+    args = parser.parse_args(argv)
+    summary = FeedSummary(args.directory)
+    print(
+        rollup(summary.groups, args.by or ["Study Number"]).to_csv(index=False), end=""
+    )
+    print(f"# {json.dumps(summary.state)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from merck_feed_csv import csv_chunks
+from merck_feed_log import event
+from merck_feed_outputs import content_hash
+
+# Chunked uploads of the feed CSVs. Each file is streamed from csv_chunks in
+# fixed-size blocks; the state file records the committed offset of every
+# block, so a failed run resumes the same upload session where it stopped
+# (the CSV bytes are deterministic), and the content hash of the last
+# finished upload per file key, so unchanged files are not sent again.
+
+CHUNK_SIZE = 8 * 1024 * 1024
+TIMEOUT = (10, 300)
+
+
+def http_session(username, password, pool_size=4):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.auth = (username, password)
+    # Only connection failures are retried here; a failed block is retried
+    # by resuming the upload at its recorded offset
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(connect=3, read=0, status=0, backoff_factor=1),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class SharePointBackend:
+    # SharePoint REST upload sessions: StartUpload / ContinueUpload /
+    # FinishUpload on a file created empty in the target folder
+    def __init__(self, base_site, folder, session):
+        self.base_site = base_site.rstrip("/")
+        self.folder = folder.rstrip("/")
+        self.session = session
+        self.lock = threading.Lock()
+        self.digest = None
+
+    def _digest(self):
+        with self.lock:
+            if self.digest is None:
+                response = self._post("_api/contextinfo", digest=False)
+                self.digest = response.json()["FormDigestValue"]
+            return self.digest
+
+    def _post(self, path, data=None, digest=True):
+        headers = {"Accept": "application/json;odata=nometadata"}
+        if digest:
+            headers["X-RequestDigest"] = self._digest()
+        response = self.session.post(
+            f"{self.base_site}/{path}", data=data, headers=headers, timeout=TIMEOUT
+        )
+        response.raise_for_status()
+        return response
+
+    def write(self, name, upload_id, offset, data, last):
+        folder = f"_api/web/GetFolderByServerRelativeUrl('{self.folder}')"
+        file = f"_api/web/GetFileByServerRelativeUrl('{self.folder}/{name}')"
+        session = f"uploadId=guid'{upload_id}'"
+        if offset == 0:
+            add = f"{folder}/Files/add(url='{name}',overwrite=true)"
+            if last:
+                self._post(add, data)
+                return
+            self._post(add, b"")
+            self._post(f"{file}/StartUpload({session})", data)
+        elif last:
+            self._post(f"{file}/FinishUpload({session},fileOffset={offset})", data)
+        else:
+            self._post(f"{file}/ContinueUpload({session},fileOffset={offset})", data)
+
+
+class LocalBackend:
+    # Stand-in target directory: blocks go to a hidden .part file that is
+    # renamed into place by the last block
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, name, upload_id, offset, data, last):
+        part = os.path.join(self.directory, f".{upload_id}.part")
+        with open(part, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+        if last:
+            os.replace(part, os.path.join(self.directory, name))
+
+
+def _blocks(chunks, size):
+    # (offset, block, last) for fixed-size blocks of the chunk stream
+    def fixed():
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= size:
+                yield bytes(buffer[:size])
+                del buffer[:size]
+        if buffer:
+            yield bytes(buffer)
+
+    offset, previous = 0, None
+    for block in fixed():
+        if previous is not None:
+            yield offset, previous, False
+            offset += len(previous)
+        previous = block
+    yield offset, previous or b"", True
+
+
+class Uploader:
+    def __init__(
+        self, backend, state_path=None, chunk_size=CHUNK_SIZE, workers=4, layout=None
+    ):
+        self.backend = backend
+        self.layout = layout
+        self.state_path = state_path
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.state = {}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def _record(self, key, entry):
+        with self.lock:
+            self.state[key] = entry
+            if not self.state_path:
+                return
+            with open(f"{self.state_path}.tmp", "w") as f:
+                json.dump(self.state, f, indent=1, sort_keys=True)
+            os.replace(f"{self.state_path}.tmp", self.state_path)
+
+    def upload_file(self, key, name, frame, compression=None, csv_workers=4):
+        # Returns False when the same content was already uploaded for key
+        digest = f"{content_hash(frame)}:{compression}"
+        entry = self.state.get(key, {})
+        if entry.get("done") and entry["content_hash"] == digest:
+            event("upload_skipped", key=key, unchanged_since=entry["name"])
+            return False
+        if (
+            entry.get("done")
+            or entry.get("content_hash") != digest
+            or entry.get("name") != name
+        ):
+            entry = {"upload_id": str(uuid.uuid4()), "offset": 0}
+        elif entry["offset"]:
+            event("upload_resumed", key=key, name=name, offset=entry["offset"])
+        entry.update(name=name, content_hash=digest, done=False)
+
+        chunks = csv_chunks(frame, compression, csv_workers, layout=self.layout)
+        for offset, block, last in _blocks(chunks, self.chunk_size):
+            if offset + len(block) <= entry["offset"] and not last:
+                continue
+            self.backend.write(name, entry["upload_id"], offset, block, last)
+            self._record(key, dict(entry, offset=offset + len(block), done=last))
+        return True
+
+    def upload(self, files, compression=None, csv_workers=4):
+        # files: [(key, name, frame)]; returns the names actually uploaded
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            sent = list(
+                pool.map(
+                    lambda file: self.upload_file(*file, compression, csv_workers),
+                    files,
+                )
+            )
+        return [name for (_, name, _), uploaded in zip(files, sent) if uploaded]
@@ -0,0 +1,262 @@
+import datetime
+import importlib.util
+import os
+import random
+import sys
+import types
+
+import pytest
+from sqlalchemy import JSON, Column, DateTime, Float, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+# The feed script runs inside Airflow next to the LIMS models. The tests stand
+# in for both: a SQLite LIMS database with the tables the feed reads, and the
+# Variable / context helpers it star-imports from scripts.dependencies.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+Base = declarative_base()
+
+
+class Accessioning(Base):
+    __tablename__ = "accessioning"
+    id = Column(Integer, primary_key=True)
+    client = Column(String)
+    inventory_code = Column(String)
+    analysis_type = Column(String)
+    draw_date = Column(String)
+    draw_time = Column(String)
+    created_on = Column(DateTime)
+    status = Column(String)
+    origination_facility = Column(String)
+    date_received = Column(DateTime)
+    source = Column(String)
+    study_name = Column(String)
+    ruid = Column(String)
+    container_type = Column(String)
+    comments = Column(String)
+    meta = Column(JSON)
+
+
+class Aliquot(Base):
+    __tablename__ = "aliquot"
+    id = Column(Integer, primary_key=True)
+    client = Column(String)
+    inventory_code = Column(String)
+    parent_barcode = Column(String)
+    ultimate_parent = Column(String)
+    status = Column(String)
+    ruid = Column(String)
+    container_type = Column(String)
+    aliquot_created_on = Column(DateTime)
+    source = Column(String)
+    meta = Column(JSON)
+
+
+class QualityControl(Base):
+    __tablename__ = "quality_control"
+    id = Column(Integer, primary_key=True)
+    client = Column(String)
+    inventory_code = Column(String)
+    concentration = Column(Float)
+    concentration_unit = Column(String)
+    vol_avg = Column(Float)
+    volume_unit = Column(String)
+    meta = Column(JSON)
+
+
+class StatusUpdates(Base):
+    __tablename__ = "status_updates"
+    id = Column(Integer, primary_key=True)
+    client = Column(String)
+    inventory_code = Column(String)
+    status = Column(String)
+    site_name = Column(String)
+    stored_date = Column(DateTime)
+    shipped_date = Column(DateTime)
+    disposed_date = Column(DateTime)
+    date_updated = Column(DateTime)
+
+
+MODELS = {
+    "Accessioning": Accessioning,
+    "Aliquot": Aliquot,
+    "QualityControl": QualityControl,
+    "StatusUpdates": StatusUpdates,
+}
+START = datetime.datetime(2022, 1, 1)
+# An accession that was disposed of after being shipped, for the as-of tests
+SHIPPED = "8013390900"
+VARIABLES = {}
+
+
+class Variable:
+    @staticmethod
+    def get(key, default_var=None, deserialize_json=False):
+        return VARIABLES.get(key, default_var)
+
+
+class NotScheduled(Exception):
+    pass
+
+
+def get_current_context():
+    # Loading the script starts a run; the tests only use its functions
+    raise NotScheduled
+
+
+def send_data(name, frame):
+    pass
+
+
+def seed(session, accessions=60):
+    rng = random.Random(1)
+    statuses = ["Stored", "Shipped", "Disposed", "Discarded", "Released", "Weird"]
+    facilities = ["MSD-Celerion", "MSD-SCRI", "Unknown Place", None]
+    for i in range(accessions):
+        code = str(8013390000 + i)
+        created = START + datetime.timedelta(days=i)
+        session.add(
+            Accessioning(
+                client="MERCK",
+                inventory_code=code,
+                analysis_type=rng.choice(["RNA analysis", "Genetic Analysis ", None]),
+                draw_date=created.strftime("%Y-%m-%d"),
+                draw_time="10:%02d" % (i % 60),
+                created_on=created,
+                status=rng.choice(statuses),
+                origination_facility=rng.choice(facilities),
+                date_received=created + datetime.timedelta(days=1),
+                source=rng.choice(["PL", "BC", "DNA-WB", "S"]),
+                study_name=rng.choice(["MK0000386", "MK3475A", "MK1234", "V501200"]),
+                ruid=f"R{i}",
+                container_type=rng.choice(["10 mL EDTA", "Micronic 1.4", "Cryovial"]),
+                comments=rng.choice(["ok", None]),
+                meta={
+                    "site": rng.choice([12, "0034", None]),
+                    "randomization_id": rng.choice([None, 123, "45"]),
+                    "screening_number": rng.choice([None, 99]),
+                },
+            )
+        )
+        for j in range(rng.randint(0, 2)):
+            aliquot = f"{code}{j:02d}" if j else f"A{code}"
+            session.add(
+                Aliquot(
+                    client="MERCK",
+                    inventory_code=aliquot,
+                    parent_barcode=code,
+                    ultimate_parent=code,
+                    status=rng.choice(statuses[:5]),
+                    ruid=f"RA{i}{j}",
+                    container_type=rng.choice(["Cryovial", "BloodSpotCard"]),
+                    aliquot_created_on=created + datetime.timedelta(days=2),
+                    source=rng.choice(["DNA-WB", "PL"]),
+                    meta={"extra": j},
+                )
+            )
+            session.add(
+                QualityControl(
+                    client="MERCK",
+                    inventory_code=aliquot,
+                    concentration=rng.choice([None, 12.5, 3.33333]),
+                    concentration_unit="ng/ul",
+                    vol_avg=rng.choice([None, 1.5, 200.0]),
+                    volume_unit=rng.choice(["ml", "uL", None]),
+                    meta={"q": 1},
+                )
+            )
+        for k in range(rng.randint(0, 3)):
+            status = rng.choice(statuses[:4])
+            updated = created + datetime.timedelta(days=3 * k)
+            session.add(
+                StatusUpdates(
+                    client="MERCK",
+                    inventory_code=code,
+                    status=status,
+                    site_name=rng.choice(facilities),
+                    stored_date=updated,
+                    shipped_date=updated if status == "Shipped" else None,
+                    disposed_date=updated if status == "Disposed" else None,
+                    date_updated=updated,
+                )
+            )
+    session.add(
+        Accessioning(
+            client="MERCK",
+            inventory_code=SHIPPED,
+            created_on=START,
+            status="Disposed",
+            source="PL",
+            study_name="MK1234",
+            container_type="Cryovial",
+            meta={},
+        )
+    )
+    for status, updated in (("Shipped", "2022-03-01"), ("Disposed", "2022-06-01")):
+        updated = datetime.datetime.fromisoformat(updated)
+        session.add(
+            StatusUpdates(
+                client="MERCK",
+                inventory_code=SHIPPED,
+                status=status,
+                site_name="MSD-SCRI",
+                shipped_date=updated if status == "Shipped" else None,
+                disposed_date=updated if status == "Disposed" else None,
+                date_updated=updated,
+            )
+        )
+    session.add(
+        Accessioning(
+            client="OTHER",
+            inventory_code="X1",
+            status="Stored",
+            source="PL",
+            container_type="Cryovial",
+            meta={},
+        )
+    )
+    session.commit()
+
+
+def stand_in(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+@pytest.fixture(scope="session")
+def feed(tmp_path_factory):
+    # merck_data_feed_new loaded against a seeded SQLite LIMS database
+    directory = tmp_path_factory.mktemp("feed")
+    engine = create_engine(f"sqlite:///{directory / 'lims.db'}")
+    Base.metadata.create_all(engine)
+    seed(sessionmaker(bind=engine)())
+    VARIABLES["MERCK_FEED_MAPPINGS_ARTIFACT"] = str(directory / "mappings.bin")
+    stand_in("airflow")
+    stand_in(
+        "airflow.exceptions",
+        AirflowException=type("AirflowException", (Exception,), {}),
+    )
+    stand_in("models")
+    stand_in("models.session", SessionLocal=sessionmaker(bind=engine))
+    stand_in("models.accessioning", **MODELS)
+    stand_in("scripts")
+    stand_in("scripts.dependencies")
+    stand_in(
+        "scripts.dependencies.table_columns",
+        Variable=Variable,
+        get_current_context=get_current_context,
+        send_data=send_data,
+    )
+    path = os.path.join(ROOT, "merck_data_feed_new.py")
+    spec = importlib.util.spec_from_file_location("merck_data_feed_new", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    try:
+        spec.loader.exec_module(module)
+    except NotScheduled:
+        pass
+    return module
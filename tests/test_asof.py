@@ -0,0 +1,24 @@
+import pandas as pd
+from conftest import SHIPPED
+
+
+def test_asof_export_at_the_current_time_matches_the_export(feed):
+    export = feed.join_tables(feed.validate_tables(feed.extract_tables()))
+    [(_, asof)] = feed.asof_exports([pd.Timestamp.now()])
+    pd.testing.assert_frame_equal(
+        asof.reset_index(drop=True), export.reset_index(drop=True)
+    )
+
+
+def test_asof_status_falls_back_to_the_accession_status(feed):
+    # Before its first update a specimen keeps its LIMS status, afterwards it
+    # carries the status of the latest update at or before the snapshot
+    timestamps = [pd.Timestamp("2022-02-01"), pd.Timestamp("2022-04-01")]
+    statuses = [
+        export.set_index("Specimen ID").at[SHIPPED, "Current Status"]
+        for _, export in feed.asof_exports(timestamps)
+    ]
+    assert statuses == [
+        feed.STATUS_MAP["Disposed"],
+        feed.STATUS_MAP["Shipped"],
+    ]
@@ -0,0 +1,49 @@
+import io
+
+import pandas as pd
+import pytest
+from merck_feed_backend import frame_backend
+
+
+def export_csv(feed, settings):
+    tables = feed.extract_tables(settings=settings)
+    export = feed.join_tables(
+        feed.validate_tables(tables, settings=settings), settings=settings
+    )
+    stream = io.BytesIO()
+    feed.write_csv(export, stream, layout=feed.BIOTRACS)
+    return stream.getvalue()
+
+
+@pytest.mark.parametrize("backend", ["object", "arrow"])
+def test_export_bytes_match_on_both_backends(feed, backend):
+    settings = {**feed.SETTINGS, "backend": backend}
+    pandas = export_csv(feed, {**settings, "frames": "pandas"})
+    polars = export_csv(feed, {**settings, "frames": "polars"})
+    assert polars == pandas
+
+
+def test_merge_order_matches_pandas():
+    left = pd.DataFrame(
+        {"key": ["b", "a", None, "b", "c"], "x": range(5)}, index=[9, 7, 5, 3, 1]
+    )
+    right = pd.DataFrame({"key": ["b", None, "a", "b"], "x": [1.5, 2.5, 3.5, 4.5]})
+    for how in ("inner", "left"):
+        expected = left.merge(right, how=how, on=["key"], suffixes=("", "_r"))
+        for name in ("pandas", "polars"):
+            merged = frame_backend(name).merge(
+                left, right, how=how, on=["key"], suffixes=("", "_r")
+            )
+            pd.testing.assert_frame_equal(merged, expected)
+
+
+def test_latest_keeps_the_last_of_equal_timestamps():
+    updated = pd.to_datetime(["2022-01-02", "2022-01-01", "2022-01-02", None])
+    frame = pd.DataFrame(
+        {"code": ["a", "b", "a", "b"], "date": updated, "n": [1, 2, 3, 4]},
+        index=[4, 3, 2, 1],
+    )
+    for name in ("pandas", "polars"):
+        latest = frame_backend(name).latest(frame, "code", "date")
+        assert list(latest["n"]) == [3, 4]
+        assert list(latest.index) == [2, 1]
@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+from conftest import START
+
+
+def assert_matches_feed(feed):
+    # The stored rows, in their stored order, are the rows the feed builds
+    flags = feed.table_missing_status()
+    export = feed.build_export_rows(missing_status=flags)[0]
+    stored = feed.read_export_table()
+    assert stored.to_csv(index=False) == export.to_csv(index=False)
+
+
+@pytest.mark.parametrize("schema", [False, True])
+def test_export_table_rows_match_the_feed(feed, monkeypatch, schema):
+    monkeypatch.setitem(feed.SETTINGS, "schema", schema)
+    feed.refresh_export_table(full=True)
+    assert_matches_feed(feed)
+
+    # An edited QC row, a removed aliquot and a new accession
+    db = feed.db
+    try:
+        qc = db.query(feed.QualityControl).order_by(feed.QualityControl.id).first()
+        qc.concentration = 42.0
+        aliquot = db.query(feed.Aliquot).order_by(feed.Aliquot.id.desc()).first()
+        db.delete(aliquot)
+        code = "8013399100" if schema else "8013399000"
+        db.add(
+            feed.Accessioning(
+                client="MERCK",
+                inventory_code=code,
+                created_on=START + datetime.timedelta(days=90),
+                status="Stored",
+                source="PL",
+                study_name="MK1234",
+                container_type="Cryovial",
+                meta={},
+            )
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    feed.refresh_export_table()
+    assert_matches_feed(feed)
@@ -0,0 +1,27 @@
+from conftest import Base, seed
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def test_feed_queries_use_the_feed_indexes(feed, tmp_path):
+    # With the advised indexes in place no feed query (other than the full
+    # extractions) may read a whole table. The plans are taken on a database
+    # of their own: the other tests' writes can tip SQLite, which has no
+    # statistics here, from one index to another
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    Base.metadata.create_all(engine)
+    seed(sessionmaker(bind=engine)())
+    wanted = [(model.__table__, columns) for model, columns in feed.FEED_INDEXES]
+    feed.create_indexes(engine, feed.missing_indexes(engine, wanted))
+    assert feed.missing_indexes(engine, wanted) == []
+    queries, _ = feed.feed_queries()
+    assert queries
+    with engine.connect() as connection:
+        for name, statement in queries.items():
+            steps = feed.explain(connection, statement, broad=["client"])
+            scans = [
+                step["detail"]
+                for step in steps
+                if step["access"] == "scan" or step["detail"].startswith("SCAN")
+            ]
+            assert scans == [], name
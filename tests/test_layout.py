@@ -0,0 +1,58 @@
+import io
+
+# The header of the baseline feed for the LIMS columns the fixture carries:
+# the joined columns in ALL_COLUMNS order, then the constant columns in the
+# order the feed assigned them
+BASELINE_HEADER = [
+    "Analysis Type",
+    "Assay",
+    "Collection Date",
+    "Created Date",
+    "Current Status",
+    "Destination Facility",
+    "Nucleic Acid Concentration",
+    "Nucleic Acid Volume",
+    "Nucleic Acid Yield",
+    "Origination Facility",
+    "Parent Specimen ID",
+    "Randomization ID",
+    "Received Date",
+    "Screening ID",
+    "Shipped Date",
+    "Site ID",
+    "Specimen Comments",
+    "Specimen ID",
+    "Specimen Type",
+    "Study Number",
+    "Terminal Date",
+    "Vendor Specimen ID",
+    "Collection Time",
+    "Container Type",
+    "Vendor",
+    "Biopsy Accession ID",
+    "Biopsy Anatomic Location",
+    "Biopsy Collection Method",
+    "Fixation Method",
+    "Lesion Type",
+    "Pre/Post Treatment",
+    "Slide Thickness",
+    "Slides Sectioned Date",
+    "Specimen Fixation Date",
+    "Specimen Tissue Category",
+    "Diagnosis Confirmed",
+    "Biopsy Lesion Injection Status",
+    "Time from Tissue Excision to Immersion in Fixative",
+    "Fixation Time",
+    "Institutional Block or Slide ID",
+    "Time Specimen Placed in Fixative",
+    "Number of Slides Submitted",
+    "Type of Biopsy Sample Taken",
+]
+
+
+def test_csv_header_matches_the_baseline(feed):
+    export = feed.join_tables(feed.validate_tables(feed.extract_tables()))
+    stream = io.BytesIO()
+    feed.write_csv(export, stream, layout=feed.BIOTRACS)
+    header = stream.getvalue().decode().splitlines()[0]
+    assert header == ",".join(BASELINE_HEADER)